@@ -0,0 +1,172 @@
+from collections import namedtuple
+
+import numpy as np
+import pandas as pd
+
+# Result of fit_clock(). Sample k of the stream (counting dropped samples, see
+# `positions`) was taken at t0 + k / srate on the LSL clock. Jitter is the
+# distribution of the measured time stamps around that line, in seconds.
+ClockFit = namedtuple('ClockFit', [
+    't0', 'srate', 'nominal_srate', 'drift_ppm', 'positions', 'gap_positions', 'gap_sizes',
+    'jitter_rms', 'jitter_p99', 'jitter_max',
+])
+
+
+MIN_CHUNKS_PER_WINDOW = 100
+
+
+def _rolling_median(values, window):
+    # Median of values[i - window + 1:i + 1]; NaN near the start, where less than
+    # half a window is available
+    return pd.Series(values).rolling(window, min_periods=max(1, window // 2)).median().to_numpy()
+
+
+def _effective_srate(time_stamps, block):
+    # Median slope between the mean time stamps of consecutive blocks of samples.
+    # Averaging over a block cancels chunked (bursty) time stamps, and the median
+    # ignores the few blocks with a gap
+    n_blocks = len(time_stamps) // block
+    if n_blocks < 3:
+        return float((len(time_stamps) - 1) / (time_stamps[-1] - time_stamps[0]))
+
+    block_means = time_stamps[:n_blocks * block].reshape(n_blocks, block).mean(axis=1)
+    return float(block / np.median(np.diff(block_means)))
+
+
+def fit_clock(time_stamps, nominal_srate, gap_threshold=1.5, window_seconds=1.0):
+    """Fit the sample clock of a regularly sampled stream from its time stamps.
+
+    Finds dropped-sample gaps and fits t = t0 + k / srate by least squares over
+    the sample positions k with the gaps counted in. This gives the effective
+    sampling rate (drift against nominal_srate, in ppm) and the residual jitter
+    of the time stamps around the fit.
+
+    A step in the time stamps is a gap when it exceeds `gap_threshold` sample
+    periods and the time stamps stay shifted afterwards: the median lag behind
+    the clock over `window_seconds` on either side of it must differ by at least
+    half a sample. Bursty time stamps (e.g. LSL chunks) don't shift, so they are
+    not mistaken for gaps; the window is rounded to whole chunks for them.
+    """
+    time_stamps = np.asarray(time_stamps, dtype=np.float64)
+    n = len(time_stamps)
+    if n < 2:
+        return ClockFit(time_stamps[0] if n else 0.0, float(nominal_srate), float(nominal_srate), 0.0,
+                        np.arange(n), np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64), 0.0, 0.0, 0.0)
+
+    window = max(1, int(round(window_seconds * nominal_srate)))
+
+    # Chunked time stamps make the lag a sawtooth; a window spanning whole chunks
+    # keeps its median flat. The chunk length is the usual spacing of big steps.
+    # Chunks share their transport delay, so the window spans enough of them to
+    # average it out
+    big_steps = np.flatnonzero(np.diff(time_stamps) * nominal_srate > gap_threshold)
+    if len(big_steps) > 2:
+        spacings = np.bincount(np.diff(big_steps))
+        chunk = int(spacings.argmax())
+        if 1 < chunk <= window and spacings[chunk] >= len(big_steps) // 2:
+            window = chunk * max(MIN_CHUNKS_PER_WINDOW, int(round(window / chunk)))
+
+    srate = _effective_srate(time_stamps, block=10 * window)
+    index = np.arange(n)
+
+    # How many samples each time stamp lags behind where an unbroken clock would put it
+    lag = (time_stamps - time_stamps[0]) * srate - index
+    lag_before = _rolling_median(lag, window)
+    lag_after = _rolling_median(lag[::-1], window)[::-1]
+
+    steps = np.diff(lag)
+    candidates = np.flatnonzero(steps > gap_threshold - 1)
+    with np.errstate(invalid='ignore'):
+        shift = lag_after[candidates + 1] - lag_before[candidates]
+        candidates = candidates[shift >= 0.5]
+
+    # Candidates closer than a window see the same shift; each such group is one
+    # gap at its biggest step, sized by the shift across the whole group
+    group_starts = np.flatnonzero(np.diff(candidates, prepend=-window - 1) > window)
+    group_ends = np.append(group_starts[1:], len(candidates))[:len(group_starts)] - 1
+    group_ids = np.repeat(np.arange(len(group_starts)), group_ends - group_starts + 1)
+    biggest = candidates[np.lexsort((-steps[candidates], group_ids))[group_starts]]
+    sizes = np.round(lag_after[candidates[group_ends] + 1] - lag_before[candidates[group_starts]])
+
+    gaps = biggest[sizes > 0]
+    gap_sizes = sizes[sizes > 0].astype(np.int64)
+
+    gap_sizes = gap_sizes[np.argsort(gaps)]
+    gaps = np.sort(gaps)
+
+    missing = np.zeros(n, dtype=np.int64)
+    missing[gaps + 1] = gap_sizes
+    positions = index + np.cumsum(missing)
+
+    # Least squares line through (position, time stamp)
+    slope, t0 = np.polyfit(positions.astype(np.float64), time_stamps, 1)
+    residuals = time_stamps - (t0 + slope * positions)
+    abs_residuals = np.abs(residuals)
+
+    return ClockFit(
+        t0=float(t0), srate=float(1.0 / slope), nominal_srate=float(nominal_srate),
+        drift_ppm=float((1.0 / slope / nominal_srate - 1.0) * 1e6),
+        positions=positions, gap_positions=positions[gaps] + 1, gap_sizes=gap_sizes,
+        jitter_rms=float(np.sqrt(np.mean(residuals ** 2))),
+        jitter_p99=float(np.percentile(abs_residuals, 99)),
+        jitter_max=float(abs_residuals.max()),
+    )
+
+
+def clock_report(fit):
+    # Summary of a ClockFit for printing or logging, times in milliseconds
+    return {
+        'nominal_srate': fit.nominal_srate,
+        'effective_srate': round(fit.srate, 6),
+        'drift_ppm': round(fit.drift_ppm, 2),
+        'gaps': len(fit.gap_sizes),
+        'missing_samples': int(fit.gap_sizes.sum()),
+        'jitter_rms_ms': round(fit.jitter_rms * 1e3, 3),
+        'jitter_p99_ms': round(fit.jitter_p99 * 1e3, 3),
+        'jitter_max_ms': round(fit.jitter_max * 1e3, 3),
+    }
+
+
+def resample_stream(data, fit, times):
+    """Linearly interpolate (n_channels, n_samples) data at `times` on the LSL clock.
+
+    Samples are placed by the fitted clock rather than their own time stamps, so
+    jitter is removed, and dropped samples are interpolated over. Times outside the
+    stream are NaN. For a lower rate than the stream's, low-pass filter first.
+    """
+    positions = (np.asarray(times, dtype=np.float64) - fit.t0) * fit.srate
+    out = np.full((data.shape[0], len(positions)), np.nan)
+
+    # A little slack for rounding at the ends of the grid
+    inside = (positions > fit.positions[0] - 1e-6) & (positions < fit.positions[-1] + 1e-6)
+    p = np.clip(positions[inside], fit.positions[0], fit.positions[-1])
+
+    # Neighbouring real samples and the weight of the right one
+    right = np.clip(np.searchsorted(fit.positions, p, side='right'), 1, len(fit.positions) - 1)
+    left = right - 1
+    weight = (p - fit.positions[left]) / (fit.positions[right] - fit.positions[left])
+
+    out[:, inside] = data[:, left] * (1.0 - weight) + data[:, right] * weight
+    return out
+
+
+def align_streams(streams, sfreq=None):
+    """Resample several regularly sampled streams onto one uniform time grid.
+
+    `streams` is a list of (data, time_stamps, nominal_srate), with data shaped
+    (n_channels, n_samples). The grid covers the time all streams overlap, at
+    `sfreq` (the highest nominal rate by default). Returns (t_start, sfreq, data,
+    fits): data is all channels stacked on the grid, fits the ClockFit of each stream.
+    """
+    fits = [fit_clock(time_stamps, nominal_srate) for _, time_stamps, nominal_srate in streams]
+    if sfreq is None:
+        sfreq = max(fit.nominal_srate for fit in fits)
+
+    t_start = max(fit.t0 + fit.positions[0] / fit.srate for fit in fits)
+    t_end = min(fit.t0 + fit.positions[-1] / fit.srate for fit in fits)
+    n_times = max(0, int(np.floor((t_end - t_start) * sfreq + 1e-6)) + 1)
+    times = t_start + np.arange(n_times) / sfreq
+
+    data = np.concatenate([resample_stream(stream_data, fit, times)
+                           for (stream_data, _, _), fit in zip(streams, fits)])
+    return t_start, float(sfreq), data, fits
@@ -0,0 +1,201 @@
+import atexit
+import hashlib
+import json
+import os
+import time
+from datetime import datetime
+
+import mne
+import numpy as np
+
+# The cache is opt-in: load_recording() only uses it when asked to, or when this
+# environment variable points at a cache directory
+CACHE_DIR_ENV = 'EEG_CACHE_DIR'
+CACHE_MAX_BYTES_ENV = 'EEG_CACHE_MAX_BYTES'
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser('~'), '.cache', 'eeg_entrainment')
+DEFAULT_MAX_BYTES = 4 * 1024 ** 3
+
+MANIFEST_NAME = 'manifest.json'
+CACHE_VERSION = 1
+
+
+def file_content_hash(file_path, block_size=1 << 20):
+    h = hashlib.blake2b(digest_size=16)
+    with open(file_path, 'rb') as f:
+        while block := f.read(block_size):
+            h.update(block)
+    return h.hexdigest()
+
+
+class RecordingCache:
+    """On-disk cache of decoded recordings.
+
+    Each entry is the signal as a float64 .npy file plus a JSON header with the
+    channels, sampling rate and annotations. Entries are keyed by a hash of the
+    source file contents; the hash itself is remembered per (path, size, mtime) so
+    unchanged files are never re-hashed. Hits are opened as copy-on-write memory
+    maps, so samples are paged in on demand and in-place operations such as
+    Raw.filter() never touch the cached file; get(..., preload=True) reads them
+    into memory instead.
+
+    The least recently used entries are evicted once the cache grows over max_bytes.
+    Use times and new hashes are kept in memory and written out with the next
+    put() or at close(), so a run of hits doesn't rewrite the manifest each time.
+    """
+
+    def __init__(self, cache_dir=None, max_bytes=None):
+        self.cache_dir = cache_dir or os.environ.get(CACHE_DIR_ENV) or DEFAULT_CACHE_DIR
+        self.max_bytes = int(max_bytes or os.environ.get(CACHE_MAX_BYTES_ENV) or DEFAULT_MAX_BYTES)
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+        self.manifest_path = os.path.join(self.cache_dir, MANIFEST_NAME)
+        self.manifest = self._load_manifest()
+        self.dirty = False
+
+    def _load_manifest(self):
+        try:
+            with open(self.manifest_path) as f:
+                manifest = json.load(f)
+            if manifest.get('version') == CACHE_VERSION:
+                return manifest
+        except (OSError, ValueError):
+            pass
+
+        return {'version': CACHE_VERSION, 'files': {}, 'entries': {}}
+
+    def _save_manifest(self):
+        tmp_path = self.manifest_path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(self.manifest, f)
+        os.replace(tmp_path, self.manifest_path)
+
+    def _paths(self, key):
+        base = os.path.join(self.cache_dir, key)
+        return base + '.npy', base + '.json'
+
+    def key(self, file_path):
+        abs_path = os.path.abspath(file_path)
+        stat = os.stat(abs_path)
+        known = self.manifest['files'].get(abs_path)
+        if known and known['size'] == stat.st_size and known['mtime_ns'] == stat.st_mtime_ns:
+            return known['hash']
+
+        content_hash = file_content_hash(abs_path)
+        self.manifest['files'][abs_path] = {
+            'size': stat.st_size,
+            'mtime_ns': stat.st_mtime_ns,
+            'hash': content_hash,
+        }
+        self.dirty = True
+
+        return content_hash
+
+    def get(self, file_path, preload=False):
+        key = self.key(file_path)
+        if key not in self.manifest['entries']:
+            return None
+
+        data_path, header_path = self._paths(key)
+        try:
+            with open(header_path) as f:
+                header = json.load(f)
+            data = np.load(data_path, mmap_mode=None if preload else 'c')
+        except (OSError, ValueError):
+            del self.manifest['entries'][key]
+            self.dirty = True
+            return None
+
+        self.manifest['entries'][key]['last_used'] = time.time()
+        self.dirty = True
+
+        info = mne.create_info(header['ch_names'], header['sfreq'], ch_types=header['ch_types'], verbose=False)
+        raw = mne.io.RawArray(data, info, verbose=False)
+        if header['meas_date'] is not None:
+            raw.set_meas_date(datetime.fromisoformat(header['meas_date']))
+
+        annotations = header['annotations']
+        raw.set_annotations(mne.Annotations(
+            annotations['onset'], annotations['duration'], annotations['description'],
+            orig_time=raw.info['meas_date'],
+        ))
+
+        return raw
+
+    def put(self, file_path, raw):
+        key = self.key(file_path)
+        data_path, header_path = self._paths(key)
+
+        meas_date = raw.info['meas_date']
+        header = {
+            'source': os.path.abspath(file_path),
+            'ch_names': raw.ch_names,
+            'ch_types': raw.get_channel_types(),
+            'sfreq': raw.info['sfreq'],
+            'meas_date': meas_date.isoformat() if meas_date is not None else None,
+            'annotations': {
+                # Stored relative to the first sample, like load_recording() returns them
+                'onset': (raw.annotations.onset - raw.first_time if meas_date is not None
+                          else raw.annotations.onset).tolist(),
+                'duration': raw.annotations.duration.tolist(),
+                'description': raw.annotations.description.tolist(),
+            },
+        }
+
+        # Write to temporary names first, so a crash never leaves a half-written entry
+        with open(data_path + '.tmp', 'wb') as f:
+            np.save(f, raw.get_data())
+        with open(header_path + '.tmp', 'w') as f:
+            json.dump(header, f)
+        os.replace(data_path + '.tmp', data_path)
+        os.replace(header_path + '.tmp', header_path)
+
+        self.manifest['entries'][key] = {
+            'bytes': os.path.getsize(data_path) + os.path.getsize(header_path),
+            'last_used': time.time(),
+        }
+        self._evict(keep=key)
+        self.flush()
+
+    def flush(self):
+        if self.dirty:
+            self._save_manifest()
+            self.dirty = False
+
+    def close(self):
+        self.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _evict(self, keep):
+        entries = self.manifest['entries']
+        total = sum(entry['bytes'] for entry in entries.values())
+
+        for key in sorted(entries, key=lambda k: entries[k]['last_used']):
+            if total <= self.max_bytes:
+                break
+            if key == keep:
+                continue
+
+            for path in self._paths(key):
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+            total -= entries.pop(key)['bytes']
+
+
+_shared = {}
+
+
+def shared_cache(cache_dir=None):
+    # One RecordingCache per directory for the whole process, so the use times of
+    # many hits are written out once (on the next put() or at exit)
+    cache_dir = cache_dir or os.environ.get(CACHE_DIR_ENV) or DEFAULT_CACHE_DIR
+    if cache_dir not in _shared:
+        _shared[cache_dir] = RecordingCache(cache_dir)
+        atexit.register(_shared[cache_dir].close)
+    return _shared[cache_dir]
@@ -0,0 +1,172 @@
+from collections import namedtuple
+
+import numpy as np
+
+# OpenBCI Cyton full scale at the default gain of 24: +-4.5 V / 24
+RAIL_VOLTS = 4.5 / 24
+# The OpenBCI GUI calls a channel railed above 90% of full scale
+RAIL_LEVEL = 0.9
+
+QUALITY_BLOCK_SECONDS = 60
+
+# Default thresholds of bad_channels()
+MAX_FLAT_FRACTION = 0.9
+MIN_STD = 0.1e-6
+MAX_RAIL_FRACTION = 0.1
+MAX_LINE_NOISE_RATIO = 1.0
+LINE_NOISE_FACTOR = 10.0
+
+# Per-channel results of ChannelQualityMeter. flat_fraction is the share of
+# samples equal to the previous one, rail_fraction the share near the ADC limits,
+# line_noise_ratio the power within 1 Hz of the line frequency over the power in
+# 1-45 Hz. NaN where there wasn't enough data
+ChannelQuality = namedtuple('ChannelQuality', [
+    'ch_names', 'n_samples', 'flat_fraction', 'std', 'rail_fraction', 'line_noise_ratio',
+])
+
+
+class ChannelQualityMeter:
+    """Channel quality statistics accumulated over (n_channels, n_samples) chunks.
+
+    Every chunk is looked at once, with whole-array operations, and only running
+    sums are kept, so memory doesn't grow with the recording: the same meter works
+    on blocks of a lazy recording and on live chunks. Spectra are taken over
+    `segment_seconds` segments; samples that don't fill one are carried over to
+    the next chunk. With `half_life_seconds`, older samples weigh exponentially
+    less, so a live monitor follows the current state of the electrodes.
+    """
+
+    def __init__(self, sfreq, n_channels, line_freq=50.0, rail_volts=RAIL_VOLTS, segment_seconds=1.0,
+                 half_life_seconds=None):
+        self.sfreq = sfreq
+        self.n_channels = n_channels
+        self.rail_volts = rail_volts
+        self.half_life_seconds = half_life_seconds
+
+        self.nperseg = max(2, int(round(segment_seconds * sfreq)))
+        self.window = np.hanning(self.nperseg)
+        freqs = np.fft.rfftfreq(self.nperseg, 1.0 / sfreq)
+        self.line_bins = np.abs(freqs - line_freq) <= 1.0 if line_freq is not None else np.zeros(len(freqs), bool)
+        self.band_bins = (freqs >= 1.0) & (freqs <= 45.0)
+
+        self.reset()
+
+    def reset(self):
+        shape = (self.n_channels,)
+        self.weight = 0.0
+        self.n_samples = 0
+        # Sums of samples relative to the first one, which keeps a big DC offset
+        # from swamping the variance
+        self.reference = None
+        self.sum = np.zeros(shape)
+        self.sum_sq = np.zeros(shape)
+        self.flat = np.zeros(shape)
+        self.railed = np.zeros(shape)
+        self.line_power = np.zeros(shape)
+        self.band_power = np.zeros(shape)
+        self.last = None
+        self.pending = np.zeros((self.n_channels, 0))
+
+    def _decay(self, n):
+        if self.half_life_seconds is None:
+            return
+        factor = 0.5 ** (n / (self.half_life_seconds * self.sfreq))
+        self.weight *= factor
+        for total in (self.sum, self.sum_sq, self.flat, self.railed, self.line_power, self.band_power):
+            total *= factor
+
+    def update(self, chunk):
+        chunk = np.asarray(chunk, dtype=np.float64)
+        n = chunk.shape[-1]
+        if n == 0:
+            return
+
+        self._decay(n)
+        if self.reference is None:
+            self.reference = chunk[:, :1].copy()
+
+        centred = chunk - self.reference
+        self.weight += n
+        self.n_samples += n
+        self.sum += centred.sum(axis=1)
+        self.sum_sq += np.einsum('ij,ij->i', centred, centred)
+
+        # Compared with the previous sample, across chunk boundaries too; the very
+        # first sample has none
+        self.flat += (chunk[:, 1:] == chunk[:, :-1]).sum(axis=1)
+        if self.last is not None:
+            self.flat += (chunk[:, :1] == self.last)[:, 0]
+        self.last = chunk[:, -1:].copy()
+
+        if self.rail_volts is not None:
+            self.railed += (np.abs(chunk) >= RAIL_LEVEL * self.rail_volts).sum(axis=1)
+
+        self._update_spectra(chunk)
+
+    def _update_spectra(self, chunk):
+        samples = np.concatenate([self.pending, chunk], axis=1) if self.pending.shape[1] else chunk
+        n_segments = samples.shape[1] // self.nperseg
+        self.pending = samples[:, n_segments * self.nperseg:].copy()
+        if n_segments == 0:
+            return
+
+        segments = samples[:, :n_segments * self.nperseg].reshape(self.n_channels, n_segments, self.nperseg)
+        segments = (segments - segments.mean(axis=2, keepdims=True)) * self.window
+        power = np.abs(np.fft.rfft(segments, axis=2)) ** 2
+        self.line_power += power[:, :, self.line_bins].sum(axis=(1, 2))
+        self.band_power += power[:, :, self.band_bins].sum(axis=(1, 2))
+
+    def result(self, ch_names=None):
+        ch_names = list(ch_names) if ch_names is not None else [str(i) for i in range(self.n_channels)]
+        with np.errstate(invalid='ignore', divide='ignore'):
+            mean = self.sum / self.weight
+            variance = np.maximum(self.sum_sq / self.weight - mean ** 2, 0.0)
+            return ChannelQuality(
+                ch_names=ch_names,
+                n_samples=self.n_samples,
+                flat_fraction=self.flat / self.weight,
+                std=np.sqrt(variance),
+                rail_fraction=self.railed / self.weight if self.rail_volts is not None
+                else np.full(self.n_channels, np.nan),
+                line_noise_ratio=self.line_power / self.band_power,
+            )
+
+
+def channel_quality(raw, picks=None, block_seconds=QUALITY_BLOCK_SECONDS, **meter_kwargs):
+    # One pass over the recording, a block at a time, so lazy and memory-mapped
+    # recordings are never read into memory as a whole
+    ch_names = list(picks) if picks is not None else raw.ch_names
+    meter = ChannelQualityMeter(raw.info['sfreq'], len(ch_names), **meter_kwargs)
+
+    block_size = max(1, int(block_seconds * raw.info['sfreq']))
+    for start in range(0, raw.n_times, block_size):
+        meter.update(raw.get_data(picks=ch_names, start=start, stop=start + block_size))
+
+    return meter.result(ch_names)
+
+
+def bad_channels(quality, max_flat_fraction=MAX_FLAT_FRACTION, min_std=MIN_STD,
+                 max_rail_fraction=MAX_RAIL_FRACTION, max_line_noise_ratio=MAX_LINE_NOISE_RATIO,
+                 line_noise_factor=LINE_NOISE_FACTOR):
+    """Names of the channels that fail a check, with the reasons for each.
+
+    'flat' is a channel stuck at one value (disconnected or dead), 'railed' one
+    that spends too much time at the ADC limits, 'line noise' one dominated by
+    mains hum (typically a loose electrode). Unshielded recordings have some hum
+    on every channel, so a channel only counts as noisy if its line noise ratio is
+    also `line_noise_factor` times the median over all channels.
+    """
+    bad = {}
+    with np.errstate(invalid='ignore'):
+        typical_line_noise = np.nanmedian(quality.line_noise_ratio) if np.isfinite(quality.line_noise_ratio).any() \
+            else np.nan
+        checks = [
+            ('flat', (quality.flat_fraction > max_flat_fraction) | (quality.std < min_std)),
+            ('railed', quality.rail_fraction > max_rail_fraction),
+            ('line noise', (quality.line_noise_ratio > max_line_noise_ratio)
+             & (quality.line_noise_ratio > line_noise_factor * typical_line_noise)),
+        ]
+    for reason, failed in checks:
+        for channel in np.flatnonzero(failed):
+            bad.setdefault(quality.ch_names[channel], []).append(reason)
+    return bad
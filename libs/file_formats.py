@@ -1,114 +1,559 @@
-import math
+import os
 
 import mne
 import numpy as np
 import pandas as pd
-import pyxdf
 
-# A function to load data in Daniel Ingram's format here: https://osf.io/srfnz/
-# Might not work for Muse data coming from other sources
-def load_muse_csv(file_path):
-    def estimate_sfreq(timestamps):
-        """Estimate sampling frequency by bucketing data for each second."""
-        bucket_counts = timestamps.dt.floor('s').value_counts()
+try:
+    import pyarrow as pa
+    from pyarrow import csv as pa_csv
+except ImportError:
+    pa = pa_csv = None
+
+from libs.alignment import align_streams
+from libs.cache import CACHE_DIR_ENV, shared_cache
+from libs.markers import decode_markers, markers_to_annotations
+from libs.xdf import XDFFile
+
+# Lazy (preload=False) recordings remember the byte offset of every LINE_INDEX_STEP-th
+# line, so a segment read seeks close to its first row instead of parsing from the top
+LINE_INDEX_STEP = 4096
+
+
+def _index_lines(file_path, step=LINE_INDEX_STEP, block_size=1 << 24):
+    """Return (n_lines, offsets), where offsets[k] is the byte offset of line k * step."""
+    offsets = [0]
+    n_lines = 0
+    pos = 0
+    last_byte = b'\n'
+    with open(file_path, 'rb') as f:
+        while block := f.read(block_size):
+            newlines = np.flatnonzero(np.frombuffer(block, dtype=np.uint8) == ord('\n'))
+            # Line number of the line that starts right after each newline
+            line_numbers = n_lines + 1 + np.arange(len(newlines))
+            offsets.extend((pos + newlines[line_numbers % step == 0] + 1).tolist())
+            n_lines += len(newlines)
+            pos += len(block)
+            last_byte = block[-1:]
+
+    if last_byte != b'\n':
+        n_lines += 1
+
+    return n_lines, offsets
+
+
+def _read_csv_rows(file_path, line_offsets, first_line, n_rows, usecols, **kwargs):
+    # Rows [first_line, first_line + n_rows) of a headerless read, as a (n_rows, len(usecols)) array
+    k = first_line // LINE_INDEX_STEP
+    with open(file_path, 'rb') as f:
+        f.seek(line_offsets[k])
+        df = pd.read_csv(f, header=None, skiprows=first_line - k * LINE_INDEX_STEP, nrows=n_rows,
+                         usecols=usecols, engine='c', **kwargs)
+    return df[usecols].to_numpy(dtype=np.float64)
+
+
+def _read_lazy_segment(data, idx, cals, mult, n_channels, read):
+    # Shared body of BaseRaw._read_segment_file(): read(channels) returns the
+    # requested (len(channels), stop - start) block in volts
+    channels = np.arange(n_channels)[idx]
+    if mult is None:
+        np.multiply(read(channels), cals, out=data)
+    else:
+        data[:] = mult @ read(channels)
+
+
+def estimate_sfreq(times, lag=256):
+    """Estimate the sampling frequency from sample time stamps (in seconds).
+
+    Uses the median spacing over `lag` samples rather than between neighbours, so
+    millisecond-quantized time stamps don't bias it, while dropped-sample gaps only
+    affect the few windows that straddle them.
+    """
+    lag = max(1, min(lag, len(times) - 1))
+    spacing = np.median((times[lag:] - times[:-lag]) / lag)
+    return float(np.round(1.0 / spacing))
+
+
+def fill_gaps(data, times, sfreq, threshold=1.5):
+    """Put samples with dropped-sample gaps back onto a uniform grid.
+
+    A gap is a time step longer than `threshold` sample periods. Missing samples are
+    linearly interpolated. Returns (data, gap_onsets, gap_durations), with onsets
+    in seconds from the first sample.
+    """
+    steps = np.diff(times) * sfreq
+    n_missing = np.where(steps > threshold, np.round(steps).astype(np.int64) - 1, 0)
+    if not np.any(n_missing):
+        return data, np.zeros(0), np.zeros(0)
+
+    positions = np.concatenate(([0], np.cumsum(1 + n_missing)))
+    filled = np.empty((data.shape[0], positions[-1] + 1))
+    filled[:, positions] = data
+
+    missing = np.ones(filled.shape[1], dtype=bool)
+    missing[positions] = False
+    missing_idx = np.flatnonzero(missing)
+    for ch in range(data.shape[0]):
+        filled[ch, missing_idx] = np.interp(missing_idx, positions, data[ch])
+
+    gaps = np.flatnonzero(n_missing)
+    return filled, (positions[gaps] + 1) / sfreq, n_missing[gaps] / sfreq
+
+
+MUSE_CH_NAMES = ['TP9', 'AF7', 'AF8', 'TP10']
+
+
+def _gap_annotations(gap_onsets, gap_durations):
+    # Interpolated stretches are marked so that annotation-aware MNE functions can skip them
+    return mne.Annotations(gap_onsets, gap_durations, ['BAD_gap'] * len(gap_onsets))
+
+
+class RawMuse(mne.io.BaseRaw):
+    """Muse CSV recording read on demand, see load_muse_csv(preload=False).
+
+    Only the time stamps are parsed up front, to place the samples on a uniform
+    grid. Segment reads parse just the rows they cover and interpolate dropped
+    samples exactly like fill_gaps().
+    """
+
+    def __init__(self, file_path):
+        raw_columns = ['RAW_' + name for name in MUSE_CH_NAMES]
+        columns = pd.read_csv(file_path, nrows=0).columns.tolist()
+
+        # Mind Monitor writes all RAW columns of a sample together, so the first one
+        # tells sample rows from event rows
+        df = pd.read_csv(file_path, usecols=['TimeStamp', raw_columns[0]], engine='pyarrow' if pa is not None else 'c')
+        df = df.dropna(subset=raw_columns[:1])
 
-        avg_count = bucket_counts.mean()
-        sfreq = math.ceil(avg_count)
+        timestamps = pd.to_datetime(df['TimeStamp'], format='ISO8601')
+        times = (timestamps - timestamps.iloc[0]).dt.total_seconds().to_numpy()
+        sfreq = estimate_sfreq(times)
 
-        return sfreq
+        steps = np.diff(times) * sfreq
+        n_missing = np.where(steps > 1.5, np.round(steps).astype(np.int64) - 1, 0)
+        positions = np.concatenate(([0], np.cumsum(1 + n_missing)))
+        _, line_offsets = _index_lines(file_path)
 
-    # Define the schema for the CSV file
-    schema = {
-        'TimeStamp': str,
-        'RAW_TP9': float,
-        'RAW_AF7': float,
-        'RAW_AF8': float,
-        'RAW_TP10': float
-    }
+        raw_extras = {
+            'usecols': [columns.index(column) for column in raw_columns],
+            'line_offsets': line_offsets,
+            # File data row and grid position of each sample
+            'rows': df.index.to_numpy(),
+            'positions': positions,
+        }
+        info = mne.create_info(ch_names=MUSE_CH_NAMES, sfreq=sfreq, ch_types='eeg', verbose=False)
+        super().__init__(info, preload=False, last_samps=[int(positions[-1])],
+                         filenames=[file_path], raw_extras=[raw_extras], verbose=False)
 
-    # Read the CSV file with the specified schema
-    df = pd.read_csv(file_path, dtype=schema)
+        gaps = np.flatnonzero(n_missing)
+        if len(gaps):
+            self.set_annotations(_gap_annotations((positions[gaps] + 1) / sfreq, n_missing[gaps] / sfreq))
 
-    ch_names = ['TP9', 'AF7', 'AF8', 'TP10']
-    data = df[['RAW_' + name for name in ch_names]].values.T
+    def _read_segment_file(self, data, idx, fi, start, stop, cals, mult):
+        extras = self._raw_extras[fi]
+        positions = extras['positions']
 
-    # Estimate sampling frequency from timestamps
-    timestamps = df['TimeStamp'].str.slice(0, 24)  # Truncate the timestamps
-    timestamps = pd.to_datetime(timestamps, format='%Y-%m-%d %H:%M:%S.%f')
+        # Samples on both sides of [start, stop), so the grid points in between can be interpolated
+        lo = max(np.searchsorted(positions, start, side='right') - 1, 0)
+        hi = min(np.searchsorted(positions, stop - 1, side='left') + 1, len(positions))
+        rows = extras['rows'][lo:hi]
+        grid = np.arange(start, stop)
 
+        def read(channels):
+            # +1 for the column header line
+            values = _read_csv_rows(self._filenames[fi], extras['line_offsets'], rows[0] + 1, rows[-1] - rows[0] + 1,
+                                    [extras['usecols'][ch] for ch in channels])
+            values = values[rows - rows[0]]
+            block = np.empty((len(channels), len(grid)))
+            for i in range(len(channels)):
+                block[i] = np.interp(grid, positions[lo:hi], values[:, i]) * 1e-6
+            return block
 
-    sfreq = estimate_sfreq(timestamps)
-    assert sfreq == 256, f'Unexpected sampling frequency: {sfreq}'
+        _read_lazy_segment(data, idx, cals, mult, len(MUSE_CH_NAMES), read)
+
+
+# A function to load data in Daniel Ingram's format here: https://osf.io/srfnz/
+# Might not work for Muse data coming from other sources
+def load_muse_csv(file_path, preload=True):
+    if not preload:
+        return RawMuse(file_path)
+
+    ch_names = MUSE_CH_NAMES
+    raw_columns = ['RAW_' + name for name in ch_names]
+
+    # Only read the time stamps and the raw EEG columns, with pyarrow's multithreaded parser if available
+    df = pd.read_csv(file_path, usecols=['TimeStamp'] + raw_columns, engine='pyarrow' if pa is not None else 'c')
+
+    # Rows without raw EEG are Mind Monitor events (blinks, jaw clenches, ...), not samples
+    df = df.dropna(subset=raw_columns)
+
+    timestamps = pd.to_datetime(df['TimeStamp'], format='ISO8601')
+    times = (timestamps - timestamps.iloc[0]).dt.total_seconds().to_numpy()
+    data = df[raw_columns].to_numpy(dtype=np.float64).T
+
+    sfreq = estimate_sfreq(times)
+    data, gap_onsets, gap_durations = fill_gaps(data, times, sfreq)
 
     info = mne.create_info(ch_names=ch_names, sfreq=sfreq, ch_types=['eeg'] * len(ch_names), verbose=False)
     raw = mne.io.RawArray(data * 1e-6, info, verbose=False)
 
+    if len(gap_onsets):
+        raw.set_annotations(_gap_annotations(gap_onsets, gap_durations))
+
     return raw
 
 
-def load_openbci_txt(file_path):
-    # TODO: unhardcode the sampling frequency and channel names
-    sfreq = 250  # Sampling frequency of the OpenBCI data
-    ch_names = ['EXG Channel 0', 'EXG Channel 1', 'EXG Channel 2', 'EXG Channel 3',
-                'EXG Channel 4', 'EXG Channel 5', 'EXG Channel 6', 'EXG Channel 7']
+OPENBCI_CHUNK_ROWS = 1_000_000
+
+
+def read_openbci_header(file_path):
+    """Parse the '%' header block and the column header line of an OpenBCI GUI text export.
+
+    Returns (metadata, columns, n_header_lines). `columns` is None for old exports
+    that have no column header line.
+    """
+    metadata = {}
+    columns = None
+    n_header_lines = 0
+
+    with open(file_path, 'r', errors='replace') as f:
+        for line in f:
+            if line.startswith('%'):
+                n_header_lines += 1
+                key, sep, value = line[1:].partition('=')
+                if sep:
+                    metadata[key.strip()] = value.strip()
+                continue
+
+            if line.strip() and not line.lstrip()[0].isdigit() and line.lstrip()[0] != '-':
+                columns = [column.strip() for column in line.split(',')]
+                n_header_lines += 1
+            break
+
+    return metadata, columns, n_header_lines
+
+
+def _count_lines(file_path, block_size=1 << 24):
+    n_lines = 0
+    with open(file_path, 'rb') as f:
+        while block := f.read(block_size):
+            n_lines += block.count(b'\n')
+    return n_lines + 1
+
+
+def _iter_openbci_blocks(file_path, n_header_lines, usecols, chunk_rows):
+    # pyarrow's streaming CSV reader parses on several threads; pandas' C engine is the fallback
+    if pa_csv is not None:
+        reader = pa_csv.open_csv(
+            file_path,
+            read_options=pa_csv.ReadOptions(skip_rows=n_header_lines, autogenerate_column_names=True),
+            convert_options=pa_csv.ConvertOptions(include_columns=[f'f{i}' for i in usecols],
+                                                  column_types={f'f{i}': pa.float64() for i in usecols}),
+        )
+        for batch in reader:
+            yield np.column_stack([batch.column(f'f{i}').to_numpy(zero_copy_only=False) for i in usecols])
+        return
+
+    reader = pd.read_csv(file_path, skiprows=n_header_lines, header=None, usecols=usecols,
+                         skipinitialspace=True, engine='c', dtype=np.float64, chunksize=chunk_rows)
+    for chunk in reader:
+        yield chunk[usecols].to_numpy()
+
+
+def _openbci_layout(file_path):
+    metadata, columns, n_header_lines = read_openbci_header(file_path)
+
+    # '%Sample Rate = 250 Hz' (older GUI versions write '250.0 Hz')
+    sfreq = float(metadata.get('Sample Rate', '250').split()[0])
+    n_channels = int(metadata.get('Number of channels', 8))
+
+    if columns is not None:
+        usecols = [i for i, column in enumerate(columns) if column.startswith('EXG Channel')]
+        ch_names = [columns[i] for i in usecols]
+    else:
+        # Old exports: sample index first, then the EXG channels
+        usecols = list(range(1, n_channels + 1))
+        ch_names = [f'EXG Channel {i}' for i in range(n_channels)]
 
-    # Read data from the text file
-    data = np.loadtxt(file_path, delimiter=',', skiprows=5, usecols=range(1, 9))
-    
-    # Create MNE RawArray object
     info = mne.create_info(ch_names, sfreq, ch_types='eeg', verbose=False)
-    raw = mne.io.RawArray(data.T / 1e6, info, verbose=False)  # Convert to volts
+    if 'Board' in metadata:
+        # e.g. 'OpenBCI_GUI$BoardCytonSerialDaisy'
+        info['device_info'] = {'type': 'OpenBCI', 'model': metadata['Board'].split('$')[-1]}
+
+    return info, usecols, n_header_lines
+
+
+class RawOpenBCI(mne.io.BaseRaw):
+    """OpenBCI GUI text export read on demand, see load_openbci_txt(preload=False)."""
+
+    def __init__(self, file_path):
+        info, usecols, n_header_lines = _openbci_layout(file_path)
+        n_lines, line_offsets = _index_lines(file_path)
+
+        raw_extras = {'usecols': usecols, 'n_header_lines': n_header_lines, 'line_offsets': line_offsets}
+        super().__init__(info, preload=False, last_samps=[n_lines - n_header_lines - 1],
+                         filenames=[file_path], raw_extras=[raw_extras], verbose=False)
+
+    def _read_segment_file(self, data, idx, fi, start, stop, cals, mult):
+        extras = self._raw_extras[fi]
+
+        def read(channels):
+            values = _read_csv_rows(self._filenames[fi], extras['line_offsets'], extras['n_header_lines'] + start,
+                                    stop - start, [extras['usecols'][ch] for ch in channels], skipinitialspace=True)
+            return values.T * 1e-6
+
+        _read_lazy_segment(data, idx, cals, mult, len(extras['usecols']), read)
+
+
+def load_openbci_txt(file_path, chunk_rows=OPENBCI_CHUNK_ROWS, preload=True):
+    if not preload:
+        return RawOpenBCI(file_path)
+
+    info, usecols, n_header_lines = _openbci_layout(file_path)
+
+    # Read the numeric body in blocks straight into a preallocated buffer, in volts
+    max_rows = _count_lines(file_path) - n_header_lines
+    data = np.empty((len(usecols), max(max_rows, 0)))
+    n_rows = 0
+    for block in _iter_openbci_blocks(file_path, n_header_lines, usecols, chunk_rows):
+        np.multiply(block.T, 1e-6, out=data[:, n_rows:n_rows + len(block)])
+        n_rows += len(block)
+
+    raw = mne.io.RawArray(data[:, :n_rows], info, verbose=False)
 
     return raw
 
 
-def load_raw_xdf(file_path):
-    streams, _ = pyxdf.load_xdf(file_path)
-    eeg_stream = None
-    markers_stream = None
+def _crop_sample_range(sfreq, n_samples, tmin, tmax):
+    # Same rounding as Raw.crop(tmin, tmax), which includes the sample at tmax
+    start = 0 if tmin is None else int(round(tmin * sfreq))
+    stop = n_samples if tmax is None else int(round(tmax * sfreq)) + 1
+    return max(0, start), min(n_samples, stop)
+
+
+class RawXDF(mne.io.BaseRaw):
+    """EEG stream of an XDF file read on demand, see load_raw_xdf(preload=False).
+
+    Segment reads only decode the chunks covering them, found through the sidecar
+    chunk index, and only copy out the picked channels.
+    """
+
+    def __init__(self, xdf, stream_id, info):
+        raw_extras = {'xdf': xdf, 'stream_id': stream_id, 'n_channels': info['nchan']}
+        super().__init__(info, preload=False, last_samps=[xdf.n_samples(stream_id) - 1],
+                         filenames=[xdf.file_path], raw_extras=[raw_extras], verbose=False)
+
+    def _read_segment_file(self, data, idx, fi, start, stop, cals, mult):
+        extras = self._raw_extras[fi]
+
+        def read(channels):
+            values, _ = extras['xdf'].read_numeric(extras['stream_id'], scale=1e-6, start=start, stop=stop,
+                                                   channels=channels)
+            return values
 
-    for stream in streams:
-        stream_type = stream['info']['type'][0]
+        _read_lazy_segment(data, idx, cals, mult, extras['n_channels'], read)
+
+
+def _find_xdf_streams(xdf):
+    # The last EEG and the last marker stream
+    eeg_stream_id = None
+    markers_stream_id = None
+
+    for stream_id, header in xdf.headers.items():
+        stream_type = header['info']['type'][0]
         if stream_type.upper() == 'EEG':
-            eeg_stream = stream
+            eeg_stream_id = stream_id
         elif stream_type == 'Markers':
-            markers_stream = stream        
+            markers_stream_id = stream_id
+
+    if eeg_stream_id is None:
+        raise ValueError('No EEG stream found in the XDF file')
+
+    return eeg_stream_id, markers_stream_id
+
+
+def load_xdf_markers(file_path):
+    """Decode the marker stream of an XDF file, see libs.markers.decode_markers().
+
+    Adds an 'onset' column in seconds from the first EEG sample, the time base of
+    load_raw_xdf() annotations. Only the marker chunks are decoded. Use
+    libs.markers.trial_table() for per-trial fields of run_trials.py sessions.
+    """
+    xdf = XDFFile(file_path, use_index=True)
+    eeg_stream_id, markers_stream_id = _find_xdf_streams(xdf)
+    if markers_stream_id is None:
+        return decode_markers([], []).assign(onset=np.zeros(0))
+
+    markers = decode_markers(*xdf.read_strings(markers_stream_id))
+    markers.insert(1, 'onset', markers['time'] - xdf.first_timestamp(eeg_stream_id))
+    return markers
+
+
+def _xdf_channel_names(xdf, stream_id):
+    channels = xdf.stream_info(stream_id)['desc'][0]['channels'][0]['channel']
+    return [ch_desc['label'][0] for ch_desc in channels]
+
+
+def load_xdf_session(file_path, stream_ids=None, sfreq=None, marker_events=None):
+    """Load the EEG streams of an XDF file onto one drift-corrected timeline.
 
-    if eeg_stream is None:
+    Each stream's sample clock is fitted from its (clock-synchronized, not
+    dejittered) time stamps with libs.alignment.fit_clock(). That finds dropped
+    samples and the effective sampling rate. The streams are then resampled onto a
+    common uniform grid at `sfreq` (the highest nominal rate by default) covering
+    the time they overlap. Interpolated gaps get BAD_gap annotations and markers are
+    annotated on the same timeline.
+
+    `stream_ids` defaults to all EEG streams. Channel names that appear in more
+    than one stream are prefixed with the stream name. Returns (raw, fits), where
+    fits maps stream names to libs.alignment.ClockFit (see clock_report()).
+    """
+    return _load_xdf_session(XDFFile(file_path, dejitter_timestamps=False), stream_ids, sfreq, marker_events)
+
+
+def _load_xdf_session(xdf, stream_ids, sfreq, marker_events):
+    if stream_ids is None:
+        stream_ids = [stream_id for stream_id, header in xdf.headers.items()
+                      if header['info']['type'][0].upper() == 'EEG']
+    if not stream_ids:
         raise ValueError('No EEG stream found in the XDF file')
-    
-    channel_descs = eeg_stream['info']['desc'][0]['channels'][0]["channel"]
+
+    streams = []
+    names = []
+    ch_names = []
+    for stream_id in stream_ids:
+        info = xdf.stream_info(stream_id)
+        data, time_stamps = xdf.read_numeric(stream_id, scale=1e-6)
+        streams.append((data, time_stamps, float(info['nominal_srate'][0])))
+        names.append(info['name'][0])
+        ch_names.append(_xdf_channel_names(xdf, stream_id))
+
+    all_names = [name for stream_ch_names in ch_names for name in stream_ch_names]
+    if len(set(all_names)) < len(all_names):
+        all_names = [f'{name}:{ch_name}' for name, stream_ch_names in zip(names, ch_names) for ch_name in stream_ch_names]
+
+    t_start, sfreq, data, fits = align_streams(streams, sfreq=sfreq)
+    info = mne.create_info(all_names, sfreq, ch_types='eeg', verbose=False)
+    raw = mne.io.RawArray(data, info, verbose=False)
+
+    annotations = mne.Annotations([], [], [])
+    _, markers_stream_id = _find_xdf_streams(xdf)
+    if markers_stream_id is not None:
+        markers = decode_markers(*xdf.read_strings(markers_stream_id))
+        annotations = markers_to_annotations(markers, t_start, events=marker_events)
+
+    for fit in fits:
+        gap_onsets = fit.t0 + fit.gap_positions / fit.srate - t_start
+        annotations.append(gap_onsets, fit.gap_sizes / fit.srate, ['BAD_gap'] * len(gap_onsets))
+    raw.set_annotations(annotations)
+
+    return raw, dict(zip(names, fits))
+
+
+def load_raw_xdf(file_path, tmin=None, tmax=None, preload=True, marker_events=None, align=False):
+    # A time range is served from the sidecar chunk index, so only the chunks
+    # covering it get decoded. The result is the same as load_raw_xdf(...).crop(tmin, tmax)
+    # marker_events restricts the annotations made from JSON markers to those event types.
+    # align=True puts the samples on their fitted, drift-corrected clock (see load_xdf_session)
+    windowed = tmin is not None or tmax is not None
+
+    if align:
+        xdf = XDFFile(file_path, dejitter_timestamps=False)
+        eeg_stream_id, _ = _find_xdf_streams(xdf)
+        raw, _ = _load_xdf_session(xdf, [eeg_stream_id], None, marker_events)
+        if windowed:
+            raw.crop(tmin=tmin or 0.0, tmax=tmax)
+        return raw
+
+    xdf = XDFFile(file_path, use_index=windowed or not preload)
+    eeg_stream_id, markers_stream_id = _find_xdf_streams(xdf)
+
+    eeg_info = xdf.stream_info(eeg_stream_id)
+    channel_descs = eeg_info['desc'][0]['channels'][0]["channel"]
     assert all(ch_desc['type'][0].upper() == 'EEG' for ch_desc in channel_descs)
 
-    ch_names = [ch_desc["label"][0] for ch_desc in channel_descs]
-    
-    sfreq = eeg_stream['info']['nominal_srate'][0]
-    data = 1e-6 * eeg_stream['time_series'].T
+    ch_names = _xdf_channel_names(xdf, eeg_stream_id)
 
+    sfreq = float(eeg_info['nominal_srate'][0])
     info = mne.create_info(ch_names, sfreq, ch_types='eeg', verbose=False)
-    raw = mne.io.RawArray(data, info, verbose=False)
 
-    if markers_stream is not None:
-        eeg_start_time = eeg_stream['time_stamps'][0]
+    # Decoded chunk by chunk into a single preallocated float64 buffer, already in volts,
+    # so RawArray can take it over without another copy
+    if not preload:
+        raw = RawXDF(xdf, eeg_stream_id, info)
+        eeg_start_time = xdf.first_timestamp(eeg_stream_id)
+    elif windowed:
+        start, stop = _crop_sample_range(sfreq, xdf.n_samples(eeg_stream_id), tmin, tmax)
+        data, _ = xdf.read_numeric(eeg_stream_id, scale=1e-6, start=start, stop=stop)
+        eeg_start_time = xdf.first_timestamp(eeg_stream_id)
+        raw = mne.io.RawArray(data, info, first_samp=start, verbose=False)
+    else:
+        data, eeg_time_stamps = xdf.read_numeric(eeg_stream_id, scale=1e-6)
+        eeg_start_time = eeg_time_stamps[0]
+        raw = mne.io.RawArray(data, info, verbose=False)
+
+    if markers_stream_id is not None:
+        markers = decode_markers(*xdf.read_strings(markers_stream_id))
+        annotations = markers_to_annotations(markers, eeg_start_time, events=marker_events)
 
-        onset = markers_stream['time_stamps'][:-1] - eeg_start_time
-        duration = markers_stream['time_stamps'][1:] - onset - eeg_start_time
-        description = [ts[0].split(' ')[2].rstrip('.wav') for ts in markers_stream['time_series'][:-1]]
-        annotations = mne.Annotations(onset, duration, description)
+        if windowed and preload:
+            # Onsets of a Raw with first_samp > 0 are counted from its first sample
+            annotations.crop(start / sfreq, (start + raw.n_times) / sfreq, verbose=False)
+            annotations.onset -= start / sfreq
 
         raw.set_annotations(annotations)
 
+    if windowed and not preload:
+        raw.crop(tmin=tmin or 0.0, tmax=tmax)
+
     return raw
 
 
-def load_recording(file_path):
+def _read_recording(file_path, preload=True):
     if file_path.endswith('.txt'):
-        return load_openbci_txt(file_path)
+        return load_openbci_txt(file_path, preload=preload)
     elif file_path.endswith('.csv'):
-        return load_muse_csv(file_path)
+        return load_muse_csv(file_path, preload=preload)
     elif file_path.endswith('.xdf'):
-        return load_raw_xdf(file_path)
+        return load_raw_xdf(file_path, preload=preload)
     elif file_path.endswith('.vhdr'):
-        return mne.io.read_raw(file_path, preload=True)
+        return mne.io.read_raw(file_path, preload=preload)
+
+    return mne.io.read_raw(file_path, preload=preload)
+
+
+def load_recording(file_path, tmin=None, tmax=None, cache=None, preload=True):
+    """Load a recording, optionally only the [tmin, tmax] range in seconds.
+
+    XDF files are read through a sidecar chunk index, so a short window of a long
+    recording is decoded without parsing the rest. Other formats are cropped after loading.
 
-    return mne.io.read_raw(file_path, preload=True)
\ No newline at end of file
+    With cache=True the decoded recording is kept in an on-disk cache (see libs.cache)
+    and memory-mapped on later runs. cache=None enables it only when the EEG_CACHE_DIR
+    environment variable is set.
+
+    With preload=False the samples are only read when needed, so picks and crops
+    applied before Raw.load_data() or Raw.get_data() skip the rest of the file.
+    Cache hits are then memory-mapped, which is lazy already; with preload=True
+    they are read into memory.
+    """
+    windowed = tmin is not None or tmax is not None
+
+    if cache is None:
+        cache = CACHE_DIR_ENV in os.environ
+
+    if cache:
+        recording_cache = shared_cache()
+        raw = recording_cache.get(file_path, preload=preload)
+        if raw is None:
+            raw = _read_recording(file_path)
+            recording_cache.put(file_path, raw)
+    elif file_path.endswith('.xdf'):
+        return load_raw_xdf(file_path, tmin=tmin, tmax=tmax, preload=preload)
+    else:
+        raw = _read_recording(file_path, preload=preload)
+
+    if windowed:
+        raw.crop(tmin=tmin or 0.0, tmax=tmax)
+
+    return raw
@@ -1,37 +1,270 @@
-import mne
+import functools
+from concurrent.futures import ThreadPoolExecutor
 
-from brainflow.board_shim import BoardShim, BoardIds
-from brainflow.data_filter import DataFilter, FilterTypes, NoiseTypes
+import mne
+from mne.annotations import _annotations_starts_stops
 
 import numpy as np
+from scipy.signal import (butter, choose_conv_method, convolve, iirnotch, oaconvolve, sosfilt, sosfilt_zi,
+                          sosfiltfilt, tf2sos)
+
+DEAD_CHANNEL_BLOCK_SECONDS = 60
+
+# Filter plans for this many (sfreq, band, notch, method, length) combinations are kept
+FILTER_PLAN_CACHE_SIZE = 16
+
+# Transition band of the notch filters, as in mne.filter.notch_filter()
+NOTCH_TRANS_BANDWIDTH = 1.0
+
+# Annotations that raw.filter() doesn't filter across: 'edge' marks where raws were concatenated
+SKIP_BY_ANNOTATION = ('edge', 'bad_acq_skip')
 
-def filter_and_drop_dead_channels(raw, picks):
-    to_drop = []
 
-    data = raw.get_data()
-    for channel in range(raw.info['nchan']):
-        if np.all(data[channel] == data[channel][0]):
-            to_drop.append(raw.ch_names[channel])
+def find_dead_channels(raw, block_seconds=DEAD_CHANNEL_BLOCK_SECONDS):
+    # Channels that stay at one value for the whole recording. Read block by block,
+    # stopping as soon as every channel has moved, so a lazy (preload=False)
+    # recording usually only has its first block read
+    block_size = max(1, int(block_seconds * raw.info['sfreq']))
+    first_values = None
+    dead = np.ones(raw.info['nchan'], dtype=bool)
 
-    raw.drop_channels(to_drop)
-        
-    raw.filter(l_freq=1.0, h_freq=45.0, verbose=False)
-    raw.notch_filter(50, notch_widths=4, verbose=False)
+    for start in range(0, raw.n_times, block_size):
+        data = raw.get_data(start=start, stop=start + block_size)
+        if first_values is None:
+            first_values = data[:, :1]
+        dead &= np.all(data == first_values, axis=1)
+        if not dead.any():
+            break
 
+    return [raw.ch_names[channel] for channel in np.flatnonzero(dead)]
+
+
+def filter_and_drop_dead_channels(raw, picks):
+    # Works on lazy (preload=False) recordings too: only the picked channels are
+    # loaded before filtering
+    raw.drop_channels(find_dead_channels(raw))
+
+    # Both filters work channel by channel, so picking first gives the same result
     raw.pick(picks)
+    if not raw.preload:
+        raw.load_data(verbose=False)
+
+    # Same filters as raw.filter(1.0, 45.0) followed by raw.notch_filter(50, notch_widths=4),
+    # without designing them again for every recording
+    get_filter_plan(raw.info['sfreq']).apply_raw(raw)
 
     raw.set_montage('standard_1020')
 
 
-def create_new_raw_with_brainflow_filters_applied(raw):
-    data = raw.get_data()
-    sampling_rate = BoardShim.get_sampling_rate(BoardIds.CYTON_BOARD.value)
-    num_channels = raw.info['nchan']
+def _pad_edges(x, n_edge):
+    # MNE's 'reflect_limited' padding: the edges mirrored around the first and last
+    # samples (odd reflection), zeros beyond what the signal can provide
+    n_times = x.shape[-1]
+    zeros = np.zeros(x.shape[:-1] + (max(n_edge - n_times + 1, 0),))
+    return np.concatenate([
+        zeros,
+        2 * x[..., :1] - x[..., n_edge:0:-1],
+        x,
+        2 * x[..., -1:] - x[..., -2:-n_edge - 2:-1],
+        zeros,
+    ], axis=-1)
+
+
+class FilterPlan:
+    """Zero-phase band-pass + notch filters, designed once for a sampling rate.
+
+    The coefficients are the ones raw.filter() and raw.notch_filter() design for
+    the same parameters (FIR firwin, or Butterworth for method='iir'), and apply()
+    gives the same result up to rounding. FIR stages are applied as one centred
+    convolution over the padded signal: FFT overlap-add for long signals, direct
+    convolution for short ones, whichever scipy estimates to be faster. Get plans
+    through get_filter_plan(), which caches them.
+    """
+
+    def __init__(self, sfreq, l_freq=1.0, h_freq=45.0, notch=(50.0,), notch_width=4.0, method='fir',
+                 filter_length='auto'):
+        self.sfreq = sfreq
+        self.l_freq = l_freq
+        self.h_freq = h_freq
+        self.stages = []
+
+        if l_freq is not None or h_freq is not None:
+            band = mne.filter.create_filter(None, sfreq, l_freq, h_freq, filter_length=filter_length,
+                                            method=method, iir_params=None, phase='zero', verbose=False)
+            self.stages.append(('iir', band) if method == 'iir' else ('fir', band))
+
+        notch = [freq for freq in notch if freq < sfreq / 2]
+        if notch:
+            tb_2 = NOTCH_TRANS_BANDWIDTH / 2.0
+            lows = [freq - notch_width / 2.0 - tb_2 for freq in notch]
+            highs = [freq + notch_width / 2.0 + tb_2 for freq in notch]
+            self.stages.append(('fir', mne.filter.create_filter(
+                None, sfreq, highs, lows, filter_length=filter_length, l_trans_bandwidth=tb_2,
+                h_trans_bandwidth=tb_2, method='fir', phase='zero', verbose=False)))
+
+    @staticmethod
+    def _apply_fir(x, h):
+        n_times = x.shape[-1]
+        n_edge = max(min(len(h), n_times) - 1, 0)
+        x_ext = _pad_edges(x, n_edge) if n_edge else x
+
+        if choose_conv_method(x_ext[0], h, mode='full') == 'direct':
+            filtered = convolve(x_ext, h[np.newaxis, :], mode='full', method='direct')
+        else:
+            filtered = oaconvolve(x_ext, h[np.newaxis, :], mode='full', axes=-1)
+
+        shift = (len(h) - 1) // 2 + n_edge
+        return filtered[:, shift:shift + n_times]
+
+    @staticmethod
+    def _apply_iir(x, iir_params):
+        n_times = x.shape[-1]
+        padlen = min(iir_params['padlen'], n_times - 1)
+        x_ext = _pad_edges(x, padlen) if padlen > 0 else x
+        filtered = sosfiltfilt(iir_params['sos'], x_ext, axis=-1, padlen=0)
+        return filtered[:, padlen:padlen + n_times]
+
+    def apply(self, data):
+        # data is (n_channels, n_times); returns a filtered copy
+        x = np.atleast_2d(np.asarray(data, dtype=np.float64))
+        if x.shape[-1] < 2:
+            return x.copy().reshape(np.shape(data))
+
+        for kind, coefficients in self.stages:
+            x = self._apply_fir(x, coefficients) if kind == 'fir' else self._apply_iir(x, coefficients)
+        return x.reshape(np.shape(data))
+
+    def apply_raw(self, raw, skip_by_annotation=SKIP_BY_ANNOTATION):
+        # In place on the data channels of a preloaded raw, like raw.filter(): each
+        # stretch between skip_by_annotation annotations is filtered on its own,
+        # and samples inside them are left as they are. info['highpass'] and
+        # info['lowpass'] are narrowed to the band the same way too
+        onsets, ends = _annotations_starts_stops(raw, skip_by_annotation, invert=True)
+
+        def apply_segments(data):
+            filtered = data.copy()
+            for start, stop in zip(onsets, ends):
+                filtered[:, start:stop] = self.apply(data[:, start:stop])
+            return filtered
+
+        raw.apply_function(apply_segments, picks='data', channel_wise=False, verbose=False)
+        with raw.info._unlock():
+            if self.l_freq is not None and (raw.info['highpass'] is None or self.l_freq > raw.info['highpass']):
+                raw.info['highpass'] = float(self.l_freq)
+            if self.h_freq is not None and (raw.info['lowpass'] is None or self.h_freq < raw.info['lowpass']):
+                raw.info['lowpass'] = float(self.h_freq)
+        return raw
+
+
+@functools.lru_cache(maxsize=FILTER_PLAN_CACHE_SIZE)
+def _cached_filter_plan(sfreq, l_freq, h_freq, notch, notch_width, method, filter_length):
+    return FilterPlan(sfreq, l_freq, h_freq, notch, notch_width, method, filter_length)
+
+
+def get_filter_plan(sfreq, l_freq=1.0, h_freq=45.0, notch=(50.0,), notch_width=4.0, method='fir',
+                    filter_length='auto'):
+    # Designing the filters takes longer than applying them to a few seconds of
+    # data, so plans are memoized; `notch` is a frequency or a sequence of them
+    notch = tuple(float(freq) for freq in np.atleast_1d(notch if notch is not None else []))
+    return _cached_filter_plan(float(sfreq), l_freq, h_freq, notch, float(notch_width), method, filter_length)
+
+
+def design_live_filter_sos(sfreq, l_freq=1.0, h_freq=45.0, notch_freq=50.0, notch_width=4.0, order=4):
+    # Same bands as filter_and_drop_dead_channels(), as causal IIR second-order sections
+    band_sos = butter(order, [l_freq, h_freq], btype='bandpass', fs=sfreq, output='sos')
+    if notch_freq is None or notch_freq >= sfreq / 2:
+        return band_sos
+
+    b, a = iirnotch(notch_freq, notch_freq / notch_width, fs=sfreq)
+    return np.vstack([band_sos, tf2sos(b, a)])
+
+
+class StreamingFilterBank:
+    """Band-pass + notch filter for live data that keeps its state between chunks.
+
+    Each call to process() only filters the new samples, continuing from where the
+    previous chunk ended, so the output is the same as filtering the whole stream
+    at once with sosfilt() however it is chunked. The state starts from the first
+    sample's steady state, so a DC offset doesn't cause a big step transient.
+    """
+
+    def __init__(self, sfreq, n_channels, **filter_kwargs):
+        self.sos = design_live_filter_sos(sfreq, **filter_kwargs)
+        self.n_channels = n_channels
+        self.zi = None
+
+    def reset(self):
+        self.zi = None
+
+    def process(self, chunk):
+        # chunk is (n_channels, n_samples)
+        chunk = np.asarray(chunk, dtype=np.float64)
+        if chunk.shape[-1] == 0:
+            return chunk.copy()
+
+        if self.zi is None:
+            self.zi = sosfilt_zi(self.sos)[:, np.newaxis, :] * chunk[np.newaxis, :, :1]
+
+        filtered, self.zi = sosfilt(self.sos, chunk, axis=-1, zi=self.zi)
+        return filtered
+
+
+# What BrainFlow's remove_environmental_noise() removes: a 4th order Butterworth
+# band-stop 4 Hz wide around each of these frequencies
+BRAINFLOW_NOISE_FREQS = (50.0, 60.0)
+BRAINFLOW_NOISE_WIDTH = 4.0
+
+
+def design_brainflow_sos(sfreq, l_freq=1.0, h_freq=45.0, order=4, noise_freqs=BRAINFLOW_NOISE_FREQS):
+    # Returns the band-pass and the list of band-stop second-order sections
+    band_sos = butter(order, [l_freq, h_freq], btype='bandpass', fs=sfreq, output='sos')
+    stop_sos = [butter(4, [freq - BRAINFLOW_NOISE_WIDTH / 2, freq + BRAINFLOW_NOISE_WIDTH / 2], btype='bandstop',
+                       fs=sfreq, output='sos')
+                for freq in noise_freqs if freq + BRAINFLOW_NOISE_WIDTH / 2 < sfreq / 2]
+    return band_sos, stop_sos
+
+
+def _brainflow_filter_rows(data, band_sos, stop_sos):
+    # perform_bandpass(..., BUTTERWORTH) is one causal pass; the band-stops are
+    # BUTTERWORTH_ZERO_PHASE: forward, then backward over the reversed signal. Like
+    # in BrainFlow, the signal isn't padded and the filter isn't reset in between:
+    # the backward pass starts from the state the forward pass ended in
+    filtered = sosfilt(band_sos, data, axis=-1)
+    for sos in stop_sos:
+        filtered, state = sosfilt(sos, filtered, axis=-1, zi=np.zeros((len(sos), filtered.shape[0], 2)))
+        filtered = sosfilt(sos, filtered[:, ::-1], axis=-1, zi=state)[0][:, ::-1]
+    return filtered
+
+
+def apply_brainflow_filters(data, sfreq, l_freq=1.0, h_freq=45.0, order=4, noise_freqs=BRAINFLOW_NOISE_FREQS,
+                            n_jobs=1):
+    """The OpenBCI GUI filters, as BrainFlow applies them, on all channels at once.
+
+    Same as DataFilter.perform_bandpass(..., FilterTypes.BUTTERWORTH) followed by
+    remove_environmental_noise() for each of `noise_freqs`, channel by channel,
+    but with SciPy's sosfilt along the time axis of the whole (n_channels,
+    n_samples) array. sosfilt releases the GIL, so with n_jobs > 1 groups of
+    channels are filtered on that many threads. Returns a filtered copy.
+    scripts/check_brainflow_filters.py compares the result with BrainFlow's.
+    """
+    data = np.atleast_2d(np.asarray(data, dtype=np.float64))
+    band_sos, stop_sos = design_brainflow_sos(sfreq, l_freq, h_freq, order, noise_freqs)
+
+    n_jobs = max(1, min(n_jobs, data.shape[0]))
+    if n_jobs == 1:
+        return _brainflow_filter_rows(data, band_sos, stop_sos)
+
+    groups = np.array_split(np.arange(data.shape[0]), n_jobs)
+    filtered = np.empty_like(data)
+    with ThreadPoolExecutor(n_jobs) as pool:
+        results = pool.map(lambda rows: _brainflow_filter_rows(data[rows], band_sos, stop_sos), groups)
+        for rows, result in zip(groups, results):
+            filtered[rows] = result
+    return filtered
+
 
-    for channel in range(num_channels):
-        DataFilter.perform_bandpass(data[channel], sampling_rate, 1.0, 45.0, 4, FilterTypes.BUTTERWORTH.value, 1)
-        DataFilter.remove_environmental_noise(data[channel], sampling_rate, NoiseTypes.FIFTY.value)
-        DataFilter.remove_environmental_noise(data[channel], sampling_rate, NoiseTypes.SIXTY.value)
+def create_new_raw_with_brainflow_filters_applied(raw, n_jobs=1):
+    data = apply_brainflow_filters(raw.get_data(), raw.info['sfreq'], n_jobs=n_jobs)
 
     filtered_raw = mne.io.RawArray(data, raw.info)
-    return filtered_raw
\ No newline at end of file
+    return filtered_raw
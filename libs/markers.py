@@ -0,0 +1,192 @@
+import json
+
+import mne
+import numpy as np
+import pandas as pd
+
+# Events of scripts/run_trials.py that open a span closed by a later event of the
+# same trial (or block); their annotations get the span as duration
+DEFAULT_SPANS = {
+    'trial_start': 'trial_end',
+    'flicker_start': 'flicker_end',
+    'delay_start': 'stim_onset_req',
+    'stim_onset_req': 'response',
+    'block_start': 'block_end',
+}
+
+# Payload fields that describe a trial, by the event that carries them
+TRIAL_FIELDS = {
+    'trial_start': ['cond', 'angle', 'snr_level', 'snr_jitter', 'seed', 'delay_cycles'],
+    'stim_onset_req': ['snr', 'stim_hash'],
+    'response': ['resp', 'correct', 'rt_ms', 'timeout'],
+    'flicker_timing': ['flip_ms_p99', 'flip_ms_max', 'err_on_post_p50', 'err_on_post_p99', 'err_on_post_max', 'long_flips'],
+}
+
+
+def legacy_marker_description(value):
+    # Older recordings have markers like 'Playing sound /open.wav'
+    parts = value.split(' ')
+    return parts[2].rstrip('.wav') if len(parts) > 2 else value
+
+
+def _parse_payloads(values):
+    # One json.loads call for the whole stream; only fall back to parsing marker by
+    # marker if some of them aren't valid JSON. A marker like '1,2' joins fine but
+    # turns into several items, which would shift every later payload, so the
+    # counts must match too
+    try:
+        payloads = json.loads('[' + ','.join(values) + ']')
+        if len(payloads) == len(values):
+            return payloads
+    except ValueError:
+        pass
+
+    payloads = []
+    for value in values:
+        try:
+            payloads.append(json.loads(value))
+        except ValueError:
+            payloads.append(None)
+    return payloads
+
+
+def decode_markers(values, time_stamps):
+    """Decode a marker stream into a DataFrame with one row per marker.
+
+    `values` are marker strings, or the 1-element lists that pyxdf and
+    XDFFile.read_strings() return. JSON payloads from run_trials.push_marker()
+    become columns ('ev', 'ts', 'trial', 'freq', ...). Other markers only get 'ev',
+    parsed the old way. 'time' holds `time_stamps` and 'json' tells the two kinds apart.
+    """
+    values = [value[0] if isinstance(value, (list, tuple)) else value for value in values]
+    is_json = np.array([value[:1] == '{' for value in values], dtype=bool)
+
+    json_idx = np.flatnonzero(is_json)
+    payloads = _parse_payloads([values[i] for i in json_idx])
+    if len(json_idx) == len(values) and all(isinstance(payload, dict) for payload in payloads):
+        records = payloads
+    else:
+        records = [{}] * len(values)
+        for i, payload in zip(json_idx, payloads):
+            if isinstance(payload, dict):
+                records[i] = payload
+            else:
+                is_json[i] = False
+
+    markers = pd.DataFrame.from_records(records, index=pd.RangeIndex(len(values)))
+    if 'ev' not in markers:
+        markers['ev'] = None
+    markers['ev'] = markers['ev'].astype(object)
+    legacy_idx = np.flatnonzero(~is_json)
+    markers.loc[legacy_idx, 'ev'] = [legacy_marker_description(values[i]) for i in legacy_idx]
+
+    markers.insert(0, 'time', np.asarray(time_stamps, dtype=np.float64))
+    markers.insert(1, 'json', is_json)
+    return markers
+
+
+def _next_end(keys, times, is_start, is_end):
+    # Index of the first end marker at or after each start marker with the same key,
+    # -1 if there is none. Sorting by (key, time) with starts before ends at equal
+    # times puts that end right after the start, ignoring other starts in between
+    candidates = np.flatnonzero(is_start | is_end)
+    order = candidates[np.lexsort((is_end[candidates], times[candidates], keys[candidates]))]
+
+    # Position of the next end marker in `order`, scanning from the back
+    end_positions = np.where(is_end[order], np.arange(len(order)), len(order))
+    next_pos = np.minimum.accumulate(end_positions[::-1])[::-1]
+
+    starts_in_order = np.flatnonzero(is_start[order])
+    next_end = np.full(len(keys), -1)
+    found = next_pos[starts_in_order] < len(order)
+    matched = order[next_pos[starts_in_order[found]]]
+    same_key = keys[matched] == keys[order[starts_in_order[found]]]
+    next_end[order[starts_in_order[found][same_key]]] = matched[same_key]
+    return next_end
+
+
+def span_durations(markers, spans=DEFAULT_SPANS):
+    """Time from each span-opening marker to its closing marker, 0 if there is none.
+
+    A span closes at the first `spans[ev]` event at or after it with the same
+    'trial' (or 'block', for events without a trial).
+    """
+    durations = np.zeros(len(markers))
+    times = markers['time'].to_numpy()
+    ev = markers['ev'].to_numpy()
+    is_json = markers['json'].to_numpy()
+
+    has_trial = markers['trial'].notna().to_numpy() if 'trial' in markers else np.zeros(len(markers), dtype=bool)
+    for key, keyed in (('trial', has_trial), ('block', ~has_trial)):
+        if key not in markers:
+            continue
+
+        keys = markers[key].to_numpy(dtype=np.float64, na_value=np.nan)
+        keyed = keyed & is_json & ~np.isnan(keys)
+        for start_ev, end_ev in spans.items():
+            is_start = keyed & (ev == start_ev)
+            is_end = keyed & (ev == end_ev)
+            if not is_start.any() or not is_end.any():
+                continue
+
+            next_end = _next_end(keys, times, is_start, is_end)
+            found = np.flatnonzero(next_end >= 0)
+            durations[found] = times[next_end[found]] - times[found]
+
+    return durations
+
+
+def markers_to_annotations(markers, start_time=0.0, events=None, spans=DEFAULT_SPANS):
+    """Build MNE annotations from decode_markers() output.
+
+    Onsets are relative to `start_time` (the first EEG time stamp). JSON markers
+    become annotations named after their 'ev', restricted to `events` if given,
+    lasting until the end of their span (see span_durations()). Streams with only
+    old-style markers keep the old behaviour: every marker lasts until the next
+    one and the last marker is dropped.
+    """
+    time_stamps = markers['time'].to_numpy()
+
+    if not markers['json'].any():
+        onset = time_stamps[:-1] - start_time
+        duration = time_stamps[1:] - onset - start_time
+        return mne.Annotations(onset, duration, markers['ev'].to_numpy()[:-1].astype(str))
+
+    selected = markers['json'].to_numpy().copy()
+    if events is not None:
+        selected &= markers['ev'].isin(list(events)).to_numpy()
+
+    durations = span_durations(markers, spans)
+    return mne.Annotations(time_stamps[selected] - start_time, durations[selected],
+                           markers['ev'].to_numpy()[selected].astype(str))
+
+
+def trial_table(markers):
+    """One row per trial of a run_trials.py session, indexed by trial number.
+
+    Has a 't_<ev>' column with the time of each event in the trial, the block it
+    belongs to and the TRIAL_FIELDS of its trial_start, stim_onset_req, response
+    and flicker_timing markers.
+    """
+    if 'trial' not in markers:
+        return pd.DataFrame(index=pd.Index([], name='trial', dtype=np.int64))
+
+    trials = markers[markers['json'] & markers['trial'].notna()]
+    trials = trials.assign(trial=trials['trial'].astype(np.int64))
+
+    table = trials.pivot_table(index='trial', columns='ev', values='time', aggfunc='first')
+    table.columns = ['t_' + ev for ev in table.columns]
+    table.columns.name = None
+
+    if 'block' in markers and 't_trial_start' in table:
+        block_starts = markers[markers['json'] & (markers['ev'] == 'block_start')]
+        pos = np.searchsorted(block_starts['time'].to_numpy(), table['t_trial_start'].to_numpy(), side='right') - 1
+        table.insert(0, 'block', np.where(pos >= 0, block_starts['block'].to_numpy()[np.maximum(pos, 0)], np.nan))
+
+    for ev, fields in TRIAL_FIELDS.items():
+        fields = [field for field in fields if field in trials]
+        if fields:
+            rows = trials[trials['ev'] == ev].drop_duplicates('trial', keep='last').set_index('trial')
+            table = table.join(rows[fields])
+
+    return table
@@ -28,12 +28,12 @@ def add_red_line_with_value(fig, value, delta_db):
             ha='left', va='top', color='red', fontsize=8, transform=text_transform)
 
 
-def plot_psd(psd, title=None, average=True, ylim=None):
+def plot_psd(psd, title=None, average=True, ylim=None, robust_fit=False, peak_method='argmax'):
     # TODO: do our own custom mapping of electrodes to colors
     COLOR_VALUES = ["brown", "red", "orange", "magenta", "green", "blue", "purple", "black"]
 
-    peak_alpha_freq = get_peak_alpha_freq(psd)
-    psd_freqs, fit_freq_range, fitted_curve, delta_db = fit_one_over_f_curve(psd, min_freq=3, max_freq=40, peak_alpha_freq=peak_alpha_freq)
+    peak_alpha_freq = get_peak_alpha_freq(psd, peak_method)
+    psd_freqs, fit_freq_range, fitted_curve, delta_db = fit_one_over_f_curve(psd, min_freq=3, max_freq=40, peak_alpha_freq=peak_alpha_freq, robust=robust_fit)
 
     fig = psd.plot(average=average, show=False, spatial_colors=True)
     # Remove borders/spines around all axes in the figure
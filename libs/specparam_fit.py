@@ -0,0 +1,220 @@
+import hashlib
+import json
+import os
+import sqlite3
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from libs.cache import CACHE_DIR_ENV, DEFAULT_CACHE_DIR
+
+# Spectra handed to a worker process at a time: big enough that pickling and
+# model setup don't dominate, small enough to keep every worker busy
+FIT_CHUNK_SIZE = 64
+
+FIT_CACHE_NAME = 'specparam.db'
+# Bump when the stored results change meaning, so old fits are not reused
+FIT_CACHE_VERSION = 2
+
+# Same settings as iaf_specparam() in plot/alpha.py
+DEFAULT_SETTINGS = {'max_n_peaks': 6}
+
+# Output of fit_spectra(), one entry per spectrum: aperiodic parameters
+# (offset, [knee,] exponent), an (n_peaks, 3) array of peaks (centre frequency,
+# power over the aperiodic fit, bandwidth), the goodness of fit, and the
+# (n_peaks, 3) gaussians (centre, height, standard deviation) the model is
+# regenerated from (see group_model()). NaN where the fit failed
+SpecparamFits = namedtuple('SpecparamFits', ['aperiodic', 'peaks', 'r_squared', 'error', 'gaussians'])
+
+SCHEMA = """
+PRAGMA journal_mode=WAL;
+PRAGMA synchronous=NORMAL;
+CREATE TABLE IF NOT EXISTS fit(
+  key BLOB PRIMARY KEY,
+  result BLOB
+);
+"""
+
+
+def _fit_chunk(freqs, spectra, freq_range, settings):
+    # Runs in a worker process; specparam is only needed where fitting happens
+    from specparam import SpectralGroupModel
+
+    fg = SpectralGroupModel(**settings, verbose=False)
+    fg.fit(freqs, spectra, freq_range)
+    return [(np.asarray(r.aperiodic_params, dtype=np.float64),
+             np.asarray(r.peak_params, dtype=np.float64).reshape(-1, 3),
+             float(r.r_squared), float(r.error),
+             np.asarray(r.gaussian_params, dtype=np.float64).reshape(-1, 3)) for r in fg.get_results()]
+
+
+def _encode(result):
+    aperiodic, peaks, r_squared, error, gaussians = result
+    return np.concatenate([[r_squared, error, len(aperiodic)], aperiodic, peaks.ravel(), gaussians.ravel()]).tobytes()
+
+
+def _decode(blob):
+    values = np.frombuffer(blob, dtype=np.float64)
+    n_aperiodic = int(values[2])
+    aperiodic = values[3:3 + n_aperiodic].copy()
+    # As many gaussians as peaks
+    peaks, gaussians = values[3 + n_aperiodic:].reshape(2, -1, 3).copy()
+    return aperiodic, peaks, float(values[0]), float(values[1]), gaussians
+
+
+class SpecparamFitter:
+    """specparam fits of many spectra, spread over a process pool and cached on disk.
+
+    Spectra are fitted in chunks of `chunk_size` by SpectralGroupModel in `n_jobs`
+    worker processes (-1 for one per CPU). Every fit is stored in an SQLite file
+    under the cache directory (EEG_CACHE_DIR, like libs.cache), keyed by a hash of
+    the spectrum, its frequencies, the fit range and the model settings, so
+    re-running a report or a sliding-window analysis only fits what changed.
+    cache=False fits everything and stores nothing.
+    """
+
+    def __init__(self, freq_range=(3, 45), settings=None, n_jobs=1, chunk_size=FIT_CHUNK_SIZE, cache=True,
+                 cache_dir=None):
+        self.freq_range = tuple(float(f) for f in freq_range)
+        self.settings = dict(DEFAULT_SETTINGS if settings is None else settings)
+        self.n_jobs = os.cpu_count() if n_jobs == -1 else max(1, n_jobs)
+        self.chunk_size = max(1, chunk_size)
+
+        self.db = None
+        if cache:
+            cache_dir = cache_dir or os.environ.get(CACHE_DIR_ENV) or DEFAULT_CACHE_DIR
+            os.makedirs(cache_dir, exist_ok=True)
+            self.db = sqlite3.connect(os.path.join(cache_dir, FIT_CACHE_NAME), isolation_level=None)
+            self.db.executescript(SCHEMA)
+
+    def _keys(self, freqs, spectra):
+        prefix = hashlib.blake2b(digest_size=16)
+        prefix.update(json.dumps([FIT_CACHE_VERSION, self.freq_range, self.settings], sort_keys=True).encode())
+        prefix.update(freqs.tobytes())
+
+        keys = []
+        for spectrum in spectra:
+            h = prefix.copy()
+            h.update(spectrum.tobytes())
+            keys.append(h.digest())
+        return keys
+
+    def _lookup(self, keys):
+        found = {}
+        # SQLite limits the number of parameters of a statement
+        for start in range(0, len(keys), 500):
+            batch = list(set(keys[start:start + 500]))
+            rows = self.db.execute(f"SELECT key, result FROM fit WHERE key IN ({','.join('?' * len(batch))})", batch)
+            found.update((bytes(key), _decode(result)) for key, result in rows)
+        return found
+
+    def _fit(self, freqs, spectra):
+        chunks = [spectra[start:start + self.chunk_size] for start in range(0, len(spectra), self.chunk_size)]
+        if self.n_jobs == 1 or len(chunks) == 1:
+            fitted = [_fit_chunk(freqs, chunk, self.freq_range, self.settings) for chunk in chunks]
+        else:
+            with ProcessPoolExecutor(max_workers=min(self.n_jobs, len(chunks))) as executor:
+                fitted = list(executor.map(_fit_chunk, [freqs] * len(chunks), chunks,
+                                           [self.freq_range] * len(chunks), [self.settings] * len(chunks)))
+        return [result for chunk in fitted for result in chunk]
+
+    def fit(self, freqs, spectra):
+        """Fit (..., n_freqs) power spectra; returns SpecparamFits shaped like spectra[..., 0]."""
+        freqs = np.ascontiguousarray(freqs, dtype=np.float64)
+        spectra = np.asarray(spectra, dtype=np.float64)
+        shape = spectra.shape[:-1]
+        spectra = np.ascontiguousarray(spectra.reshape(-1, spectra.shape[-1]))
+
+        keys = self._keys(freqs, spectra)
+        results = self._lookup(keys) if self.db is not None else {}
+
+        # Identical spectra (e.g. a repeated window) are only fitted once
+        missing = {}
+        for i, key in enumerate(keys):
+            if key not in results:
+                missing.setdefault(key, i)
+        if missing:
+            new = dict(zip(missing, self._fit(freqs, spectra[list(missing.values())])))
+            results.update(new)
+            if self.db is not None:
+                self.db.execute("BEGIN")
+                self.db.executemany("INSERT OR REPLACE INTO fit(key, result) VALUES(?, ?)",
+                                    [(key, _encode(result)) for key, result in new.items()])
+                self.db.execute("COMMIT")
+
+        ordered = [results[key] for key in keys]
+        n_aperiodic = max((len(r[0]) for r in ordered), default=2)
+        aperiodic = np.full((len(ordered), n_aperiodic), np.nan)
+        peaks = np.empty(len(ordered), dtype=object)
+        gaussians = np.empty(len(ordered), dtype=object)
+        for i, (params, spectrum_peaks, _, _, spectrum_gaussians) in enumerate(ordered):
+            aperiodic[i, :len(params)] = params
+            peaks[i] = spectrum_peaks
+            gaussians[i] = spectrum_gaussians
+
+        return SpecparamFits(
+            aperiodic=aperiodic.reshape(shape + (n_aperiodic,)),
+            peaks=peaks.reshape(shape),
+            r_squared=np.array([r[2] for r in ordered]).reshape(shape),
+            error=np.array([r[3] for r in ordered]).reshape(shape),
+            gaussians=gaussians.reshape(shape),
+        )
+
+    def close(self):
+        if self.db is not None:
+            self.db.close()
+            self.db = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def fit_spectra(freqs, spectra, freq_range=(3, 45), settings=None, n_jobs=1, chunk_size=FIT_CHUNK_SIZE, cache=True):
+    with SpecparamFitter(freq_range, settings, n_jobs=n_jobs, chunk_size=chunk_size, cache=cache) as fitter:
+        return fitter.fit(freqs, spectra)
+
+
+def group_model(fits, freqs, spectra, freq_range=(3, 45), settings=None):
+    # A SpectralGroupModel holding (n_spectra, n_freqs) spectra and their fits
+    # from fit_spectra() with the same range and settings, without fitting again:
+    # for specparam's plots and printouts, and get_model(i, regenerate=True)
+    from specparam import SpectralGroupModel
+    from specparam.data import FitResults
+
+    fg = SpectralGroupModel(**dict(DEFAULT_SETTINGS if settings is None else settings), verbose=False)
+    fg.add_data(freqs, spectra, list(freq_range))
+    n_aperiodic = 3 if fg.aperiodic_mode == 'knee' else 2
+    fg.add_results([FitResults(aperiodic[:n_aperiodic], peaks, r_squared, error, gaussians)
+                    for aperiodic, peaks, r_squared, error, gaussians
+                    in zip(fits.aperiodic, fits.peaks, fits.r_squared, fits.error, fits.gaussians)])
+    return fg
+
+
+def band_peaks(fits, band):
+    # The strongest peak within band = (low, high) Hz of every spectrum, as a
+    # (..., 3) array of (centre frequency, power, bandwidth); NaN where there is
+    # none. The same choice as specparam's get_band_peak_group()
+    low, high = band
+    out = np.full(fits.peaks.shape + (3,), np.nan)
+    flat = out.reshape(-1, 3)
+    for i, peaks in enumerate(fits.peaks.ravel()):
+        in_band = peaks[(peaks[:, 0] >= low) & (peaks[:, 0] <= high)]
+        if len(in_band):
+            flat[i] = in_band[np.argmax(in_band[:, 1])]
+    return out
+
+
+def strongest_band_peak(fits, band, axis=-1):
+    # Centre frequency of the strongest band peak over `axis` (the channels),
+    # e.g. the IAF of each window of (n_windows, n_channels) fits; NaN where no
+    # channel has a peak in the band
+    peaks = band_peaks(fits, band)
+    power = np.moveaxis(peaks[..., 1], axis, -1)
+    freqs = np.moveaxis(peaks[..., 0], axis, -1)
+    has_peak = np.isfinite(power).any(axis=-1)
+    best = np.argmax(np.where(np.isfinite(power), power, -np.inf), axis=-1)
+    return np.where(has_peak, np.take_along_axis(freqs, best[..., None], axis=-1)[..., 0], np.nan)
@@ -0,0 +1,524 @@
+import gzip
+import json
+import os
+import struct
+from collections import defaultdict
+from xml.etree.ElementTree import fromstring
+
+import numpy as np
+from pyxdf.pyxdf import StreamData, _clock_sync, _jitter_removal, _xml2dict
+
+# Chunk tags from the XDF 1.0 specification
+TAG_FILE_HEADER = 1
+TAG_STREAM_HEADER = 2
+TAG_SAMPLES = 3
+TAG_CLOCK_OFFSET = 4
+TAG_BOUNDARY = 5
+TAG_STREAM_FOOTER = 6
+
+NUMERIC_FORMATS = {
+    'int8': np.dtype('<i1'),
+    'int16': np.dtype('<i2'),
+    'int32': np.dtype('<i4'),
+    'int64': np.dtype('<i8'),
+    'float32': np.dtype('<f4'),
+    'double64': np.dtype('<f8'),
+}
+
+INDEX_SUFFIX = '.idx.npz'
+INDEX_VERSION = 1
+
+
+def open_xdf(file_path):
+    if str(file_path).endswith(('.xdfz', '.xdf.gz')):
+        f = gzip.open(file_path, 'rb')
+    else:
+        f = open(file_path, 'rb')
+
+    if f.read(4) != b'XDF:':
+        f.close()
+        raise ValueError(f'Invalid XDF file {file_path}')
+
+    return f
+
+
+def _read_varlen_int(f):
+    nbytes = f.read(1)
+    if not nbytes:
+        raise EOFError()
+
+    if nbytes[0] == 1:
+        return f.read(1)[0]
+    elif nbytes[0] == 4:
+        return struct.unpack('<I', f.read(4))[0]
+    elif nbytes[0] == 8:
+        return struct.unpack('<Q', f.read(8))[0]
+
+    raise ValueError('Invalid variable-length integer in XDF file')
+
+
+def _unpack_varlen_int(buf, pos):
+    nbytes = buf[pos]
+    if nbytes == 1:
+        return buf[pos + 1], pos + 2
+    elif nbytes == 4:
+        return struct.unpack_from('<I', buf, pos + 1)[0], pos + 5
+    elif nbytes == 8:
+        return struct.unpack_from('<Q', buf, pos + 1)[0], pos + 9
+
+    raise ValueError('Invalid variable-length integer in XDF file')
+
+
+def iter_chunks(f):
+    """Walk the chunk headers of an open XDF file.
+
+    Yields (tag, stream_id, offset, length) where offset/length describe the chunk
+    content after the stream id. The content is not read: the caller may read it,
+    and the file position is moved past the chunk before the next one is yielded.
+    """
+    while True:
+        try:
+            chunk_length = _read_varlen_int(f)
+        except EOFError:
+            return
+
+        tag_bytes = f.read(2)
+        if len(tag_bytes) < 2:
+            return
+        tag = struct.unpack('<H', tag_bytes)[0]
+
+        stream_id = None
+        content_length = chunk_length - 2
+        if tag in (TAG_STREAM_HEADER, TAG_SAMPLES, TAG_CLOCK_OFFSET, TAG_STREAM_FOOTER):
+            stream_id_bytes = f.read(4)
+            if len(stream_id_bytes) < 4:
+                return
+            stream_id = struct.unpack('<I', stream_id_bytes)[0]
+            content_length -= 4
+
+        offset = f.tell()
+        yield tag, stream_id, offset, content_length
+        f.seek(offset + content_length)
+
+
+def decode_numeric_samples(buf, dtype, n_channels, last_timestamp, tdiff):
+    """Decode the content of a numeric Samples chunk.
+
+    Returns (time_stamps, values) where values is a (n_samples, n_channels) view
+    into `buf` whenever the chunk has a uniform layout (every sample time-stamped,
+    or none of them), which is what LabRecorder writes.
+    """
+    n_samples, pos = _unpack_varlen_int(buf, 0)
+    if n_samples == 0:
+        return np.zeros(0), np.zeros((0, n_channels), dtype=dtype)
+
+    body = np.frombuffer(buf, dtype=np.uint8, offset=pos)
+    sample_bytes = n_channels * dtype.itemsize
+
+    if len(body) == n_samples * (9 + sample_bytes) and np.all(body[::9 + sample_bytes] == 8):
+        records = body.view(np.dtype([('flag', 'u1'), ('ts', '<f8'), ('values', dtype, (n_channels,))]))
+        return records['ts'].copy(), records['values']
+
+    if len(body) == n_samples * (1 + sample_bytes) and not np.any(body[::1 + sample_bytes]):
+        records = body.view(np.dtype([('flag', 'u1'), ('values', dtype, (n_channels,))]))
+        time_stamps = last_timestamp + tdiff * np.arange(1, n_samples + 1)
+        return time_stamps, records['values']
+
+    # Mixed layout: walk the samples one by one like the reference importer
+    time_stamps = np.zeros(n_samples)
+    values = np.zeros((n_samples, n_channels), dtype=dtype)
+    for k in range(n_samples):
+        if buf[pos] != 0:
+            last_timestamp = struct.unpack_from('<d', buf, pos + 1)[0]
+            pos += 9
+        else:
+            last_timestamp += tdiff
+            pos += 1
+        time_stamps[k] = last_timestamp
+        values[k] = np.frombuffer(buf, dtype=dtype, count=n_channels, offset=pos)
+        pos += sample_bytes
+
+    return time_stamps, values
+
+
+def decode_string_samples(buf, n_channels, last_timestamp, tdiff):
+    n_samples, pos = _unpack_varlen_int(buf, 0)
+
+    time_stamps = np.zeros(n_samples)
+    values = []
+    for k in range(n_samples):
+        if buf[pos] != 0:
+            last_timestamp = struct.unpack_from('<d', buf, pos + 1)[0]
+            pos += 9
+        else:
+            last_timestamp += tdiff
+            pos += 1
+        time_stamps[k] = last_timestamp
+
+        sample = []
+        for _ in range(n_channels):
+            length, pos = _unpack_varlen_int(buf, pos)
+            sample.append(bytes(buf[pos:pos + length]).decode(errors='replace'))
+            pos += length
+        values.append(sample)
+
+    return time_stamps, values
+
+
+class XDFFile:
+    """Chunk-level reader for XDF recordings.
+
+    Opening the file walks the chunk headers once, seeking past sample payloads:
+    stream headers, footers and clock offsets are parsed and the byte ranges of
+    every Samples chunk are remembered. Sample data is decoded later, one chunk at
+    a time, straight into a preallocated output buffer, so peak memory stays close
+    to the size of the decoded signal.
+
+    With use_index=True the chunk table is read from (or, on first use, written to)
+    a sidecar file next to the recording, together with the first/last time stamp
+    of every chunk. That enables reading a sample range without touching the rest
+    of the file.
+
+    Time stamps are clock-synchronized and dejittered exactly like pyxdf.load_xdf
+    does with its default settings.
+    """
+
+    def __init__(self, file_path, synchronize_clocks=True, dejitter_timestamps=True, use_index=False):
+        self.file_path = file_path
+        self.synchronize_clocks = synchronize_clocks
+        self.dejitter_timestamps = dejitter_timestamps
+
+        self.file_header = None
+        self.headers = {}
+        self.footers = {}
+        self.clock_times = defaultdict(list)
+        self.clock_values = defaultdict(list)
+        # stream_id -> list of (offset, length, n_samples)
+        self.sample_chunks = defaultdict(list)
+        # stream_id -> (n_chunks, 2) array of first/last processed time stamps, only with an index
+        self.chunk_time_ranges = None
+        # stream_id -> processed time stamps of string (marker) streams, only with an index
+        self.string_time_stamps = {}
+
+        if use_index and self._load_index():
+            return
+
+        self._scan(with_time_stamps=use_index)
+
+        if use_index:
+            self._save_index()
+
+    @property
+    def index_path(self):
+        return str(self.file_path) + INDEX_SUFFIX
+
+    def _scan(self, with_time_stamps):
+        raw_time_stamps = defaultdict(list)
+        last_timestamps = defaultdict(float)
+
+        with open_xdf(self.file_path) as f:
+            for tag, stream_id, offset, length in iter_chunks(f):
+                if tag == TAG_SAMPLES:
+                    to_read = length if with_time_stamps else min(length, 9)
+                    buf = f.read(to_read)
+                    if len(buf) < to_read:
+                        break  # truncated recording
+                    n_samples, _ = _unpack_varlen_int(buf, 0)
+                    self.sample_chunks[stream_id].append((offset, length, n_samples))
+
+                    if with_time_stamps:
+                        time_stamps, _ = self._decode_chunk(stream_id, buf, last_timestamps[stream_id])
+                        if len(time_stamps):
+                            last_timestamps[stream_id] = time_stamps[-1]
+                        raw_time_stamps[stream_id].append(time_stamps)
+                elif tag == TAG_CLOCK_OFFSET:
+                    clock_time, clock_value = struct.unpack('<dd', f.read(16))
+                    self.clock_times[stream_id].append(clock_time)
+                    self.clock_values[stream_id].append(clock_value)
+                elif tag == TAG_STREAM_HEADER:
+                    xml = f.read(length).decode('utf-8', 'replace')
+                    self.headers[stream_id] = _xml2dict(fromstring(xml))
+                elif tag == TAG_STREAM_FOOTER:
+                    self.footers[stream_id] = _xml2dict(fromstring(f.read(length)))
+                elif tag == TAG_FILE_HEADER:
+                    self.file_header = _xml2dict(fromstring(f.read(length)))
+
+        if with_time_stamps:
+            self.chunk_time_ranges = {}
+            for stream_id, chunks in raw_time_stamps.items():
+                time_stamps = self._process_time_stamps(stream_id, np.concatenate(chunks))
+                if self._stream_layout(stream_id)[0] == 'string':
+                    # Marker streams are tiny, but their clock sync fit is not free
+                    self.string_time_stamps[stream_id] = time_stamps
+                counts = np.array([len(chunk) for chunk in chunks])
+                ends = np.cumsum(counts)
+                ranges = np.full((len(chunks), 2), np.nan)
+                non_empty = counts > 0
+                ranges[non_empty, 0] = time_stamps[(ends - counts)[non_empty]]
+                ranges[non_empty, 1] = time_stamps[ends[non_empty] - 1]
+                self.chunk_time_ranges[stream_id] = ranges
+
+    def _file_signature(self):
+        stat = os.stat(self.file_path)
+        return {
+            'version': INDEX_VERSION,
+            'size': stat.st_size,
+            'mtime_ns': stat.st_mtime_ns,
+            'synchronize_clocks': self.synchronize_clocks,
+            'dejitter_timestamps': self.dejitter_timestamps,
+        }
+
+    def _load_index(self):
+        try:
+            with np.load(self.index_path) as index:
+                meta = json.loads(str(index['meta']))
+                if meta['signature'] != self._file_signature():
+                    return False
+
+                self.file_header = meta['file_header']
+                self.headers = {int(k): v for k, v in meta['headers'].items()}
+                self.footers = {int(k): v for k, v in meta['footers'].items()}
+                for k, v in meta['clock_times'].items():
+                    self.clock_times[int(k)] = v
+                for k, v in meta['clock_values'].items():
+                    self.clock_values[int(k)] = v
+
+                self.chunk_time_ranges = {}
+                for stream_id in meta['sample_streams']:
+                    chunks = index[f'chunks_{stream_id}']
+                    self.sample_chunks[stream_id] = [tuple(chunk) for chunk in chunks.tolist()]
+                    self.chunk_time_ranges[stream_id] = index[f'time_ranges_{stream_id}']
+                    if f'time_stamps_{stream_id}' in index:
+                        self.string_time_stamps[stream_id] = index[f'time_stamps_{stream_id}']
+        except (OSError, KeyError, ValueError):
+            return False
+
+        return True
+
+    def _save_index(self):
+        meta = {
+            'signature': self._file_signature(),
+            'file_header': self.file_header,
+            'headers': self.headers,
+            'footers': self.footers,
+            'clock_times': self.clock_times,
+            'clock_values': self.clock_values,
+            'sample_streams': list(self.sample_chunks),
+        }
+        arrays = {'meta': np.array(json.dumps(meta))}
+        for stream_id, chunks in self.sample_chunks.items():
+            arrays[f'chunks_{stream_id}'] = np.array(chunks, dtype=np.int64).reshape(-1, 3)
+            arrays[f'time_ranges_{stream_id}'] = self.chunk_time_ranges[stream_id]
+        for stream_id, time_stamps in self.string_time_stamps.items():
+            arrays[f'time_stamps_{stream_id}'] = time_stamps
+
+        # The index is only an accelerator: a read-only data directory must not break loading
+        try:
+            with open(self.index_path, 'wb') as f:
+                np.savez(f, **arrays)
+        except OSError:
+            pass
+
+    def stream_info(self, stream_id):
+        return self.headers[stream_id]['info']
+
+    def n_samples(self, stream_id):
+        return sum(n for _, _, n in self.sample_chunks[stream_id])
+
+    def first_timestamp(self, stream_id):
+        """Synchronized and dejittered time stamp of the first sample (needs an index)."""
+        ranges = self.chunk_time_ranges[stream_id]
+        return ranges[~np.isnan(ranges[:, 0]), 0][0]
+
+    def _chunk_time_range(self, stream_id):
+        # Raw time stamps of the first and last sample, decoding only the first and
+        # last non-empty sample chunks
+        chunk_indices = [i for i, (_, _, n) in enumerate(self.sample_chunks[stream_id]) if n > 0]
+        time_stamps = [self._decode_chunk(stream_id, buf, 0.0)[0]
+                       for _, buf in self._iter_chunk_contents(stream_id, [chunk_indices[0], chunk_indices[-1]])]
+        if len(time_stamps) < 2:
+            return None
+        return time_stamps[0][0], time_stamps[-1][-1]
+
+    def _stream_layout(self, stream_id):
+        info = self.stream_info(stream_id)
+        n_channels = int(info['channel_count'][0])
+        srate = float(info['nominal_srate'][0])
+        tdiff = 1.0 / srate if srate > 0 else 0.0
+        return info['channel_format'][0], n_channels, tdiff
+
+    def _decode_chunk(self, stream_id, buf, last_timestamp):
+        channel_format, n_channels, tdiff = self._stream_layout(stream_id)
+        if channel_format == 'string':
+            return decode_string_samples(buf, n_channels, last_timestamp, tdiff)
+
+        return decode_numeric_samples(buf, NUMERIC_FORMATS[channel_format], n_channels, last_timestamp, tdiff)
+
+    def _iter_chunk_contents(self, stream_id, chunk_indices=None):
+        chunks = self.sample_chunks[stream_id]
+        if chunk_indices is None:
+            chunk_indices = range(len(chunks))
+
+        with open_xdf(self.file_path) as f:
+            for i in chunk_indices:
+                offset, length, _ = chunks[i]
+                f.seek(offset)
+                buf = f.read(length)
+                if len(buf) < length:
+                    return  # truncated recording
+                yield i, buf
+
+    def read_numeric(self, stream_id, scale=None, out=None, start=None, stop=None, channels=None):
+        """Decode a numeric stream into a (n_channels, n_samples) float64 array.
+
+        `out` may be a preallocated (or memory-mapped) array of that shape. Values
+        are multiplied by `scale` while being copied in, so unit conversion doesn't
+        cost an extra full-size temporary. Returns (data, time_stamps).
+
+        `start`/`stop` select a sample range; only the chunks covering it are read.
+        This needs an index, and the time stamps of a partial read are interpolated
+        from the per-chunk time ranges, which is exact for dejittered streams.
+
+        `channels` selects a subset of channels (indices), in that order.
+        """
+        channel_format, n_channels, tdiff = self._stream_layout(stream_id)
+        dtype = NUMERIC_FORMATS[channel_format]
+        channels = slice(None) if channels is None else np.asarray(channels, dtype=np.int64)
+        n_out = n_channels if isinstance(channels, slice) else len(channels)
+
+        counts = np.array([n for _, _, n in self.sample_chunks[stream_id]], dtype=np.int64)
+        bounds = np.concatenate(([0], np.cumsum(counts)))
+        total = int(bounds[-1])
+
+        partial = start is not None or stop is not None
+        start = 0 if start is None else max(0, int(start))
+        stop = total if stop is None else min(total, int(stop))
+        stop = max(start, stop)
+        if partial and self.chunk_time_ranges is None:
+            raise ValueError('Reading a sample range requires XDFFile(..., use_index=True)')
+
+        chunk_indices = np.flatnonzero((bounds[:-1] < stop) & (bounds[1:] > start) & (counts > 0))
+
+        if out is None:
+            out = np.empty((n_out, stop - start))
+        time_stamps = np.zeros(stop - start)
+
+        pos = 0
+        last_timestamp = 0.0
+        for i, buf in self._iter_chunk_contents(stream_id, chunk_indices):
+            chunk_time_stamps, values = decode_numeric_samples(buf, dtype, n_channels, last_timestamp, tdiff)
+            last_timestamp = chunk_time_stamps[-1]
+
+            if partial:
+                first, last = self.chunk_time_ranges[stream_id][i]
+                chunk_time_stamps = np.linspace(first, last, len(chunk_time_stamps))
+
+            # Part of this chunk that falls into [start, stop)
+            lo = max(start - bounds[i], 0)
+            hi = min(stop - bounds[i], counts[i])
+            n = hi - lo
+
+            if scale is None:
+                out[:, pos:pos + n] = values[lo:hi, channels].T
+            else:
+                np.multiply(values[lo:hi, channels].T, scale, out=out[:, pos:pos + n])
+            time_stamps[pos:pos + n] = chunk_time_stamps[lo:hi]
+            pos += n
+
+        if not partial:
+            time_stamps = self._process_time_stamps(stream_id, time_stamps[:pos])
+
+        return out[:, :pos], time_stamps[:pos]
+
+    def read_strings(self, stream_id):
+        """Decode a string stream (e.g. markers). Returns (values, time_stamps)."""
+        all_values = []
+        all_time_stamps = []
+        last_timestamp = 0.0
+        for _, buf in self._iter_chunk_contents(stream_id):
+            time_stamps, values = self._decode_chunk(stream_id, buf, last_timestamp)
+            if len(time_stamps):
+                last_timestamp = time_stamps[-1]
+            all_values.extend(values)
+            all_time_stamps.append(time_stamps)
+
+        if stream_id in self.string_time_stamps:
+            return all_values, self.string_time_stamps[stream_id]
+
+        time_stamps = np.concatenate(all_time_stamps) if all_time_stamps else np.zeros(0)
+        return all_values, self._process_time_stamps(stream_id, time_stamps)
+
+    def _process_time_stamps(self, stream_id, time_stamps):
+        if len(time_stamps) == 0:
+            return time_stamps
+
+        # Reuse pyxdf's own clock sync and dejittering so that the results match
+        # pyxdf.load_xdf. These only look at time stamps, never at sample values.
+        stream = StreamData(self.headers[stream_id])
+        stream.time_stamps = time_stamps
+        stream.clock_times = self.clock_times[stream_id]
+        stream.clock_values = self.clock_values[stream_id]
+        streams = {stream_id: stream}
+
+        if self.synchronize_clocks:
+            _clock_sync(streams)
+        if self.dejitter_timestamps:
+            _jitter_removal(streams, 1, 500)
+
+        return stream.time_stamps
+
+
+def _footer_time_range(footer):
+    try:
+        info = footer['info']
+        return float(info['first_timestamp'][0]), float(info['last_timestamp'][0])
+    except (KeyError, IndexError, TypeError, ValueError):
+        return None
+
+
+def read_xdf_metadata(file_path, with_markers=False):
+    """Stream headers, sample counts and time ranges of an XDF file, without decoding samples.
+
+    Only the header, footer and clock offset chunks are parsed; sample chunks are
+    skipped after reading their sample count. The time range of a stream comes from
+    its footer, or from its first and last sample chunk if the recording has no
+    footer (e.g. it was cut short), and is clock-synchronized like pyxdf does.
+
+    Returns (file_header, streams), streams being a list of dicts with 'stream_id',
+    'info', 'n_samples', 'n_chunks', 'first_timestamp', 'last_timestamp',
+    'duration' and 'effective_srate'. With with_markers=True string streams also
+    get 'markers' and 'marker_time_stamps', decoded like XDFFile.read_strings().
+    """
+    xdf = XDFFile(file_path, dejitter_timestamps=False)
+
+    streams = []
+    for stream_id, header in xdf.headers.items():
+        n_samples = xdf.n_samples(stream_id)
+        stream = {
+            'stream_id': stream_id,
+            'info': header['info'],
+            'n_samples': n_samples,
+            'n_chunks': len(xdf.sample_chunks[stream_id]),
+            'first_timestamp': None,
+            'last_timestamp': None,
+            'duration': None,
+            'effective_srate': None,
+        }
+
+        time_range = _footer_time_range(xdf.footers.get(stream_id))
+        if time_range is None and n_samples:
+            time_range = xdf._chunk_time_range(stream_id)
+        if time_range is not None and n_samples:
+            first, last = xdf._process_time_stamps(stream_id, np.array(time_range))
+            stream['first_timestamp'] = first
+            stream['last_timestamp'] = last
+            stream['duration'] = last - first
+            if n_samples > 1 and last > first:
+                stream['effective_srate'] = (n_samples - 1) / (last - first)
+
+        if with_markers and xdf._stream_layout(stream_id)[0] == 'string':
+            stream['markers'], stream['marker_time_stamps'] = xdf.read_strings(stream_id)
+
+        streams.append(stream)
+
+    return xdf.file_header, streams
@@ -7,7 +7,8 @@ import pygame
 
 from mne_lsl.lsl import resolve_streams, StreamInlet
 
-from libs.filters import filter_and_drop_dead_channels
+from libs.channel_quality import ChannelQualityMeter, bad_channels
+from libs.filters import StreamingFilterBank
 from libs.parse import get_channels_from_xml_desc, parse_picks
 from libs.plot import plot_psd, plot_to_pygame
 
@@ -103,6 +104,7 @@ print("Sampling rate:", sampling_rate)
 print("Units:", stream_info.get_channel_units())
 
 max_seconds = 20
+QUALITY_HALF_LIFE_SECONDS = 5
 
 
 pygame.init()
@@ -120,29 +122,37 @@ wht = (255,255,255)
 TOP_MARGIN = 20
 LEFT_MARGIN = 20
 
-all_data = None
+# New samples are filtered once, as they arrive, and the unfiltered ones only go
+# through the quality meter, which looks mostly at the last few seconds
+filter_bank = StreamingFilterBank(sampling_rate, n_channels)
+quality_meter = ChannelQualityMeter(sampling_rate, n_channels, half_life_seconds=QUALITY_HALF_LIFE_SECONDS)
+filtered_data = None
 while True:
     # Pull data from the LSL stream
     data, _ = inlet.pull_chunk()
 
-    if all_data is None:
-        all_data = data.copy()
+    filtered = filter_bank.process(data.T * scale_factor)
+    quality_meter.update(data.T * scale_factor)
+    if filtered_data is None:
+        filtered_data = filtered
     else:
-        all_data = np.concatenate((all_data, data), axis=0)
+        filtered_data = np.concatenate((filtered_data, filtered), axis=1)
     
-    if len(all_data) > int(sampling_rate) * max_seconds:
-        all_data = all_data[-int(sampling_rate) * max_seconds:]
+    if filtered_data.shape[1] > int(sampling_rate) * max_seconds:
+        filtered_data = filtered_data[:, -int(sampling_rate) * max_seconds:]
 
-    print("All data", len(all_data))
+    print("All data", filtered_data.shape[1])
     print("Pulled data", len(data))
 
 
     if len(data) > 0:
         # Convert data to a NumPy array
-        print(f"All data shape: {all_data.shape}")
+        print(f"All data shape: {filtered_data.shape}")
 
-        raw = mne.io.RawArray(all_data.T * scale_factor, mne.create_info(names, sampling_rate, ch_types='eeg'))
-        filter_and_drop_dead_channels(raw, None)
+        raw = mne.io.RawArray(filtered_data, mne.create_info(names, sampling_rate, ch_types='eeg'))
+        bad = bad_channels(quality_meter.result(names))
+        raw.drop_channels([name for name, reasons in bad.items() if 'flat' in reasons])
+        raw.set_montage('standard_1020')
         if picks:
             raw.pick_channels(picks)
 
@@ -172,7 +182,10 @@ while True:
             screen.blit(plot_to_pygame(agg, fig), (LEFT_MARGIN, TOP_MARGIN + psd_plot_pygame_image.get_height() + 20))
 
 
-        rms_text = f"uvRMS = {int(min(uvrms)):2d}‥{int(max(uvrms)):<3d}  {' '.join(f"{int(d):2d}" for d in uvrms)}"
+        rms_text = f"uvRMS = {int(min(uvrms)):2d}‥{int(max(uvrms)):<3d}  {' '.join(f'{int(d):2d}' for d in uvrms)}"
+        noisy = [f"{name} ({', '.join(reasons)})" for name, reasons in bad.items() if 'flat' not in reasons]
+        if noisy:
+            rms_text += "  bad: " + ", ".join(noisy)
         text = font.render(rms_text, True, black) 
         screen.blit(text, (LEFT_MARGIN / 2, TOP_MARGIN / 2))
 
@@ -7,7 +7,8 @@ import pyglet
 
 from mne_lsl.lsl import resolve_streams, StreamInlet
 
-from libs.filters import filter_and_drop_dead_channels
+from libs.channel_quality import ChannelQualityMeter, bad_channels
+from libs.filters import StreamingFilterBank
 from libs.parse import get_channels_from_xml_desc
 from libs.plot import plot_psd
 
@@ -109,6 +110,7 @@ print("Sampling rate:", sampling_rate)
 print("Units:", stream_info.get_channel_units())
 
 max_seconds = 20
+QUALITY_HALF_LIFE_SECONDS = 5
 
 window = pyglet.window.Window(1000, 1000)
 print('Pixel ratio', window.get_pixel_ratio())
@@ -119,7 +121,11 @@ label = pyglet.text.Label('', font_name='monospace', font_size=18, x=10, y=10, c
 TOP_MARGIN = 20
 LEFT_MARGIN = 20
 
-all_data = None
+# New samples are filtered once, as they arrive, and the unfiltered ones only go
+# through the quality meter, which looks mostly at the last few seconds
+filter_bank = StreamingFilterBank(sampling_rate, n_channels)
+quality_meter = ChannelQualityMeter(sampling_rate, n_channels, half_life_seconds=QUALITY_HALF_LIFE_SECONDS)
+filtered_data = None
 
 @window.event
 def on_draw():
@@ -136,22 +142,26 @@ def on_draw():
 
 
 def update(dt):
-    global all_data, psd_plot_pyglet_image, raw_plot_pyglet_image, label
+    global filtered_data, psd_plot_pyglet_image, raw_plot_pyglet_image, label
 
     # Pull data from the LSL stream
     data, _ = inlet.pull_chunk()
 
-    if all_data is None:
-        all_data = data.copy()
+    filtered = filter_bank.process(data.T * scale_factor)
+    quality_meter.update(data.T * scale_factor)
+    if filtered_data is None:
+        filtered_data = filtered
     else:
-        all_data = np.concatenate((all_data, data), axis=0)
+        filtered_data = np.concatenate((filtered_data, filtered), axis=1)
     
-    if len(all_data) > int(sampling_rate) * max_seconds:
-        all_data = all_data[-int(sampling_rate) * max_seconds:]
+    if filtered_data.shape[1] > int(sampling_rate) * max_seconds:
+        filtered_data = filtered_data[:, -int(sampling_rate) * max_seconds:]
 
     if len(data) > 0:
-        raw = mne.io.RawArray(all_data.T * scale_factor, mne.create_info(names, sampling_rate, ch_types='eeg'))
-        filter_and_drop_dead_channels(raw, None)
+        raw = mne.io.RawArray(filtered_data, mne.create_info(names, sampling_rate, ch_types='eeg'))
+        bad = bad_channels(quality_meter.result(names))
+        raw.drop_channels([name for name, reasons in bad.items() if 'flat' in reasons])
+        raw.set_montage('standard_1020')
 
         second_before_the_last_data = raw.get_data(start=len(raw.times) - int(sampling_rate) * 2, stop=len(raw.times) - int(sampling_rate))
         uvrms = np.sqrt(np.mean(second_before_the_last_data ** 2, axis=1)) * 1e6
@@ -165,7 +175,10 @@ def update(dt):
             fig = plot_raw_eeg(raw, max_seconds, start_offset=1.5, end_offset=1.5)
             raw_plot_pyglet_image = plot_to_pyglet(agg, fig)
 
-        rms_text = f"uvRMS = {int(min(uvrms)):2d}‥{int(max(uvrms)):<3d}  {' '.join(f"{int(d):2d}" for d in uvrms)}"
+        rms_text = f"uvRMS = {int(min(uvrms)):2d}‥{int(max(uvrms)):<3d}  {' '.join(f'{int(d):2d}' for d in uvrms)}"
+        noisy = [f"{name} ({', '.join(reasons)})" for name, reasons in bad.items() if 'flat' not in reasons]
+        if noisy:
+            rms_text += "  bad: " + ", ".join(noisy)
         label.text = rms_text
 
 pyglet.clock.schedule_interval(update, 0.3)
@@ -10,11 +10,10 @@ from libs.file_formats import load_recording
 from libs.filters import filter_and_drop_dead_channels
 from libs.plot import plot_psd
 from libs.parse import parse_picks
-from libs.psd import get_peak_alpha_freq
+from libs.psd import get_peak_alpha_freq, peak_alpha_freqs, sliding_welch
+from libs.specparam_fit import fit_spectra, strongest_band_peak
 
-from specparam import SpectralModel, SpectralGroupModel
 from specparam.bands import Bands
-from specparam.analysis import get_band_peak_group
 
 parser = argparse.ArgumentParser(
                     prog='alpha_from_xdf',
@@ -43,39 +42,36 @@ bands = Bands({'theta': [3, 7],
 def iaf_original(psd):
     return get_peak_alpha_freq(psd)
 
-def iaf_specparam(psd):
+def iaf_specparam(psd, n_jobs=1):
     psd_values, freqs = psd.get_data(return_freqs=True)
 
-    fg = SpectralGroupModel(max_n_peaks=6)
-    fg.fit(freqs, psd_values, [3, 45])
-    alpha_peaks = get_band_peak_group(fg, bands['alpha'])
-    res = None
-    if alpha_peaks.size > 0:
-        res = alpha_peaks[np.argmax(alpha_peaks[:, 1]), 0]  # Get frequency of highest power peak
+    # Frequency of the highest power alpha peak over all channels
+    fits = fit_spectra(freqs, psd_values, [3, 45], settings={'max_n_peaks': 6}, n_jobs=n_jobs)
+    res = strongest_band_peak(fits, bands['alpha'])
 
     if not np.isnan(res):
-        return res
-    
+        return float(res)
+
     return None
 
 
-def sliding_window_iaf(raw, iaf_method, window_size=5, step_size=1):
-    iaf_estimates = []
-    
-    for start in range(0, len(raw.times) - int(window_size * raw.info['sfreq']), int(step_size * raw.info['sfreq'])):
-        t0 = time.perf_counter()
-
-        end = start + int(window_size * raw.info['sfreq'])
-        window_raw = raw.copy().crop(tmin=raw.times[start], tmax=raw.times[end])
-        window_psd = window_raw.compute_psd(fmin=1.0, fmax=45.0)
-        
-        iaf = iaf_method(window_psd)
-        print("IAF estimation took", time.perf_counter() - t0, "seconds")
-
-        if iaf is not None:
-            iaf_estimates.append(iaf)
-    
-    return np.array(iaf_estimates)
+def sliding_window_iaf(raw, method='original', window_size=5, step_size=1, n_jobs=1):
+    # PSDs of all windows at once; with specparam all windows x channels are
+    # fitted as one batch over n_jobs processes, and cached fits are reused
+    t0 = time.perf_counter()
+
+    n_fft = min(2048, int(round(window_size * raw.info['sfreq'])) + 1)
+    sliding = sliding_welch(raw.get_data(), raw.info['sfreq'], window_size, step_size,
+                            fmin=1.0, fmax=45.0, n_fft=n_fft)
+
+    if method == 'specparam':
+        fits = fit_spectra(sliding.freqs, sliding.psds, [3, 45], settings={'max_n_peaks': 6}, n_jobs=n_jobs)
+        iaf_estimates = strongest_band_peak(fits, bands['alpha'])
+    else:
+        iaf_estimates = peak_alpha_freqs(sliding.psds, sliding.freqs)
+
+    print(f"IAF estimation of {len(sliding.times)} windows took", time.perf_counter() - t0, "seconds")
+    return iaf_estimates[~np.isnan(iaf_estimates)]
 
 
 def plot_iaf_histogram(ax, iaf_estimates, freq_resolution, color, label):
@@ -220,7 +216,7 @@ def plot_spectrogram(raw, single_best_plot=True, multitaper=True, morlet=False,
     return fig_main
 
 # Main script
-raw = load_recording(input_filename)
+raw = load_recording(input_filename, preload=False)
 filter_and_drop_dead_channels(raw, picks)
 
 psd = raw.compute_psd(fmin=1.0, fmax=45.0)
@@ -258,8 +254,8 @@ if preset_output_png:
     sys.exit(0)
 
 # # Perform sliding window IAF estimation using both methods
-# iaf_estimates_original = sliding_window_iaf(raw, iaf_original, window_size=5, step_size=1)
-# iaf_estimates_specparam = sliding_window_iaf(raw, iaf_specparam, window_size=5, step_size=1)
+# iaf_estimates_original = sliding_window_iaf(raw, 'original', window_size=5, step_size=1)
+# iaf_estimates_specparam = sliding_window_iaf(raw, 'specparam', window_size=5, step_size=1, n_jobs=-1)
 # print("Specparam method IAF estimates:", iaf_estimates_specparam)
 
 # # Plot IAF histograms
@@ -4,6 +4,7 @@ import re
 from io import BytesIO
 
 import mne
+from mne.time_frequency import SpectrumArray
 import mpld3
 import numpy as np
 import matplotlib.pyplot as plt
@@ -13,6 +14,7 @@ from libs.file_formats import load_recording
 from libs.filters import filter_and_drop_dead_channels
 from libs.plot import plot_psd
 from libs.parse import parse_picks
+from libs.psd import PEAK_METHODS, fit_aperiodic, peak_alpha_freqs, psd_to_mean_db, sliding_welch
 
 
 parser = argparse.ArgumentParser(
@@ -26,6 +28,14 @@ parser.add_argument('--chunk-duration', type=float, default=90.0, help='Duration
 parser.add_argument('--chunk-shift', type=float, default=0.5, help='Shift between chunks in seconds')
 parser.add_argument('--picks', type=str, default=None, help='Comma or space-separated list of channels to use')
 parser.add_argument('--separate-channels', action='store_true', help='Plot each channel separately')
+parser.add_argument('--tmin', type=float, default=None, help='Only analyze the recording from this time (seconds)')
+parser.add_argument('--tmax', type=float, default=None, help='Only analyze the recording up to this time (seconds)')
+parser.add_argument('--psd-plot-every', type=float, default=None,
+                    help='Only dump the PSD plot of a chunk every this many seconds (default: every chunk)')
+parser.add_argument('--robust-fit', action='store_true', help='Leave spectral peaks out of the 1/f fit')
+parser.add_argument('--peak-method', choices=PEAK_METHODS, default='argmax',
+                    help='How the peak alpha frequency is picked: the biggest bin, interpolated between bins '
+                         '(parabolic, gaussian) or the alpha band centre of gravity (cog)')
 
 args = parser.parse_args()
 
@@ -55,39 +65,36 @@ def format_time(seconds):
 
 
 # Load the MNE Raw file
-raw = load_recording(input_filename)
+raw = load_recording(input_filename, tmin=args.tmin, tmax=args.tmax, preload=False)
 filter_and_drop_dead_channels(raw, picks)
 
 
 
-n_chunks = int(np.floor((raw.times[-1] - chunk_duration) / chunk_shift)) + 1
+# The PSD of every chunk at once: each Welch segment is transformed only once,
+# however many chunks it is part of
+sliding = sliding_welch(raw.get_data(), raw.info['sfreq'], chunk_duration, chunk_shift, fmin=1.0, fmax=45.0)
+n_chunks = len(sliding.times)
 
+peak_freqs = peak_alpha_freqs(sliding.psds, sliding.freqs, args.peak_method)
+# The 1/f fits of all chunks in one go
+dbs = fit_aperiodic(psd_to_mean_db(sliding.psds), sliding.freqs, 3, 40, peak_freqs=peak_freqs,
+                    robust=args.robust_fit).delta_db
 
-peak_alpha_freqs = []
-dbs = []
-
+plot_every = max(1, int(round(args.psd_plot_every / chunk_shift))) if args.psd_plot_every else 1
 psd_figs = []
-
-# Iterate over the raw data in chunks
-for i in range(n_chunks):
-    print(f'Processing chunk {i + 1}/{n_chunks}')
+for i in range(0, n_chunks, plot_every):
+    print(f'Plotting chunk {i + 1}/{n_chunks}')
     tmin = i * chunk_shift
     tmax = i * chunk_shift + chunk_duration
-    
-    # Get the data for the current chunk
-    chunk_data = raw.copy().crop(tmin=tmin, tmax=tmax)
 
-    psd = chunk_data.compute_psd(fmin=1.0, fmax=45.0)
-
-    fig, iaf_stats = plot_psd(psd, title=f'PSD for time {format_time(tmin)}..{format_time(tmax)}', average=not separate_channels)
-    
+    psd = SpectrumArray(sliding.psds[i], raw.info, sliding.freqs, verbose=False)
+    fig, _ = plot_psd(psd, title=f'PSD for time {format_time(tmin)}..{format_time(tmax)}', average=not separate_channels,
+                      robust_fit=args.robust_fit, peak_method=args.peak_method)
     psd_figs.append(fig)
-    peak_alpha_freqs.append(iaf_stats.peak_alpha_freq)
-    dbs.append(iaf_stats.delta_db)
 
 # Create the first chart for peak alpha frequency
 fig1, ax1 = plt.subplots()
-ax1.plot(np.arange(n_chunks) * chunk_shift, peak_alpha_freqs)
+ax1.plot(np.arange(n_chunks) * chunk_shift, peak_freqs)
 ax1.set_xlabel('Time (s)')
 ax1.set_ylabel('Peak Alpha Frequency (Hz)')
 ax1.set_title('Peak Alpha Frequency over Time')
@@ -4,7 +4,7 @@ import mne
 import numpy as np
 import matplotlib.pyplot as plt
 
-from libs.file_formats import load_raw_xdf
+from libs.file_formats import load_recording
 from libs.filters import filter_and_drop_dead_channels
 from libs.parse import parse_picks
 from libs.plot import add_red_line_with_value, plot_psd
@@ -47,7 +47,7 @@ def plot_subtracted_data(subtracted_data, freqs):
 
 input_xdf_filename = sys.argv[1]
 
-raw = load_raw_xdf(input_xdf_filename)
+raw = load_recording(input_xdf_filename, preload=False)
 filter_and_drop_dead_channels(raw, picks=parse_picks(None))
 
 eyes_open_psd = concatenate_and_get_psd(get_raws_from_annotations(raw.annotations, "/open"))
@@ -7,7 +7,12 @@ import matplotlib.pyplot as plt
 from libs.file_formats import load_recording
 from libs.filters import filter_and_drop_dead_channels
 
-raw = load_recording(sys.argv[1])
+# Define the time range to plot (first 10 seconds)
+start_time = 5
+end_time = 15
+
+# Only load what is plotted, plus a few seconds so the filter edge effects stay out of the plot
+raw = load_recording(sys.argv[1], tmin=0, tmax=end_time + 5)
 filter_and_drop_dead_channels(raw, None)
 
 # Get the data, channel names, and sampling frequency
@@ -15,9 +20,6 @@ data = raw.get_data()
 ch_names = raw.ch_names
 sfreq = raw.info['sfreq']
 
-# Define the time range to plot (first 10 seconds)
-start_time = 5
-end_time = 15
 start_sample = int(start_time * sfreq)
 end_sample = int(end_time * sfreq)
 
@@ -5,14 +5,12 @@ import numpy as np
 import matplotlib.pyplot as plt
 import mne
 
-from specparam import SpectralModel, SpectralGroupModel
 from specparam.bands import Bands
-from specparam.analysis import get_band_peak_group
-from specparam.plts.spectra import plot_spectra
 
 
-from libs.file_formats import load_raw_xdf
+from libs.file_formats import load_recording
 from libs.filters import filter_and_drop_dead_channels
+from libs.specparam_fit import band_peaks, fit_spectra, group_model
 
 
 
@@ -40,23 +38,27 @@ bands = Bands({'theta': [3, 7],
 
 input_filename = sys.argv[1]
 
-raw = load_raw_xdf(input_filename)
+raw = load_recording(input_filename)
 filter_and_drop_dead_channels(raw, None)
 print(raw.ch_names)
 
 psd = raw.compute_psd(fmin=1.0, fmax=45.0)
 psd_values, psd_freqs = psd.get_data(return_freqs=True)
 
-fg = SpectralGroupModel()
+# specparam's default settings; channels are fitted in parallel and cached fits reused
+fits = fit_spectra(psd_freqs, psd_values, [3, 45], settings={}, n_jobs=-1)
 print(psd_freqs.shape, psd_values.shape)
-fg.report(psd_freqs, psd_values, [3, 45])
+# What fg.report() shows, from the fits above
+fg = group_model(fits, psd_freqs, psd_values, [3, 45], settings={})
+fg.plot()
+fg.print_results(False)
 
 # Plot the topographies across different frequency bands
 fig, axes = plt.subplots(1, 3, figsize=(15, 5))
 for ind, (label, band_def) in enumerate(bands):
 
     # Get the power values across channels for the current band
-    band_power = check_nans(get_band_peak_group(fg, band_def)[:, 1])
+    band_power = check_nans(band_peaks(fits, band_def)[:, 1])
     print("Band def", band_def)
     print("Band power", band_power.shape, band_power)
 
@@ -71,7 +73,7 @@ fig, axes = plt.subplots(1, 3, figsize=(15, 6))
 for ind, (label, band_def) in enumerate(bands):
 
     # Get the power values across channels for the current band
-    band_power = check_nans(get_band_peak_group(fg, band_def)[:, 1])
+    band_power = check_nans(band_peaks(fits, band_def)[:, 1])
 
     channel_index = np.argmax(band_power)
     # Extracted and plot the power spectrum model with the most band power
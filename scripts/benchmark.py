@@ -0,0 +1,346 @@
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Callable, Optional
+
+import numpy as np
+
+# Benchmarks that draw with pygame run without a window unless told otherwise
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+os.environ.setdefault("PYGAME_HIDE_SUPPORT_PROMPT", "1")
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SAMPLE_DATA_DIR = os.path.join(REPO_DIR, "sample_data")
+
+# A run is a regression if it is this much slower than the one it's compared with
+DEFAULT_TOLERANCE = 0.2
+
+
+@dataclass
+class Workload:
+    run: Callable[[], object]
+    work: float          # units of work one run() does, for the throughput
+    unit: str
+    # Extra numbers from the last run, e.g. the timing summaries of run_flicker()
+    extra: Optional[Callable[[object], dict]] = None
+
+
+def synthetic_eeg(seconds: float, n_channels: int, sfreq: float, seed: int = 0) -> np.ndarray:
+    # Brown-ish noise with a 10 Hz rhythm and 50 Hz hum, in volts
+    rng = np.random.default_rng(seed)
+    n_samples = int(seconds * sfreq)
+    t = np.arange(n_samples) / sfreq
+    data = rng.standard_normal((n_channels, n_samples)).cumsum(axis=1) * 0.3e-6
+    data += 10e-6 * np.sin(2 * np.pi * 10 * t) + 5e-6 * np.sin(2 * np.pi * 50 * t)
+    data += rng.standard_normal((n_channels, n_samples)) * 2e-6
+    return data
+
+
+def synthetic_raw(args):
+    import mne
+    ch_names = mne.channels.make_standard_montage("standard_1020").ch_names[:args.channels]
+    info = mne.create_info(ch_names, args.sfreq, ch_types="eeg", verbose=False)
+    return mne.io.RawArray(synthetic_eeg(args.seconds, len(ch_names), args.sfreq), info, verbose=False)
+
+
+def write_openbci_txt(file_path: str, data: np.ndarray, sfreq: float) -> None:
+    # The layout of an OpenBCI GUI v5 export, EXG channels in microvolts
+    n_channels, n_samples = data.shape
+    columns = (["Sample Index"] + [f"EXG Channel {i}" for i in range(n_channels)]
+               + ["Accel Channel 0", "Accel Channel 1", "Accel Channel 2", "Timestamp"])
+    table = np.column_stack([
+        np.arange(n_samples) % 256, data.T * 1e6, np.zeros((n_samples, 3)),
+        1.7e9 + np.arange(n_samples) / sfreq,
+    ])
+    with open(file_path, "w") as f:
+        f.write(f"%OpenBCI Raw EXG Data\n%Number of channels = {n_channels}\n%Sample Rate = {sfreq:g} Hz\n"
+                f"%Board = OpenBCI_GUI$BoardCytonSerialDaisy\n")
+        f.write(", ".join(columns) + "\n")
+        np.savetxt(f, table, fmt=["%.1f"] + ["%.6f"] * (n_channels + 3) + ["%.6f"], delimiter=", ")
+
+
+# ---------- benchmarks ----------
+# Each one does its setup and returns a Workload; only Workload.run() is timed
+
+def bench_load_sample_data(args, tmp_dir):
+    from libs.file_formats import load_recording
+    paths = [os.path.join(SAMPLE_DATA_DIR, name) for name in sorted(os.listdir(SAMPLE_DATA_DIR))
+             if name.endswith((".xdf", ".bdf", ".txt", ".csv"))]
+    n_values = sum(raw.n_times * raw.info["nchan"] for raw in
+                   (load_recording(path, cache=False, preload=False) for path in paths))
+    return Workload(lambda: [load_recording(path, cache=False) for path in paths], n_values, "samples/s")
+
+
+def bench_load_openbci_txt(args, tmp_dir):
+    from libs.file_formats import load_recording
+    path = os.path.join(tmp_dir, "synthetic-openbci.txt")
+    data = synthetic_eeg(args.seconds, args.channels, args.sfreq)
+    write_openbci_txt(path, data, args.sfreq)
+    return Workload(lambda: load_recording(path, cache=False), data.size, "samples/s")
+
+
+def bench_load_openbci_txt_lazy_pick(args, tmp_dir):
+    from libs.file_formats import load_recording
+    path = os.path.join(tmp_dir, "synthetic-openbci.txt")
+    write_openbci_txt(path, synthetic_eeg(args.seconds, args.channels, args.sfreq), args.sfreq)
+
+    def run():
+        raw = load_recording(path, cache=False, preload=False)
+        raw.pick(raw.ch_names[:2]).load_data(verbose=False)
+        return raw
+
+    return Workload(run, 2 * int(args.seconds * args.sfreq), "samples/s")
+
+
+def bench_filter_and_drop_dead_channels(args, tmp_dir):
+    from libs.filters import filter_and_drop_dead_channels
+    raw = synthetic_raw(args)
+
+    def run():
+        copy = raw.copy()
+        filter_and_drop_dead_channels(copy, None)
+        return copy
+
+    return Workload(run, raw.n_times * raw.info["nchan"], "samples/s")
+
+
+def bench_compute_psd(args, tmp_dir):
+    raw = synthetic_raw(args)
+    return Workload(lambda: raw.compute_psd(fmin=1.0, fmax=45.0, verbose=False),
+                    raw.n_times * raw.info["nchan"], "samples/s")
+
+
+def bench_fit_one_over_f_curve(args, tmp_dir):
+    from libs.psd import fit_one_over_f_curve, get_peak_alpha_freq
+    psd = synthetic_raw(args).compute_psd(fmin=1.0, fmax=45.0, verbose=False)
+    n_fits = 20
+
+    def run():
+        for _ in range(n_fits):
+            fit_one_over_f_curve(psd, 2.0, 40.0, get_peak_alpha_freq(psd))
+
+    return Workload(run, n_fits, "fits/s")
+
+
+def bench_fit_aperiodic(args, tmp_dir):
+    from libs.psd import fit_aperiodic, sliding_welch
+    raw = synthetic_raw(args)
+    sliding = sliding_welch(raw.get_data(), args.sfreq, min(90.0, args.seconds / 2), 0.5, fmin=1.0, fmax=45.0)
+    psds_db = 10 * np.log10(sliding.psds * 1e12)
+    return Workload(lambda: fit_aperiodic(psds_db, sliding.freqs, 3, 40, robust=True),
+                    psds_db.shape[0] * psds_db.shape[1], "fits/s")
+
+
+def bench_draw_glass(args, tmp_dir):
+    import pygame
+    from scripts.glass import draw_glass
+    size = 800
+    surface = pygame.Surface((size, size))
+    n_stimuli = 20
+
+    def run():
+        for seed in range(n_stimuli):
+            draw_glass(surface, (size // 2, size // 2), size, 0.0, 0.24, 0.03, 8.0, 2, "cw", seed=seed)
+
+    return Workload(run, n_stimuli, "stimuli/s")
+
+
+def bench_plot_to_pygame(args, tmp_dir):
+    import matplotlib
+    matplotlib.use("Agg")
+    import matplotlib.backends.backend_agg as agg
+
+    from libs.plot import plot_psd, plot_to_pygame
+    fig, _ = plot_psd(synthetic_raw(args).compute_psd(fmin=1.0, fmax=45.0, verbose=False), title="PSD")
+    n_frames = 10
+
+    def run():
+        for _ in range(n_frames):
+            plot_to_pygame(agg, fig)
+
+    return Workload(run, n_frames, "frames/s")
+
+
+def bench_run_flicker(args, tmp_dir, update_rect=False):
+    import pygame
+    from scripts.flicker import run_flicker
+    pygame.init()
+    screen = pygame.display.set_mode((800, 600))
+    rect = pygame.Rect(250, 150, 300, 300)
+    frequency, refresh_rate, cycles = 10.0, 120.0, 60
+
+    def run():
+        return run_flicker(screen, rect, frequency=frequency, target_min_refresh_rate=refresh_rate,
+                           target_max_refresh_rate=refresh_rate, cycles=cycles, report_every=10 ** 9,
+                           update_rect=update_rect)
+
+    n_frames = cycles * int(refresh_rate / frequency)
+    return Workload(run, n_frames, "frames/s", extra=lambda stats: {
+        "err_post_ms": stats["err_post"], "flip_ms": stats["flip_ms"], "draw_ms": stats["draw_ms"],
+        "scheduler": stats["scheduler"],
+    })
+
+
+def bench_run_flicker_update_rect(args, tmp_dir):
+    # Presenting only the flicker rect; compare its flip_ms with run_flicker's
+    return bench_run_flicker(args, tmp_dir, update_rect=True)
+
+
+BENCHMARKS = {
+    "load_sample_data": bench_load_sample_data,
+    "load_openbci_txt": bench_load_openbci_txt,
+    "load_openbci_txt_lazy_pick": bench_load_openbci_txt_lazy_pick,
+    "filter_and_drop_dead_channels": bench_filter_and_drop_dead_channels,
+    "compute_psd": bench_compute_psd,
+    "fit_one_over_f_curve": bench_fit_one_over_f_curve,
+    "fit_aperiodic": bench_fit_aperiodic,
+    "draw_glass": bench_draw_glass,
+    "plot_to_pygame": bench_plot_to_pygame,
+    "run_flicker": bench_run_flicker,
+    "run_flicker_update_rect": bench_run_flicker_update_rect,
+}
+
+
+def max_rss_mb() -> float:
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss / (1024 ** 2 if sys.platform == "darwin" else 1024)
+
+
+def run_benchmark(name: str, args: argparse.Namespace, queue) -> None:
+    # Runs in a fresh process, so that the peak RSS is this benchmark's own
+    sys.path.insert(0, REPO_DIR)
+    import mne
+    mne.set_log_level("ERROR")
+
+    try:
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            rss_before = max_rss_mb()
+            workload = BENCHMARKS[name](args, tmp_dir)
+
+            # Untimed runs first: the first call pays for lazy imports and caches
+            for _ in range(args.warmup):
+                workload.run()
+
+            times = []
+            result = None
+            for _ in range(args.repeat):
+                start = time.perf_counter()
+                result = workload.run()
+                times.append(time.perf_counter() - start)
+
+            best = min(times)
+            queue.put({
+                "wall_s": best,
+                "wall_s_median": float(np.median(times)),
+                "repeats": len(times),
+                "throughput": workload.work / best,
+                "unit": workload.unit,
+                "peak_rss_mb": round(max_rss_mb(), 1),
+                "rss_increase_mb": round(max_rss_mb() - rss_before, 1),
+                **({"extra": workload.extra(result)} if workload.extra else {}),
+            })
+    except Exception as e:
+        queue.put({"error": f"{type(e).__name__}: {e}"})
+
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=REPO_DIR, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results: dict, params: dict, baseline_path: str, tolerance: float) -> list[str]:
+    with open(baseline_path) as f:
+        baseline_run = json.load(f)
+    baseline = baseline_run["results"]
+
+    regressions = []
+    print(f"\nCompared with {baseline_path}:")
+    if baseline_run.get("params") != params:
+        print(f"  Warning: different parameters ({baseline_run.get('params')}), times aren't comparable")
+    for name, result in results.items():
+        old = baseline.get(name, {})
+        if "wall_s" not in result or "wall_s" not in old:
+            continue
+        ratio = result["wall_s"] / old["wall_s"]
+        flag = "  REGRESSION" if ratio > 1 + tolerance else ""
+        print(f"  {name:32s} {old['wall_s'] * 1e3:10.1f} ms -> {result['wall_s'] * 1e3:10.1f} ms  "
+              f"({ratio:.2f}x){flag}")
+        if flag:
+            regressions.append(name)
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Time the loaders, filters, PSD and rendering hot paths; headless by default")
+    parser.add_argument("benchmarks", nargs="*", help=f"Benchmarks to run (default: all of {', '.join(BENCHMARKS)})")
+    parser.add_argument("--seconds", type=float, default=600.0, help="Length of the synthetic recordings")
+    parser.add_argument("--channels", type=int, default=16, help="Channel count of the synthetic recordings")
+    parser.add_argument("--sfreq", type=float, default=250.0, help="Sampling rate of the synthetic recordings")
+    parser.add_argument("--repeat", type=int, default=3, help="Runs per benchmark; the fastest one is reported")
+    parser.add_argument("--warmup", type=int, default=1, help="Untimed runs before the timed ones")
+    parser.add_argument("--output", type=str, default=None,
+                        help="Where to save the JSON results (default: benchmarks/<date>-<commit>.json)")
+    parser.add_argument("--compare", type=str, default=None, help="Earlier JSON results to compare with")
+    parser.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE,
+                        help="Slowdown that counts as a regression, as a fraction")
+    args = parser.parse_args()
+
+    names = args.benchmarks or list(BENCHMARKS)
+    unknown = [name for name in names if name not in BENCHMARKS]
+    if unknown:
+        parser.error(f"Unknown benchmarks: {', '.join(unknown)}")
+
+    commit = git_commit()
+    context = multiprocessing.get_context("spawn")
+    results = {}
+    for name in names:
+        queue = context.Queue()
+        process = context.Process(target=run_benchmark, args=(name, args, queue))
+        process.start()
+        process.join()
+        result = queue.get() if not queue.empty() else {"error": f"exit code {process.exitcode}"}
+        results[name] = result
+
+        if "error" in result:
+            print(f"{name:32s} failed: {result['error']}")
+        else:
+            print(f"{name:32s} {result['wall_s'] * 1e3:10.1f} ms  {result['throughput']:12.1f} {result['unit']:10s}"
+                  f"  peak RSS {result['peak_rss_mb']:.0f} MB")
+
+    params = {"seconds": args.seconds, "channels": args.channels, "sfreq": args.sfreq, "repeat": args.repeat,
+              "warmup": args.warmup}
+    output = args.output or os.path.join(
+        "benchmarks", f"{datetime.now():%Y%m%d-%H%M%S}{'-' + commit if commit else ''}.json")
+    os.makedirs(os.path.dirname(output) or ".", exist_ok=True)
+    with open(output, "w") as f:
+        json.dump({
+            "created": datetime.now().isoformat(timespec="seconds"),
+            "commit": commit,
+            "python": sys.version.split()[0],
+            "platform": platform.platform(),
+            "sdl_videodriver": os.environ.get("SDL_VIDEODRIVER"),
+            "params": params,
+            "results": results,
+        }, f, indent=2)
+    print(f"Saved {output}")
+
+    if args.compare and compare(results, params, args.compare, args.tolerance):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -10,17 +10,25 @@ def calculate_flicker_rates(refresh_rates):
                 flicker_rates.append((round(flicker_rate, 2), refresh_rate, off_frames))
     return flicker_rates
 
-refresh_rates = [165, 144, 120, 100] if len(sys.argv) == 1 else [int(arg) for arg in sys.argv[1:]]
+def closest_flicker_rate(frequency, refresh_rates):
+    # (flicker_rate, refresh_rate, off_frames) closest to frequency, None if nothing is in 6..14 Hz
+    return min(calculate_flicker_rates(refresh_rates), key=lambda rate: abs(rate[0] - frequency), default=None)
 
-results = calculate_flicker_rates(refresh_rates)
-sorted_results = sorted(results, reverse=True)
+def main():
+    refresh_rates = [165, 144, 120, 100] if len(sys.argv) == 1 else [int(arg) for arg in sys.argv[1:]]
 
-print("Flicker rates between 6 and 14 Hz, sorted in decreasing order:")
-prev_rate = None
-for i, (flicker_rate, refresh_rate, off_frames) in enumerate(sorted_results):
-    if i == 0:
-        print(f"{flicker_rate:.2f} @ {refresh_rate} Hz with 1 on and {off_frames} off")
-    else:
-        delta = prev_rate - flicker_rate
-        print(f"{flicker_rate:.2f} @ {refresh_rate} Hz Δ{delta:.2f} with 1 on and {off_frames} off")
-    prev_rate = flicker_rate
\ No newline at end of file
+    results = calculate_flicker_rates(refresh_rates)
+    sorted_results = sorted(results, reverse=True)
+
+    print("Flicker rates between 6 and 14 Hz, sorted in decreasing order:")
+    prev_rate = None
+    for i, (flicker_rate, refresh_rate, off_frames) in enumerate(sorted_results):
+        if i == 0:
+            print(f"{flicker_rate:.2f} @ {refresh_rate} Hz with 1 on and {off_frames} off")
+        else:
+            delta = prev_rate - flicker_rate
+            print(f"{flicker_rate:.2f} @ {refresh_rate} Hz Δ{delta:.2f} with 1 on and {off_frames} off")
+        prev_rate = flicker_rate
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,250 @@
+import argparse
+import os
+import sqlite3
+import time
+from collections import Counter
+from typing import Optional
+
+import mne
+
+from libs.cache import file_content_hash
+from libs.file_formats import load_recording
+from libs.filters import find_dead_channels, get_filter_plan
+from libs.parse import parse_picks
+from libs.psd import ALPHA_CHANNELS, get_peak_alpha_freq
+
+# Recordings load_recording() can open
+EXTENSIONS = ('.xdf', '.txt', '.csv', '.bdf', '.edf', '.vhdr', '.fif')
+
+# Bump when the derived features change, so that the next scan recomputes them
+# (2: BAD_*/EDGE annotations are no longer counted as markers)
+FEATURES_VERSION = 2
+
+SCHEMA = """
+PRAGMA journal_mode=WAL;
+PRAGMA synchronous=NORMAL;
+CREATE TABLE IF NOT EXISTS recording(
+  path TEXT PRIMARY KEY,
+  size INTEGER,
+  mtime_ns INTEGER,
+  hash TEXT,
+  format TEXT,
+  meas_date TEXT,
+  duration_s REAL,
+  sfreq REAL,
+  n_channels INTEGER,
+  n_markers INTEGER,
+  peak_alpha_hz REAL,
+  peak_alpha_channels TEXT,
+  features_version INTEGER,
+  error TEXT,
+  scanned_at REAL
+);
+CREATE INDEX IF NOT EXISTS recording_hash ON recording(hash);
+CREATE TABLE IF NOT EXISTS channel(
+  path TEXT,
+  name TEXT,
+  type TEXT,
+  PRIMARY KEY (path, name)
+);
+CREATE INDEX IF NOT EXISTS channel_name ON channel(name);
+CREATE TABLE IF NOT EXISTS marker(
+  path TEXT,
+  description TEXT,
+  count INTEGER,
+  PRIMARY KEY (path, description)
+);
+CREATE INDEX IF NOT EXISTS marker_description ON marker(description);
+"""
+
+
+def open_db(path: str) -> sqlite3.Connection:
+    db = sqlite3.connect(path, isolation_level=None)
+    db.row_factory = sqlite3.Row
+    db.executescript(SCHEMA)
+    return db
+
+
+def find_recordings(data_dir: str):
+    for root, _, files in os.walk(data_dir):
+        for name in sorted(files):
+            if name.endswith(EXTENSIONS):
+                yield os.path.abspath(os.path.join(root, name))
+
+
+def peak_alpha(raw: mne.io.BaseRaw) -> tuple[Optional[float], list[str]]:
+    # Same preprocessing as filter_and_drop_dead_channels(), on the occipital/parietal
+    # channels only; the recording is lazy, so the other channels are never read
+    raw.pick('eeg')
+    raw.drop_channels(find_dead_channels(raw))
+    picks = [ch for ch in ALPHA_CHANNELS if ch in raw.ch_names] or raw.ch_names
+    if not picks:
+        return None, []
+
+    raw.pick(picks)
+    raw.load_data(verbose=False)
+    get_filter_plan(raw.info['sfreq']).apply_raw(raw)
+
+    psd = raw.compute_psd(fmin=1.0, fmax=45.0, verbose=False)
+    return float(get_peak_alpha_freq(psd)), picks
+
+
+def describe_recording(path: str) -> tuple[dict, list[tuple[str, str]], Counter]:
+    raw = load_recording(path, preload=False, cache=False)
+
+    meas_date = raw.info['meas_date']
+    row = dict(
+        format=os.path.splitext(path)[1].lstrip('.').lower(),
+        meas_date=meas_date.isoformat() if meas_date is not None else None,
+        duration_s=raw.n_times / raw.info['sfreq'],
+        sfreq=raw.info['sfreq'],
+        n_channels=raw.info['nchan'],
+    )
+    channels = list(zip(raw.ch_names, raw.get_channel_types()))
+    # Annotations MNE treats as bad or as joins (e.g. the BAD_gap ones load_recording()
+    # adds where samples were dropped) mark data problems, not events
+    markers = Counter(description for description in raw.annotations.description
+                      if not description.lower().startswith(('bad', 'edge')))
+    row['n_markers'] = sum(markers.values())
+
+    row['peak_alpha_hz'], alpha_channels = peak_alpha(raw)
+    row['peak_alpha_channels'] = ','.join(alpha_channels)
+
+    return row, channels, markers
+
+
+def store(db: sqlite3.Connection, path: str, row: dict, channels, markers) -> None:
+    db.execute("DELETE FROM channel WHERE path = ?", (path,))
+    db.execute("DELETE FROM marker WHERE path = ?", (path,))
+    columns = ['path'] + list(row)
+    db.execute(f"INSERT OR REPLACE INTO recording({','.join(columns)}) VALUES({','.join('?' * len(columns))})",
+               [path] + list(row.values()))
+    db.executemany("INSERT INTO channel(path, name, type) VALUES(?, ?, ?)",
+                   [(path, name, ch_type) for name, ch_type in channels])
+    db.executemany("INSERT INTO marker(path, description, count) VALUES(?, ?, ?)",
+                   [(path, description, count) for description, count in markers.items()])
+
+
+def copy_entry(db: sqlite3.Connection, source: str, path: str, stat: os.stat_result) -> None:
+    # Same contents under another name (moved or copied file): reuse what was computed
+    entry = dict(db.execute("SELECT * FROM recording WHERE path = ?", (source,)).fetchone())
+    entry.update(path=path, size=stat.st_size, mtime_ns=stat.st_mtime_ns, scanned_at=time.time())
+    channels = [(r['name'], r['type']) for r in db.execute("SELECT name, type FROM channel WHERE path = ?", (source,))]
+    markers = Counter({r['description']: r['count']
+                       for r in db.execute("SELECT description, count FROM marker WHERE path = ?", (source,))})
+    del entry['path']
+    store(db, path, entry, channels, markers)
+
+
+def scan(db: sqlite3.Connection, data_dir: str, prune: bool = True) -> Counter:
+    stats = Counter()
+    seen = set()
+
+    for path in find_recordings(data_dir):
+        seen.add(path)
+        stat = os.stat(path)
+        known = db.execute("SELECT size, mtime_ns, hash, features_version FROM recording WHERE path = ?",
+                           (path,)).fetchone()
+
+        # Unchanged size and mtime: skip without even hashing the file
+        if (known and known['size'] == stat.st_size and known['mtime_ns'] == stat.st_mtime_ns
+                and known['features_version'] == FEATURES_VERSION):
+            stats['unchanged'] += 1
+            continue
+
+        content_hash = file_content_hash(path)
+        if known and known['hash'] == content_hash and known['features_version'] == FEATURES_VERSION:
+            # Touched, but the same contents
+            db.execute("UPDATE recording SET size = ?, mtime_ns = ? WHERE path = ?",
+                       (stat.st_size, stat.st_mtime_ns, path))
+            stats['touched'] += 1
+            continue
+
+        same = db.execute("SELECT path FROM recording WHERE hash = ? AND path != ? AND features_version = ? "
+                          "AND error IS NULL", (content_hash, path, FEATURES_VERSION)).fetchone()
+        if same:
+            db.execute("BEGIN")
+            copy_entry(db, same['path'], path, stat)
+            db.execute("COMMIT")
+            stats['copied'] += 1
+            continue
+
+        row = dict(size=stat.st_size, mtime_ns=stat.st_mtime_ns, hash=content_hash,
+                   features_version=FEATURES_VERSION, error=None, scanned_at=time.time())
+        channels, markers = [], Counter()
+        t_start = time.perf_counter()
+        try:
+            described, channels, markers = describe_recording(path)
+            row.update(described)
+            stats['scanned'] += 1
+        except Exception as e:
+            # Keep a row, so a broken file isn't retried until it changes
+            row['error'] = f'{type(e).__name__}: {e}'
+            stats['failed'] += 1
+
+        db.execute("BEGIN")
+        store(db, path, row, channels, markers)
+        db.execute("COMMIT")
+        alpha = row.get('peak_alpha_hz')
+        summary = row['error'] or (f"peak alpha {alpha:.2f} Hz" if alpha is not None else "no EEG channels")
+        print(f"{os.path.relpath(path, data_dir)}: {summary} ({time.perf_counter() - t_start:.1f}s)")
+
+    if prune:
+        data_dir = os.path.abspath(data_dir)
+        for (path,) in db.execute("SELECT path FROM recording").fetchall():
+            if path.startswith(data_dir + os.sep) and path not in seen:
+                db.execute("DELETE FROM recording WHERE path = ?", (path,))
+                db.execute("DELETE FROM channel WHERE path = ?", (path,))
+                db.execute("DELETE FROM marker WHERE path = ?", (path,))
+                stats['removed'] += 1
+
+    return stats
+
+
+def query(db: sqlite3.Connection, channels: Optional[list[str]], marker: Optional[str],
+          min_duration: Optional[float]) -> list[sqlite3.Row]:
+    sql = "SELECT * FROM recording r WHERE error IS NULL"
+    params = []
+    for name in channels or []:
+        sql += " AND EXISTS (SELECT 1 FROM channel c WHERE c.path = r.path AND c.name = ?)"
+        params.append(name)
+    if marker:
+        sql += " AND EXISTS (SELECT 1 FROM marker m WHERE m.path = r.path AND m.description = ?)"
+        params.append(marker)
+    if min_duration is not None:
+        sql += " AND duration_s >= ?"
+        params.append(min_duration)
+
+    return db.execute(sql + " ORDER BY path", params).fetchall()
+
+
+def main():
+    ap = argparse.ArgumentParser(description="SQLite catalog of the recordings in a data directory")
+    ap.add_argument("--db", default="catalog.db", help="Catalog database path")
+    sub = ap.add_subparsers(dest="command", required=True)
+
+    scan_ap = sub.add_parser("scan", help="Add new and changed recordings in a directory to the catalog")
+    scan_ap.add_argument("data_dir")
+    scan_ap.add_argument("--no-prune", action="store_true", help="Keep entries of files that no longer exist")
+
+    find_ap = sub.add_parser("find", help="List catalogued recordings")
+    find_ap.add_argument("--channels", type=str, default=None, help="Only recordings with all of these channels")
+    find_ap.add_argument("--marker", type=str, default=None, help="Only recordings with this annotation")
+    find_ap.add_argument("--min-duration", type=float, default=None, help="Minimum duration in seconds")
+
+    args = ap.parse_args()
+    db = open_db(args.db)
+
+    if args.command == "scan":
+        mne.set_log_level("ERROR")
+        stats = scan(db, args.data_dir, prune=not args.no_prune)
+        print(", ".join(f"{count} {what}" for what, count in stats.items()) or "No recordings found")
+    else:
+        for row in query(db, parse_picks(args.channels), args.marker, args.min_duration):
+            alpha = f"{row['peak_alpha_hz']:.2f} Hz" if row['peak_alpha_hz'] is not None else "-"
+            print(f"{row['path']}  {row['duration_s'] / 60:6.1f} min  {row['sfreq']:g} Hz  "
+                  f"{row['n_channels']} ch  {row['n_markers']} markers  IAF {alpha}")
+
+
+if __name__ == "__main__":
+    main()
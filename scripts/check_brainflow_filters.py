@@ -0,0 +1,82 @@
+import argparse
+import sys
+import time
+
+import numpy as np
+from brainflow.data_filter import DataFilter, FilterTypes, NoiseTypes
+
+from libs.file_formats import load_recording
+from libs.filters import apply_brainflow_filters
+
+NOISE_TYPES = {50.0: NoiseTypes.FIFTY.value, 60.0: NoiseTypes.SIXTY.value}
+
+
+def brainflow_filters(data: np.ndarray, sfreq: float) -> np.ndarray:
+    # What create_new_raw_with_brainflow_filters_applied() used to do, channel by channel
+    data = np.ascontiguousarray(data, dtype=np.float64).copy()
+    for channel in range(data.shape[0]):
+        DataFilter.perform_bandpass(data[channel], int(sfreq), 1.0, 45.0, 4, FilterTypes.BUTTERWORTH.value, 1)
+        for freq, noise_type in NOISE_TYPES.items():
+            if freq + 2 < sfreq / 2:
+                DataFilter.remove_environmental_noise(data[channel], int(sfreq), noise_type)
+    return data
+
+
+def generated_data(sfreq: float, channels: int, seconds: float, seed: int = 0) -> np.ndarray:
+    # Brown noise with 50 Hz hum, in µV
+    rng = np.random.default_rng(seed)
+    n_samples = int(seconds * sfreq)
+    t = np.arange(n_samples) / sfreq
+    return rng.standard_normal((channels, n_samples)).cumsum(axis=1) + 30 * np.sin(2 * np.pi * 50 * t)
+
+
+def best_time(fn, repeat: int) -> float:
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Check that apply_brainflow_filters() matches BrainFlow's filters and compare their speed")
+    parser.add_argument("recording", nargs="?", help="Recording to filter (default: 10 minutes of 16-channel noise)")
+    parser.add_argument("--sfreq", type=float, default=125.0, help="Sampling rate of the generated data")
+    parser.add_argument("--channels", type=int, default=16, help="Channel count of the generated data")
+    parser.add_argument("--seconds", type=float, default=600.0, help="Length of the generated data")
+    parser.add_argument("--n-jobs", type=int, default=1, help="Threads for apply_brainflow_filters()")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--rtol", type=float, default=1e-5, help="Allowed difference, relative to the peak amplitude")
+    parser.add_argument("--save-reference", type=str, default=None,
+                        help="Also save the data and BrainFlow's output to this .npz, for tests/test_brainflow_filters.py")
+    args = parser.parse_args()
+
+    if args.recording:
+        raw = load_recording(args.recording)
+        data, sfreq = raw.get_data(picks='eeg') * 1e6, raw.info['sfreq']
+    else:
+        data, sfreq = generated_data(args.sfreq, args.channels, args.seconds), args.sfreq
+
+    expected = brainflow_filters(data, sfreq)
+    if args.save_reference:
+        np.savez_compressed(args.save_reference, data=data, sfreq=sfreq, expected=expected)
+    actual = apply_brainflow_filters(data, sfreq, n_jobs=args.n_jobs)
+    error = np.abs(actual - expected).max() / np.abs(expected).max()
+
+    brainflow_time = best_time(lambda: brainflow_filters(data, sfreq), args.repeat)
+    scipy_time = best_time(lambda: apply_brainflow_filters(data, sfreq, n_jobs=args.n_jobs), args.repeat)
+
+    print(f"{data.shape[0]} channels x {data.shape[1]} samples at {sfreq:g} Hz")
+    print(f"Max difference: {error:.2e} of the peak amplitude")
+    print(f"BrainFlow: {brainflow_time * 1e3:.1f} ms  SciPy: {scipy_time * 1e3:.1f} ms  "
+          f"({brainflow_time / scipy_time:.1f}x)")
+
+    if error > args.rtol:
+        print("MISMATCH")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,61 @@
+import argparse
+import sys
+
+import mne
+import numpy as np
+
+from libs.filters import get_filter_plan
+
+
+def concatenated_raw(sfreq: float, channels: int, lengths: list[float], seed: int = 0) -> mne.io.RawArray:
+    # Brown noise with 50 Hz hum, as several raws joined with concatenate_raws(),
+    # so there are 'edge' annotations between them, plus a BAD_ACQ_SKIP stretch
+    rng = np.random.default_rng(seed)
+    info = mne.create_info([f"EEG{i:02d}" for i in range(channels)], sfreq, ch_types="eeg", verbose=False)
+    raws = []
+    for seconds in lengths:
+        n_samples = int(seconds * sfreq)
+        t = np.arange(n_samples) / sfreq
+        data = rng.standard_normal((channels, n_samples)).cumsum(axis=1) + 30 * np.sin(2 * np.pi * 50 * t)
+        raws.append(mne.io.RawArray(data * 1e-6, info, verbose=False))
+    raw = mne.concatenate_raws(raws)
+    raw.annotations.append(lengths[0] + lengths[1] / 2, 1.0, "BAD_ACQ_SKIP")
+    return raw
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Check that FilterPlan.apply_raw() matches raw.filter() + raw.notch_filter() on a "
+                    "concatenated recording, filtering each segment on its own")
+    parser.add_argument("--sfreq", type=float, default=250.0)
+    parser.add_argument("--channels", type=int, default=4)
+    parser.add_argument("--lengths", type=str, default="30,20,40", help="Seconds of each concatenated raw")
+    parser.add_argument("--rtol", type=float, default=1e-8, help="Allowed difference, relative to the peak amplitude")
+    args = parser.parse_args()
+
+    raw = concatenated_raw(args.sfreq, args.channels, [float(s) for s in args.lengths.split(",")])
+
+    expected = raw.copy().filter(1.0, 45.0, verbose=False).notch_filter(50, notch_widths=4, verbose=False)
+    actual = raw.copy()
+    get_filter_plan(args.sfreq).apply_raw(actual)
+    across = raw.copy()
+    get_filter_plan(args.sfreq).apply_raw(across, skip_by_annotation=())
+
+    peak = np.abs(expected.get_data()).max()
+    error = np.abs(actual.get_data() - expected.get_data()).max() / peak
+    across_error = np.abs(across.get_data() - expected.get_data()).max() / peak
+
+    print(f"{len(raw.annotations)} annotations: {', '.join(sorted(set(raw.annotations.description)))}")
+    print(f"highpass/lowpass: {actual.info['highpass']}/{actual.info['lowpass']} "
+          f"(raw.filter(): {expected.info['highpass']}/{expected.info['lowpass']})")
+    assert (actual.info['highpass'], actual.info['lowpass']) == (expected.info['highpass'], expected.info['lowpass'])
+    print(f"Max difference: {error:.2e} of the peak amplitude "
+          f"({across_error:.2e} when filtering across the boundaries)")
+
+    if error > args.rtol:
+        print("MISMATCH")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
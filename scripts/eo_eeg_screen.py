@@ -1,10 +1,183 @@
-import os, pygame
+import os, argparse, pygame
+from dataclasses import dataclass, field
+from typing import Optional
+
+import numpy as np
 
 BG = (0,0,0)            # Black
 DOT = (64, 64, 64)      # gray
 RADIUS_PX = 5           # ≈0.2° diameter if ~52 px/deg
 
+# Filtered samples thrown away at the start, while the filter settles
+FILTER_SETTLE_SECONDS = 1.0
+# How often (in seconds of data) the live IAF estimate is refreshed
+ESTIMATE_EVERY_SECONDS = 1.0
+
+# What run_trials.py passes to run_flicker()
+TARGET_MIN_REFRESH_RATE = 80.0
+TARGET_MAX_REFRESH_RATE = 125.0
+
+
+@dataclass
+class StoppingRule:
+    min_seconds: float = 20.0       # never stop before this much data
+    max_seconds: float = 180.0      # give up (and report what there is) after this much
+    max_ci_width: float = 0.2       # Hz, full width of the 95% interval
+    tolerance: float = 0.1          # Hz, how much the estimate may still move...
+    stable_seconds: float = 10.0    # ...over this many seconds
+
+
+@dataclass
+class LiveIaf:
+    """IAF of the EEG LSL stream, estimated while the fixation screen is up.
+
+    Every chunk is filtered as it arrives and fed to OnlinePeakAlpha, which only
+    keeps the segment spectra. Once a second the estimate is refreshed; it has
+    settled when its confidence interval is narrow and it stopped moving.
+    """
+    picks: Optional[list[str]]
+    notch: Optional[float]
+    rule: StoppingRule
+    stream: Optional[str] = None                    # name of the EEG stream, needed if there are several
+    history: list = field(default_factory=list)   # (seconds, PeakAlpha)
+
+    def __post_init__(self):
+        # Only needed in live mode, so the plain screen still runs as `python3 scripts/eo_eeg_screen.py`
+        from mne_lsl.lsl import resolve_streams, StreamInlet
+
+        from libs.filters import StreamingFilterBank
+        from libs.parse import get_channels_from_xml_desc
+        from libs.psd import ALPHA_CHANNELS, OnlinePeakAlpha
+
+        eeg_streams = [stream for stream in resolve_streams() if stream.stype.upper() == 'EEG']
+        available = [stream.name for stream in eeg_streams]
+        if self.stream is not None:
+            eeg_streams = [stream for stream in eeg_streams if stream.name == self.stream]
+            if not eeg_streams:
+                raise ValueError(f"No EEG stream named '{self.stream}', found {available}")
+        if not eeg_streams:
+            raise ValueError('No EEG streams found')
+        if len(eeg_streams) > 1:
+            raise ValueError(f'Multiple EEG streams found: {available}, pick one with --stream')
+
+        self.inlet = StreamInlet(eeg_streams[0])
+        self.inlet.open_stream()
+        stream_info = self.inlet.get_sinfo()
+        self.sfreq = stream_info.sfreq
+        names = get_channels_from_xml_desc(stream_info.desc) or [str(i) for i in range(stream_info.n_channels)]
+
+        picks = self.picks or [name for name in ALPHA_CHANNELS if name in names] or names
+        missing = [name for name in picks if name not in names]
+        if missing:
+            raise ValueError(f'Channels {missing} are not in the stream, it has {names}')
+        self.channel_idx = [names.index(name) for name in picks]
+        print(f"Live IAF from {', '.join(picks)} at {self.sfreq:g} Hz")
+
+        self.filter_bank = StreamingFilterBank(self.sfreq, len(picks), notch_freq=self.notch)
+        self.estimator = OnlinePeakAlpha(self.sfreq, len(picks))
+        self.to_skip = int(FILTER_SETTLE_SECONDS * self.sfreq)
+        self.next_estimate = ESTIMATE_EVERY_SECONDS
+
+    def poll(self) -> bool:
+        # Takes whatever arrived since the last call; True once the estimate has settled
+        data, _ = self.inlet.pull_chunk(timeout=0.0)
+        if len(data) == 0:
+            return False
+
+        filtered = self.filter_bank.process(np.asarray(data).T[self.channel_idx])
+        skip = min(self.to_skip, filtered.shape[1])
+        self.to_skip -= skip
+        self.estimator.update(filtered[:, skip:])
+
+        if self.estimator.seconds < self.next_estimate:
+            return False
+        self.next_estimate += ESTIMATE_EVERY_SECONDS
+
+        estimate = self.estimator.estimate()
+        self.history.append((self.estimator.seconds, estimate))
+        print(f"{self.estimator.seconds:5.0f}s  IAF {estimate.freq:.2f} Hz  "
+              f"95% CI {estimate.ci_low:.2f}..{estimate.ci_high:.2f}")
+        return self.settled() or self.estimator.seconds >= self.rule.max_seconds
+
+    def settled(self) -> bool:
+        seconds, estimate = self.history[-1]
+        if seconds < self.rule.min_seconds or not estimate.ci_high - estimate.ci_low <= self.rule.max_ci_width:
+            return False
+
+        recent = [e.freq for t, e in self.history if t >= seconds - self.rule.stable_seconds]
+        long_enough = self.history[0][0] <= seconds - self.rule.stable_seconds
+        return long_enough and max(recent) - min(recent) <= self.rule.tolerance
+
+
+def suggest_flicker(iaf: float, refresh_rates: Optional[list[int]], target_min_refresh_rate: float,
+                    target_max_refresh_rate: float) -> tuple[float, str]:
+    # Flicker frequency closest to the IAF that the monitor can show, and how
+    from scripts.calculate_possible_flicker_rates import closest_flicker_rate
+    from scripts.flicker import find_target_fps
+
+    if refresh_rates:
+        closest = closest_flicker_rate(iaf, refresh_rates)
+        if closest is None:
+            raise ValueError(f"No flicker rate between 6 and 14 Hz at {refresh_rates} Hz")
+        flicker_rate, refresh_rate, off_frames = closest
+        return flicker_rate, f"{refresh_rate} Hz with 1 on and {off_frames} off"
+
+    frequency = round(iaf, 2)
+    fps = find_target_fps(frequency, target_min_refresh_rate, target_max_refresh_rate)
+    return frequency, f"{fps:.2f} fps on a VRR monitor"
+
+
+def report(live: LiveIaf, args) -> None:
+    if not live.history:
+        print("No EEG data arrived, no IAF estimate")
+        return
+
+    seconds, estimate = live.history[-1]
+    status = "settled" if live.settled() else "did NOT settle"
+    print(f"\nIAF {estimate.freq:.2f} Hz (95% CI {estimate.ci_low:.2f}..{estimate.ci_high:.2f}), "
+          f"{status} after {seconds:.0f}s of data")
+    try:
+        flicker, how = suggest_flicker(estimate.freq, args.refresh_rates, args.target_min_refresh_rate,
+                                       args.target_max_refresh_rate)
+    except ValueError as e:
+        print(f"No achievable flicker rate: {e}")
+        return
+    print(f"Flicker at {flicker:.2f} Hz ({how}):")
+    print(f"  run_trials.py --iaf {estimate.freq:.2f} --freq {flicker:.2f} ...")
+
+
 def main():
+    parser = argparse.ArgumentParser(description="Fixation screen for the eyes-open EEG recording")
+    parser.add_argument('--live-iaf', action='store_true',
+                        help="Estimate IAF from the EEG LSL stream while the screen is up, stop once it settles")
+    parser.add_argument('--picks', type=str, default=None,
+                        help="Comma or space-separated channels for --live-iaf (default: the occipital/parietal ones)")
+    parser.add_argument('--stream', type=str, default=None,
+                        help="Name of the EEG LSL stream for --live-iaf, if there are several")
+    parser.add_argument('--notch', type=float, default=50.0, help="Line frequency to notch out (Hz)")
+    parser.add_argument('--min-seconds', type=float, default=StoppingRule.min_seconds)
+    parser.add_argument('--max-seconds', type=float, default=StoppingRule.max_seconds)
+    parser.add_argument('--max-ci-width', type=float, default=StoppingRule.max_ci_width,
+                        help="Stop once the 95%% interval of the IAF is at most this wide (Hz)...")
+    parser.add_argument('--tolerance', type=float, default=StoppingRule.tolerance,
+                        help="...and the IAF moved by at most this much (Hz)...")
+    parser.add_argument('--stable-seconds', type=float, default=StoppingRule.stable_seconds,
+                        help="...over this many seconds")
+    parser.add_argument('--refresh-rates', type=str, default=None,
+                        help="Fixed monitor refresh rates to snap the flicker to, e.g. 144,120 (default: VRR)")
+    parser.add_argument('--target-min-refresh-rate', type=float, default=TARGET_MIN_REFRESH_RATE)
+    parser.add_argument('--target-max-refresh-rate', type=float, default=TARGET_MAX_REFRESH_RATE)
+    args = parser.parse_args()
+    args.refresh_rates = [int(rate) for rate in args.refresh_rates.split(',')] if args.refresh_rates else None
+
+    live = None
+    if args.live_iaf:
+        from libs.parse import parse_picks
+
+        rule = StoppingRule(args.min_seconds, args.max_seconds, args.max_ci_width, args.tolerance,
+                            args.stable_seconds)
+        live = LiveIaf(parse_picks(args.picks), args.notch, rule, args.stream)
+
     # Hi-DPI friendly fullscreen at native pixels
     os.environ.setdefault("SDL_HINT_VIDEO_HIGHDPI_DISABLED", "0")
     pygame.init()
@@ -25,6 +198,9 @@ def main():
             if e.type == pygame.KEYDOWN and e.key == pygame.K_ESCAPE:
                 running = False
 
+        if live is not None and live.poll():
+            running = False
+
         screen.fill(BG)
         pygame.draw.circle(screen, DOT, center, RADIUS_PX)
         pygame.display.flip()
@@ -32,6 +208,8 @@ def main():
 
     pygame.quit()
 
+    if live is not None:
+        report(live, args)
+
 if __name__ == "__main__":
     main()
-
@@ -1,12 +1,13 @@
+import os
 import sys
 import argparse
 import gc
 import time
-import statistics
 import math
 from dataclasses import dataclass, field
 from collections import deque
 
+import numpy as np
 import pygame
 from typing import Callable, Optional
 
@@ -14,31 +15,145 @@ from typing import Callable, Optional
 REPORT_EVERY = 300
 
 # ---------- Rolling stats ----------
+# Histogram buckets: HIST_SUB_BUCKETS per power of two of |value|, from
+# HIST_MIN_VALUE up (values are ms, so 1 µs; anything smaller counts as 0).
+# Percentiles are good to 1 / HIST_SUB_BUCKETS (~3%) of the value
+HIST_MIN_VALUE = 1e-3
+HIST_SUB_BUCKETS = 16
+HIST_OCTAVES = 32
+
+def _hist_bucket(value: float) -> int:
+    # Bucket 0 holds |value| < HIST_MIN_VALUE; negatives mirror the positives
+    magnitude = abs(value) / HIST_MIN_VALUE
+    if magnitude < 1.0:
+        return 0
+    mantissa, exponent = math.frexp(magnitude)      # magnitude = mantissa * 2**exponent, 0.5 <= mantissa < 1
+    bucket = min(exponent * HIST_SUB_BUCKETS + int((mantissa - 0.5) * 2 * HIST_SUB_BUCKETS) - HIST_SUB_BUCKETS + 1,
+                 HIST_OCTAVES * HIST_SUB_BUCKETS)
+    return bucket if value > 0 else -bucket
+
+def _hist_value(bucket: int) -> float:
+    # Middle of a bucket
+    if bucket == 0:
+        return 0.0
+    octave, sub = divmod(abs(bucket) - 1, HIST_SUB_BUCKETS)
+    value = HIST_MIN_VALUE * 2.0 ** octave * (1.0 + (sub + 0.5) / HIST_SUB_BUCKETS)
+    return value if bucket > 0 else -value
+
 @dataclass
 class RollingStat:
+    """Statistics of the last `window` values (None ⇒ all of them), O(1) per value.
+
+    Values go into a preallocated ring buffer. Mean and variance are running
+    sums updated Welford-style as values enter and leave the window, min and max
+    come from monotonic deques of ring positions, and percentiles from a
+    log-bucket histogram (HDR-style) that is updated the same way. add() never
+    grows anything and summary_dict() only walks the histogram, so a summary
+    can be logged after every trial.
+    """
     name: str
     window: int | None = 1000          # None ⇒ keep everything
-    _buf: deque = field(default_factory=deque, repr=False)
+
+    def __post_init__(self):
+        n_buckets = HIST_OCTAVES * HIST_SUB_BUCKETS
+        self._counts = [0] * (2 * n_buckets + 1)     # index bucket + n_buckets
+        self._offset = n_buckets
+        self._ring = [0.0] * (self.window or 0)
+        self._ring_buckets = [0] * (self.window or 0)
+        self._min_idx: deque = deque()
+        self._max_idx: deque = deque()
+        self._all_min = math.inf
+        self._all_max = -math.inf
+        self._count = 0                              # values ever added
+        self._mean = 0.0
+        self._m2 = 0.0
 
     def add(self, value: float) -> None:
-        self._buf.append(value)
-        if self.window and len(self._buf) > self.window:
-            self._buf.popleft()
+        bucket = _hist_bucket(value)
+        self._counts[bucket + self._offset] += 1
+        n = self.n
+
+        if not self.window:
+            self._all_min = min(self._all_min, value)
+            self._all_max = max(self._all_max, value)
+        else:
+            i = self._count
+            slot = i % self.window
+            if n == self.window:
+                # The oldest value leaves the window as the new one enters
+                old = self._ring[slot]
+                self._counts[self._ring_buckets[slot] + self._offset] -= 1
+                old_mean = self._mean
+                self._mean += (value - old) / n
+                self._m2 = max(0.0, self._m2 + (value - old) * (value - self._mean + old - old_mean))
+            self._ring[slot] = value
+            self._ring_buckets[slot] = bucket
+
+            # Positions whose value can still become the min (max): increasing (decreasing) values
+            first = i - self.window + 1                 # oldest position still in the window
+            ring, window = self._ring, self.window
+            min_idx, max_idx = self._min_idx, self._max_idx
+            while min_idx and ring[min_idx[-1] % window] >= value:
+                min_idx.pop()
+            min_idx.append(i)
+            if min_idx[0] < first:
+                min_idx.popleft()
+            while max_idx and ring[max_idx[-1] % window] <= value:
+                max_idx.pop()
+            max_idx.append(i)
+            if max_idx[0] < first:
+                max_idx.popleft()
+
+        if not self.window or n < self.window:
+            delta = value - self._mean
+            self._mean += delta / (n + 1)
+            self._m2 += delta * (value - self._mean)
+        self._count += 1
 
     @property
-    def n(self):      return len(self._buf)
+    def n(self):      return min(self._count, self.window) if self.window else self._count
     @property
-    def mean(self):   return statistics.fmean(self._buf) if self._buf else 0.0
+    def mean(self):   return self._mean if self.n else 0.0
     @property
-    def stdev(self):  return statistics.pstdev(self._buf) if self.n > 1 else 0.0
+    def stdev(self):  return math.sqrt(self._m2 / self.n) if self.n > 1 else 0.0
     @property
-    def min(self):    return min(self._buf) if self._buf else 0.0
+    def min(self):
+        if not self.n: return 0.0
+        return self._ring[self._min_idx[0] % self.window] if self.window else self._all_min
     @property
-    def max(self):    return max(self._buf) if self._buf else 0.0
+    def max(self):
+        if not self.n: return 0.0
+        return self._ring[self._max_idx[0] % self.window] if self.window else self._all_max
+
+    def percentiles(self, qs) -> list[float]:
+        # One pass over the histogram; each is within a bucket of the true value,
+        # clipped to the exact min and max
+        n = self.n
+        if not n:
+            return [0.0] * len(qs)
+        ranks = [max(1, math.ceil(q / 100.0 * n)) for q in qs]
+        lo, hi = self.min, self.max
+        result = [hi] * len(qs)
+        pending = sorted(range(len(qs)), key=ranks.__getitem__)
+        seen = 0
+        for index, count in enumerate(self._counts):
+            if not count:
+                continue
+            seen += count
+            while pending and seen >= ranks[pending[0]]:
+                result[pending.pop(0)] = min(max(_hist_value(index - self._offset), lo), hi)
+            if not pending:
+                break
+        return result
+
+    def percentile(self, q: float) -> float:
+        return self.percentiles([q])[0]
 
     def summary_dict(self):
-        return {k: round(getattr(self, k), 3)
-                for k in ('mean', 'stdev', 'min', 'max', 'n')}
+        p50, p95, p99 = self.percentiles((50, 95, 99))
+        return {k: round(v, 3) for k, v in (('mean', self.mean), ('stdev', self.stdev), ('min', self.min),
+                                            ('max', self.max), ('p50', p50), ('p95', p95), ('p99', p99),
+                                            ('n', self.n))}
 
 # ---------- helpers ----------
 def find_target_fps(frequency, target_min_refresh_rate, target_max_refresh_rate):
@@ -49,6 +164,264 @@ def find_target_fps(frequency, target_min_refresh_rate, target_max_refresh_rate)
         raise ValueError("Frequency too high")
     return result
 
+# ---------- Frame log ----------
+# One row per frame; times are time.perf_counter() seconds. sleep_overshoot is
+# how much later than asked the coarse sleep returned (NaN if the frame didn't sleep)
+FRAME_DTYPE = np.dtype([
+    ('frame', np.int64),
+    ('on', np.bool_),
+    ('target', np.float64),
+    ('t_before_flip', np.float64),
+    ('t_after_flip', np.float64),
+    ('sleep_overshoot', np.float64),
+])
+
+# Flip durations above this are reported (after the train, not from inside the loop)
+LONG_FLIP_MS = 3.5
+
+class FrameLog:
+    """Per-frame timing of flicker trains, written in place into a preallocated
+    structured array (FRAME_DTYPE): recording a frame stores six numbers and
+    allocates nothing. Frames past `capacity` are only counted in `dropped`.
+    """
+
+    def __init__(self, capacity: int):
+        self.frames = np.zeros(capacity, dtype=FRAME_DTYPE)
+        # Field views made once, so that record() doesn't create them per frame
+        self._columns = [self.frames[name] for name in FRAME_DTYPE.names]
+        self.n = 0
+        self.dropped = 0
+
+    @classmethod
+    def for_train(cls, frequency: float, target_min_refresh_rate: float, target_max_refresh_rate: float,
+                  cycles: int) -> "FrameLog":
+        # Room for every frame of run_flicker(..., cycles=cycles)
+        target_fps = find_target_fps(frequency, target_min_refresh_rate, target_max_refresh_rate)
+        frames_per_cycle = int((target_fps - frequency) / frequency) + 1
+        return cls((cycles + 1) * frames_per_cycle + 1)
+
+    def reset(self) -> None:
+        self.n = 0
+        self.dropped = 0
+
+    def record(self, frame: int, on: bool, target: float, t_before_flip: float, t_after_flip: float,
+               sleep_overshoot: float) -> None:
+        i = self.n
+        if i >= len(self.frames):
+            self.dropped += 1
+            return
+        frame_col, on_col, target_col, before_col, after_col, overshoot_col = self._columns
+        frame_col[i] = frame
+        on_col[i] = on
+        target_col[i] = target
+        before_col[i] = t_before_flip
+        after_col[i] = t_after_flip
+        overshoot_col[i] = sleep_overshoot
+        self.n = i + 1
+
+    @property
+    def data(self) -> np.ndarray:
+        return self.frames[:self.n]
+
+    def save(self, path: str) -> None:
+        np.save(path, self.data)
+
+# ---------- Frame scheduler ----------
+# Until SCHED_MIN_SAMPLES sleeps were measured the scheduler wakes up
+# SCHED_INITIAL_GUARD seconds early; after that, the guard is the
+# SCHED_PERCENTILE of the measured overshoot plus SCHED_MARGIN, refreshed every
+# SCHED_UPDATE_EVERY frames after the flip, not in the wait (a percentile walks
+# the histogram, ~50 µs)
+SCHED_INITIAL_GUARD = 0.002
+SCHED_MIN_SAMPLES = 20
+SCHED_UPDATE_EVERY = 20
+SCHED_PERCENTILE = 99.0
+SCHED_MARGIN = 0.0002
+# Waits shorter than this are spun through entirely
+SCHED_MIN_SLEEP = 0.0005
+# Never spin through more than this fraction of a wait (what the fixed
+# 0.75 sleep used to spin), however bad the overshoot tail gets
+SCHED_MAX_GUARD_FRACTION = 0.25
+# The flip lead is at most this fraction of the frame interval. With vsync on
+# a fixed refresh rate flip() blocks until the vblank, so its duration is mostly
+# that wait; presenting earlier only makes it longer, and uncapped the lead
+# would feed on itself
+SCHED_MAX_FLIP_LEAD_FRACTION = 0.1
+
+class FrameScheduler:
+    """Waits for frame deadlines: sleeps through most of the wait, spins the rest.
+
+    The overshoot of every sleep (how much later than asked it returned) goes
+    into a RollingStat, and later sleeps end a high percentile of it before the
+    deadline, so the spin after them is only as long as this machine needs.
+    Flip durations are modelled the same way: with aim_flip=True the frame is
+    presented the median flip duration early (at most SCHED_MAX_FLIP_LEAD_FRACTION
+    of a frame), so that the flip, not the draw, lands on the target. That is only
+    meaningful on a VRR monitor, where the flip is the present itself; on a fixed
+    refresh rate the flip waits for the vblank anyway. Keep one scheduler across
+    trains to keep the calibration.
+    """
+
+    def __init__(self, percentile: float = SCHED_PERCENTILE, margin: float = SCHED_MARGIN,
+                 aim_flip: bool = False, window: int = 500):
+        self.percentile = percentile
+        self.margin = margin
+        self.aim_flip = aim_flip
+        self.overshoot_ms = RollingStat('sleep_overshoot_ms', window)
+        self.flip_ms = RollingStat('flip_ms', window)
+        self.guard = SCHED_INITIAL_GUARD           # seconds woken up before the deadline
+        self.flip_lead = 0.0                       # seconds presented before the target
+        self._flips_since_update = 0
+        self.reset_counters()
+
+    def reset_counters(self) -> None:
+        # Totals for summary_dict(); the calibration is kept
+        self.waits = 0
+        self.sleeps = 0
+        self.late_wakeups = 0
+        self.slept = 0.0
+        self.spun = 0.0
+
+    def deadline(self, target: float) -> float:
+        # When to present a frame whose flip should complete at `target`
+        return target - self.flip_lead
+
+    def wait(self, deadline: float) -> float:
+        # Returns at `deadline` (perf_counter seconds). The result is how much
+        # later than asked the sleep returned, NaN if there was no sleep
+        self.waits += 1
+        now = time.perf_counter()
+        overshoot = math.nan
+        wait = deadline - now
+        sleep_for = wait - min(self.guard, wait * SCHED_MAX_GUARD_FRACTION)
+        if sleep_for > SCHED_MIN_SLEEP:
+            time.sleep(sleep_for)
+            woke = time.perf_counter()
+            overshoot = woke - now - sleep_for
+            self.sleeps += 1
+            self.slept += woke - now
+            if woke > deadline:
+                self.late_wakeups += 1
+            self.overshoot_ms.add(overshoot * 1000.0)
+            now = woke
+
+        spin_start = now
+        while now < deadline:
+            now = time.perf_counter()                # fine busy-wait
+        self.spun += now - spin_start
+        return overshoot
+
+    def flipped(self, flip_duration_ms: float, interval: float) -> None:
+        # Called after every present(), where the time doesn't matter: refreshes
+        # the guard and the flip lead that the next waits use
+        self.flip_ms.add(flip_duration_ms)
+        self._flips_since_update += 1
+        if self._flips_since_update < SCHED_UPDATE_EVERY:
+            return
+        self._flips_since_update = 0
+        if self.overshoot_ms.n >= SCHED_MIN_SAMPLES:
+            self.guard = max(0.0, self.overshoot_ms.percentile(self.percentile) / 1000.0) + self.margin
+        if self.aim_flip and self.flip_ms.n >= SCHED_MIN_SAMPLES:
+            self.flip_lead = min(max(0.0, self.flip_ms.percentile(50) / 1000.0),
+                                 interval * SCHED_MAX_FLIP_LEAD_FRACTION)
+
+    def summary_dict(self):
+        waited = self.slept + self.spun
+        p50, p99 = self.overshoot_ms.percentiles((50, 99))
+        return {k: round(v, 3) for k, v in (
+            ('guard_ms', self.guard * 1000.0), ('flip_lead_ms', self.flip_lead * 1000.0),
+            ('overshoot_p50', p50), ('overshoot_p99', p99), ('overshoot_max', self.overshoot_ms.max),
+            ('sleeps', self.sleeps), ('late_wakeups', self.late_wakeups),
+            ('spin_ms_per_frame', self.spun * 1000.0 / max(1, self.waits)),
+            ('spin_fraction', self.spun / waited if waited else 0.0))}
+
+# ---------- Real-time mode (Linux) ----------
+RT_FIFO_PRIORITY = 50       # SCHED_FIFO priority asked for (1-99); below the kernel's own IRQ threads
+RT_NICE = -10               # fallback when SCHED_FIFO is not permitted
+MCL_CURRENT, MCL_FUTURE = 1, 2
+
+@dataclass
+class RealtimeGrant:
+    # What enter_realtime() actually got; None/False where it was refused
+    cpu: Optional[int] = None
+    policy: str = "default"
+    mlocked: bool = False
+    gc_disabled: bool = False
+    notes: list = field(default_factory=list)
+
+    def __str__(self):
+        return (f"real-time mode: cpu={'pinned to ' + str(self.cpu) if self.cpu is not None else 'not pinned'}, "
+                f"scheduling={self.policy}, mlockall={'yes' if self.mlocked else 'no'}, "
+                f"gc={'disabled' if self.gc_disabled else 'enabled'}"
+                + "".join(f"\n  {note}" for note in self.notes))
+
+def _mlockall(grant: RealtimeGrant) -> None:
+    import ctypes, ctypes.util, resource
+    soft, _ = resource.getrlimit(resource.RLIMIT_MEMLOCK)
+    # Without the privilege, MCL_FUTURE makes later allocations fail once the
+    # limit is reached, so only lock when the limit can't be hit
+    if soft != resource.RLIM_INFINITY and os.geteuid() != 0:
+        grant.notes.append(f"mlockall skipped: RLIMIT_MEMLOCK is {soft // 1024} KiB, set memlock unlimited "
+                           f"in /etc/security/limits.conf to allow it")
+        return
+    libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+    if libc.mlockall(MCL_CURRENT | MCL_FUTURE) != 0:
+        grant.notes.append(f"mlockall refused: {os.strerror(ctypes.get_errno())}")
+        return
+    grant.mlocked = True
+
+def enter_realtime(cpu: Optional[int] = None, fifo_priority: int = RT_FIFO_PRIORITY,
+                   nice: int = RT_NICE) -> RealtimeGrant:
+    """Best-effort real-time setup for the calling thread, on Linux.
+
+    Pins it to `cpu` (default: the last CPU it may run on, which usually
+    handles fewest interrupts), asks for SCHED_FIFO at `fifo_priority` or, if
+    that is not permitted, for `nice`, locks the process's memory with
+    mlockall(), moves everything alive so far (modules, pygame, the outlet) to
+    the permanent generation with gc.freeze() and disables the garbage
+    collector; run collect_garbage() where a pause doesn't matter. Threads started afterwards inherit the CPU and the
+    scheduling policy, so call it after the LSL outlet and the display are up.
+    Anything refused is skipped and listed in the returned RealtimeGrant.
+    """
+    grant = RealtimeGrant()
+    if not sys.platform.startswith("linux"):
+        grant.notes.append(f"only the GC is handled on {sys.platform}")
+    else:
+        try:
+            allowed = sorted(os.sched_getaffinity(0))
+            target = allowed[-1] if cpu is None else cpu
+            os.sched_setaffinity(0, {target})
+            grant.cpu = target
+        except OSError as e:
+            grant.notes.append(f"CPU pinning refused: {e.strerror}")
+
+        try:
+            os.sched_setscheduler(0, os.SCHED_FIFO, os.sched_param(fifo_priority))
+            grant.policy = f"SCHED_FIFO {fifo_priority}"
+        except OSError as e:
+            grant.notes.append(f"SCHED_FIFO refused: {e.strerror}")
+            try:
+                os.setpriority(os.PRIO_PROCESS, 0, nice)
+                grant.policy = f"nice {nice}"
+            except OSError as e:
+                grant.notes.append(f"nice {nice} refused: {e.strerror}")
+
+        try:
+            _mlockall(grant)
+        except (OSError, AttributeError) as e:
+            grant.notes.append(f"mlockall unavailable: {e}")
+
+    gc.collect()
+    gc.freeze()
+    gc.disable()
+    grant.gc_disabled = True
+    return grant
+
+def collect_garbage() -> None:
+    # For the ITI: collect what the last trial left behind. Nothing is frozen
+    # here, so cycles from earlier trials are still found by later collections
+    gc.collect()
+
 # ---------- NEW: refactored flicker loop ----------
 def run_flicker(
     screen: pygame.Surface,
@@ -60,24 +433,47 @@ def run_flicker(
     cycles: int | None = None,
     report_every: int = REPORT_EVERY,
     overlay_off_frame: Optional[Callable[[pygame.Surface], None]] = None,
+    frame_log: Optional[FrameLog] = None,
+    scheduler: Optional[FrameScheduler] = None,
+    update_rect: bool = False,
 ):
     """
     Flicker a centered rectangle as 1-frame ON followed by N OFF frames so that
     ON-to-ON interval ≈ 1/frequency. If `cycles` is None, run indefinitely.
-    Returns a dict of timing summaries.
+    Returns a dict of timing summaries. With a `frame_log`, the timing of every
+    frame is appended to it too. Frames are timed by `scheduler` (a fresh
+    FrameScheduler if None); its stats are returned under "scheduler".
+
+    The ON and OFF looks of the rect are rendered once, `overlay_off_frame`
+    included (so it must draw the same thing every time), and blitted only
+    when the rect switches between them. update_rect=True presents with
+    display.update(rect) instead of flip(); only a plain software window
+    honours that, with SCALED (the renderer, and vsync) pygame flips anyway.
     """
     target_fps = find_target_fps(frequency, target_min_refresh_rate, target_max_refresh_rate)
     interval = 1.0 / target_fps
     off_frames_per_each_on = int((target_fps - frequency) / frequency)
+    if scheduler is None:
+        scheduler = FrameScheduler()
+    scheduler.reset_counters()
 
     frame_count = 0
     pulses_emitted = 0
     rectangle_on = False
 
-    # Clear once
+    # Clear once; what the rect shows now is its OFF look
     screen.fill((0, 0, 0))
+    if overlay_off_frame is not None:
+        overlay_off_frame(screen)
     pygame.display.flip()
 
+    rect = rect.clip(screen.get_rect())
+    off_patch = screen.subsurface(rect).copy()
+    on_patch = off_patch.copy()
+    on_patch.fill((255, 255, 255))
+    patch_on = False                      # which patch is on screen
+    present = (lambda: pygame.display.update(rect)) if update_rect else pygame.display.flip
+
     # High-precision time anchors
     last_draw_time = time.perf_counter()
     previous_draw_time = last_draw_time
@@ -87,6 +483,7 @@ def run_flicker(
 
     # Rolling stats
     flip_ms   = RollingStat('flip_ms',  50 * max(1, off_frames_per_each_on))
+    draw_ms   = RollingStat('draw_ms',  50 * max(1, off_frames_per_each_on))
     err_pre   = RollingStat('err_pre',  50 * max(1, off_frames_per_each_on))
     err_post  = RollingStat('err_post', 50 * max(1, off_frames_per_each_on))
 
@@ -94,28 +491,39 @@ def run_flicker(
     err_on_pre   = RollingStat('err_pre_on',  50)
     err_on_post  = RollingStat('err_post_on', 50)
 
+    # Flips over LONG_FLIP_MS around ON frames; printed outside of the frame timing
+    long_flips = deque(maxlen=100)
+    long_flip_count = 0
+
+    def print_long_flips():
+        while long_flips:
+            frame, on, flip_duration, error_pre, error_post = long_flips.popleft()
+            print(f'⚠️  Flip too long: {flip_duration:.3f} ms | '
+                  f'Frame {frame} | {"ON" if on else "OFF"} | '
+                  f'Err pre {error_pre:.3f} ms | Err post {error_post:.3f} ms')
+
+    def summaries():
+        print_long_flips()
+        return {
+            "flip_ms": flip_ms.summary_dict(),
+            "draw_ms": draw_ms.summary_dict(),
+            "err_pre": err_pre.summary_dict(),
+            "err_post": err_post.summary_dict(),
+            "flip_ms_on": flip_on_ms.summary_dict(),
+            "err_on_pre": err_on_pre.summary_dict(),
+            "err_on_post": err_on_post.summary_dict(),
+            "scheduler": scheduler.summary_dict(),
+            "long_flips": long_flip_count,
+        }
+
     # Main loop
     while True:
         # Quit handling
         for event in pygame.event.get():
             if event.type == pygame.QUIT:
-                return {
-                    "flip_ms": flip_ms.summary_dict(),
-                    "err_pre": err_pre.summary_dict(),
-                    "err_post": err_post.summary_dict(),
-                    "flip_ms_on": flip_on_ms.summary_dict(),
-                    "err_on_pre": err_on_pre.summary_dict(),
-                    "err_on_post": err_on_post.summary_dict(),
-                }
+                return summaries()
             elif event.type == pygame.KEYDOWN and event.key == pygame.K_ESCAPE:
-                return {
-                    "flip_ms": flip_ms.summary_dict(),
-                    "err_pre": err_pre.summary_dict(),
-                    "err_post": err_post.summary_dict(),
-                    "flip_ms_on": flip_on_ms.summary_dict(),
-                    "err_on_pre": err_on_pre.summary_dict(),
-                    "err_on_post": err_on_post.summary_dict(),
-                }
+                return summaries()
 
         previous_on = rectangle_on
         # 1 frame ON, then N OFF
@@ -124,29 +532,21 @@ def run_flicker(
         if rectangle_on:
             pulses_emitted += 1
 
-        # Draw
-        if rectangle_on:
-            pygame.draw.rect(screen, (255, 255, 255), rect)
-        else:
-            pygame.draw.rect(screen, (0, 0, 0), rect)
-            if overlay_off_frame is not None:
-                overlay_off_frame(screen)
+        # Draw; consecutive OFF frames leave the screen as it is
+        draw_start = time.perf_counter()
+        if rectangle_on != patch_on:
+            screen.blit(on_patch if rectangle_on else off_patch, rect)
+            patch_on = rectangle_on
+        draw_ms.add((time.perf_counter() - draw_start) * 1000.0)
 
         # Drift-free target time for next frame
         next_frame_time = start_time + (frame_count + 1) * interval
-        current_time = time.perf_counter()
-        delay = next_frame_time - current_time
-
-        if delay > 0:
-            if delay > 0.001:
-                time.sleep(delay * 0.75)           # coarse sleep
-            while time.perf_counter() < next_frame_time:
-                pass                                # fine busy-wait
+        sleep_overshoot = scheduler.wait(scheduler.deadline(next_frame_time))
 
         previous_draw_time = last_draw_time
         last_draw_time = time.perf_counter()
 
-        pygame.display.flip()
+        present()
 
         previous_post_flip_time = post_flip_time
         post_flip_time = time.perf_counter()
@@ -159,6 +559,7 @@ def run_flicker(
         timing_error_post_ms = (actual_interval_post - interval) * 1000.0
 
         flip_ms.add(flip_duration_ms)
+        scheduler.flipped(flip_duration_ms, interval)
         err_pre.add(timing_error_pre_ms)
         err_post.add(timing_error_post_ms)
 
@@ -167,23 +568,34 @@ def run_flicker(
             err_on_pre.add(timing_error_pre_ms)
             err_on_post.add(timing_error_post_ms)
 
-        if flip_duration_ms > 3.5:
+        if frame_log is not None:
+            frame_log.record(frame_count, rectangle_on, next_frame_time, last_draw_time, post_flip_time,
+                             sleep_overshoot)
+
+        if flip_duration_ms > LONG_FLIP_MS:
             if rectangle_on or previous_on:
-                print(f'⚠️  Flip too long: {flip_duration_ms:.3f} ms | '
-                    f'Frame {frame_count} | {"ON" if rectangle_on else "OFF"} | '
-                    f'Err pre {timing_error_pre_ms:.3f} ms | Err post {timing_error_post_ms:.3f} ms')
+                long_flip_count += 1
+                long_flips.append((frame_count, rectangle_on, flip_duration_ms,
+                                   timing_error_pre_ms, timing_error_post_ms))
 
         if frame_count and frame_count % report_every == 0:
+            print_long_flips()
             print(f'\n— summary over last {flip_ms.n} frames —')
-            for stat in (flip_ms, err_pre, err_post):
+            for stat in (flip_ms, draw_ms, err_pre, err_post):
                 s = stat.summary_dict()
                 print(f'Total {stat.name:10s}: mean={s["mean"]:.3f} ms  '
-                      f'std={s["stdev"]:.3f}  min={s["min"]:.3f}  max={s["max"]:.3f}')
+                      f'std={s["stdev"]:.3f}  min={s["min"]:.3f}  p50={s["p50"]:.3f}  '
+                      f'p95={s["p95"]:.3f}  p99={s["p99"]:.3f}  max={s["max"]:.3f}')
             print()
             for stat in (flip_on_ms, err_on_pre, err_on_post):
                 s = stat.summary_dict()
                 print(f'On    {stat.name:10s}: mean={s["mean"]:.3f} ms  '
-                      f'std={s["stdev"]:.3f}  min={s["min"]:.3f}  max={s["max"]:.3f}')
+                      f'std={s["stdev"]:.3f}  min={s["min"]:.3f}  p50={s["p50"]:.3f}  '
+                      f'p95={s["p95"]:.3f}  p99={s["p99"]:.3f}  max={s["max"]:.3f}')
+            s = scheduler.summary_dict()
+            print(f'\nScheduler: guard={s["guard_ms"]:.3f} ms  overshoot p50={s["overshoot_p50"]:.3f}  '
+                  f'p99={s["overshoot_p99"]:.3f}  late wake-ups={s["late_wakeups"]}  '
+                  f'spin={s["spin_ms_per_frame"]:.3f} ms/frame ({s["spin_fraction"]:.0%} of the wait)')
             print("\n")
 
         frame_count += 1
@@ -191,14 +603,7 @@ def run_flicker(
         # Stop when enough pulses (cycles) have been emitted
         # And we are not on the flash (so it's only for a brief period)
         if cycles is not None and not rectangle_on and pulses_emitted >= cycles:
-            return {
-                "flip_ms": flip_ms.summary_dict(),
-                "err_pre": err_pre.summary_dict(),
-                "err_post": err_post.summary_dict(),
-                "flip_ms_on": flip_on_ms.summary_dict(),
-                "err_on_pre": err_on_pre.summary_dict(),
-                "err_on_post": err_on_post.summary_dict(),
-            }
+            return summaries()
 
 # ---------- CLI main (keeps existing behavior) ----------
 def main():
@@ -210,6 +615,13 @@ def main():
                         help="20–25% lower than your max monitor refresh to allow draw jitter")
     parser.add_argument('--cycles', type=int, default=None,
                         help="Number of ON pulses to present (None = run forever)")
+    parser.add_argument('--frame-log', type=str, default=None,
+                        help="Save the timing of every frame to this .npy file (the first 10 minutes without --cycles)")
+    parser.add_argument('--aim-flip', action='store_true',
+                        help="VRR monitors only: start each frame the typical flip duration early "
+                             "(at most a tenth of a frame), so the flip lands on time")
+    parser.add_argument('--realtime', action='store_true',
+                        help="Linux: pin to a core, ask for SCHED_FIFO (or a higher priority) and lock memory")
     args = parser.parse_args()
 
     # We currently don't want the garbage collector to run
@@ -231,15 +643,33 @@ def main():
         SQUARE_SIDE, SQUARE_SIDE
     )
 
+    frame_log = None
+    if args.frame_log:
+        if args.cycles is not None:
+            frame_log = FrameLog.for_train(args.flicker_frequency, args.target_min_refresh_rate,
+                                           args.target_max_refresh_rate, args.cycles)
+        else:
+            frame_log = FrameLog(int(args.target_max_refresh_rate * 600))
+
+    if args.realtime:
+        print(enter_realtime())
+
     stats = run_flicker(
         screen, rect,
         frequency=args.flicker_frequency,
         target_min_refresh_rate=args.target_min_refresh_rate,
         target_max_refresh_rate=args.target_max_refresh_rate,
         cycles=args.cycles,            # None = infinite (old behavior)
-        report_every=REPORT_EVERY
+        report_every=REPORT_EVERY,
+        frame_log=frame_log,
+        scheduler=FrameScheduler(aim_flip=args.aim_flip),
     )
 
+    if frame_log is not None:
+        frame_log.save(args.frame_log)
+        print(f"Saved {frame_log.n} frames to {args.frame_log}"
+              + (f" ({frame_log.dropped} more didn't fit)" if frame_log.dropped else ""))
+
     # If we exit the loop cleanly or after N cycles, print final stats
     if stats:
         print("\nFinal timing summaries:")
@@ -1,9 +1,14 @@
-import sys
-import pyxdf
-from pprint import pprint
+import argparse
+import os
 
-filepath = sys.argv[1]
-streams, header = pyxdf.load_xdf(filepath)
+from libs.xdf import read_xdf_metadata
+
+# Reads stream headers, footers and clock offsets only: sample chunks are skipped,
+# so this stays fast on long recordings and whole directories of them
+parser = argparse.ArgumentParser(description='Print stream metadata of XDF recordings')
+parser.add_argument('paths', nargs='+', help='XDF files, or directories to search for them')
+parser.add_argument('--metadata-only', action='store_true', help="Don't decode and print marker streams")
+args = parser.parse_args()
 
 def print_dict_tree(d, indent=0):
     """Recursively print nested dictionaries with proper indentation"""
@@ -23,39 +28,66 @@ def print_dict_tree(d, indent=0):
         else:
             print("  " * indent + f"{key}: {value}")
 
-# Print all metadata for each stream
-for i, stream in enumerate(streams):
-    print(f"\n{'='*60}")
-    print(f"STREAM {i+1}")
-    print(f"{'='*60}")
-    
-    # Convert defaultdict to regular dict for prettier printing
-    info_dict = dict(stream['info'])
-    
-    # Print all info fields
-    print("\n--- Stream Metadata ---")
-    print_dict_tree(info_dict)
-    
-    # Print data statistics
-    print(f"\n--- Data Statistics ---")
-    print(f"  Total samples: {len(stream['time_stamps'])}")
-    if len(stream['time_stamps']) > 0:
-        print(f"  First timestamp: {stream['time_stamps'][0]:.4f}")
-        print(f"  Last timestamp: {stream['time_stamps'][-1]:.4f}")
-        print(f"  Duration: {stream['time_stamps'][-1] - stream['time_stamps'][0]:.2f} seconds")
-        
-        # Calculate actual sample rate
-        if len(stream['time_stamps']) > 1:
-            actual_rate = len(stream['time_stamps']) / (stream['time_stamps'][-1] - stream['time_stamps'][0])
-            print(f"  Actual sample rate: {actual_rate:.2f} Hz")
-
-
-# Process marker stream specifically
-print("\n=== Markers ===")
-for stream in streams:
-    if stream['info']['type'][0] == 'Markers':
-        markers = stream['time_series']
-        timestamps = stream['time_stamps']
-
-        for i in range(len(timestamps)):
-            print(f"  [{timestamps[i]:10.4f}] {markers[i][0]}")
+def find_xdf_files(paths):
+    for path in paths:
+        if os.path.isdir(path):
+            for root, _, files in sorted(os.walk(path)):
+                for name in sorted(files):
+                    if name.endswith(('.xdf', '.xdfz', '.xdf.gz')):
+                        yield os.path.join(root, name)
+        else:
+            yield path
+
+
+def print_metainfo(filepath):
+    header, streams = read_xdf_metadata(filepath, with_markers=not args.metadata_only)
+
+    # Print all metadata for each stream
+    for i, stream in enumerate(streams):
+        print(f"\n{'='*60}")
+        print(f"STREAM {i+1}")
+        print(f"{'='*60}")
+
+        # Convert defaultdict to regular dict for prettier printing
+        info_dict = dict(stream['info'])
+
+        # Print all info fields
+        print("\n--- Stream Metadata ---")
+        print_dict_tree(info_dict)
+
+        # Print data statistics
+        print(f"\n--- Data Statistics ---")
+        print(f"  Total samples: {stream['n_samples']}")
+        if stream['first_timestamp'] is not None:
+            print(f"  First timestamp: {stream['first_timestamp']:.4f}")
+            print(f"  Last timestamp: {stream['last_timestamp']:.4f}")
+            print(f"  Duration: {stream['duration']:.2f} seconds")
+
+            # Calculate actual sample rate
+            if stream['effective_srate'] is not None:
+                print(f"  Actual sample rate: {stream['effective_srate']:.2f} Hz")
+
+    if args.metadata_only:
+        return
+
+    # Process marker stream specifically
+    print("\n=== Markers ===")
+    for stream in streams:
+        if stream['info']['type'][0] == 'Markers':
+            # Only string streams are decoded; numeric ones (e.g. integer event codes) are just counted
+            if 'markers' not in stream:
+                print(f"  {stream['info']['name'][0]}: {stream['n_samples']} numeric markers, not printed")
+                continue
+
+            markers = stream['markers']
+            timestamps = stream['marker_time_stamps']
+
+            for i in range(len(timestamps)):
+                print(f"  [{timestamps[i]:10.4f}] {markers[i][0]}")
+
+
+filepaths = list(find_xdf_files(args.paths))
+for filepath in filepaths:
+    if len(filepaths) > 1:
+        print(f"\n{'#'*60}\n# {filepath}\n{'#'*60}")
+    print_metainfo(filepath)
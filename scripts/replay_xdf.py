@@ -5,12 +5,12 @@ import time
 import numpy as np
 from mne_lsl.player import PlayerLSL
 
-from libs.file_formats import load_raw_xdf
+from libs.file_formats import load_recording
 
 
 xdf_file_name = sys.argv[1]
 
-raw = load_raw_xdf(xdf_file_name)
+raw = load_recording(xdf_file_name)
 with tempfile.TemporaryDirectory() as tempdir:
     temp_file_name = f'{tempdir}/temp.fif'
     raw.save(temp_file_name, overwrite=True)
@@ -9,7 +9,7 @@ import pygame
 from pylsl import StreamInfo, StreamOutlet, local_clock
 
 
-from flicker import run_flicker          # your pulse-train function
+from flicker import LONG_FLIP_MS, FrameLog, FrameScheduler, collect_garbage, enter_realtime, run_flicker  # your pulse-train function
 from glass   import draw_glass           # your Glass generator (draws onto a Surface)
 
 # ============================ Config / Dataclasses ============================
@@ -209,6 +209,17 @@ CREATE TABLE IF NOT EXISTS stimulus(
   handed TEXT,
   seed INTEGER
 );
+CREATE TABLE IF NOT EXISTS flicker_frame(
+  session_id TEXT,
+  trial_index INTEGER,
+  frame INTEGER,
+  is_on INTEGER,
+  target REAL,
+  t_before_flip REAL,
+  t_after_flip REAL,
+  sleep_overshoot REAL,
+  PRIMARY KEY (session_id, trial_index, frame)
+);
 CREATE TABLE IF NOT EXISTS trial(
   id INTEGER PRIMARY KEY AUTOINCREMENT,
   session_id TEXT,
@@ -260,6 +271,12 @@ def insert_trial(db: sqlite3.Connection, row: dict) -> int:
                         :snr_level,:snr_jitter,:seed,:resp_key,:correct,:rt_ms,:timed_out,:stim_id,:ts_onset,:ts_resp)""", row)
     return db.execute("SELECT last_insert_rowid()").fetchone()[0]
 
+def insert_flicker_frames(db: sqlite3.Connection, session_id: str, trial_index: int, frames) -> None:
+    # frames is FrameLog.data, one row per frame of the trial's flicker train
+    db.executemany("INSERT OR REPLACE INTO flicker_frame(session_id,trial_index,frame,is_on,target,"
+                   "t_before_flip,t_after_flip,sleep_overshoot) VALUES(?,?,?,?,?,?,?,?)",
+                   [(session_id, trial_index, *row) for row in frames.tolist()])
+
 # ============================ LSL helpers ====================================
 
 def make_marker_outlet(stream_name="GlassMarkers") -> Optional[StreamOutlet]:
@@ -297,7 +314,9 @@ def run_one_trial(
     angle_deg: float,              # 0.0 / 90.0 or anything 0..90
     snr_jitter: float,             # e.g., uniform(-0.03, +0.03)
     seed: int,
-    use_debug_overlay: bool=False
+    use_debug_overlay: bool=False,
+    frame_log: Optional[FrameLog]=None,
+    scheduler: Optional[FrameScheduler]=None
 ):
     W, H = screen.get_size()
     center_screen = (W//2, H//2)
@@ -340,6 +359,7 @@ def run_one_trial(
     timed_out = False
     response_enabled = False
     rt_ms = -1
+    timing = None
 
     # Draw baseline fixation
     screen.fill((0,0,0))
@@ -386,9 +406,13 @@ def run_one_trial(
             # keep fixation dot overlayed on OFF frames (optional)
             def _overlay_off(surf: pygame.Surface):
                 draw_fixation_dot(surf, center_screen)
-            run_flicker(screen, flicker_rect,
-                        frequency=task.freq_hz, target_min_refresh_rate=80.0, target_max_refresh_rate=125.0,
-                        cycles=task.cycles, report_every=10_000, overlay_off_frame=_overlay_off)
+            if frame_log is not None:
+                frame_log.reset()
+            timing = run_flicker(screen, flicker_rect,
+                                 frequency=task.freq_hz, target_min_refresh_rate=80.0, target_max_refresh_rate=125.0,
+                                 cycles=task.cycles, report_every=10_000, overlay_off_frame=_overlay_off,
+                                 frame_log=frame_log, scheduler=scheduler)
+            # The delay is timed from here: its timing summary is sent after the trial
             push_marker(outlet, "flicker_end", trial=trial_index)
             phase = Phase.DELAY
 
@@ -462,6 +486,16 @@ def run_one_trial(
         pygame.time.delay(1)  # yield
 
     # ---- After loop: save stimulus PNG & DB rows during ITI slack ----
+    if timing is not None:
+        # Timing of this trial's flicker train, in ms
+        push_marker(outlet, "flicker_timing", trial=trial_index,
+                    flip_ms_p99=timing["flip_ms"]["p99"], flip_ms_max=timing["flip_ms"]["max"],
+                    err_on_post_p50=timing["err_on_post"]["p50"], err_on_post_p99=timing["err_on_post"]["p99"],
+                    err_on_post_max=timing["err_on_post"]["max"], long_flips=timing["long_flips"])
+        print(f"trial {trial_index:03d} flicker: flip p99 {timing['flip_ms']['p99']:.2f} ms, "
+              f"ON err post p50 {timing['err_on_post']['p50']:.2f} p99 {timing['err_on_post']['p99']:.2f} "
+              f"max {timing['err_on_post']['max']:.2f} ms, spin {timing['scheduler']['spin_ms_per_frame']:.2f} ms/frame")
+
     stim_id = None
     if db is not None:
         # save PNG if requested
@@ -484,9 +518,11 @@ def run_one_trial(
                    timed_out=int(bool(timed_out)), stim_id=stim_id,
                    ts_onset=ts_onset, ts_resp=ts_resp)
         insert_trial(db, row)
+        if frame_log is not None:
+            insert_flicker_frames(db, session_id, trial_index, frame_log.data)
 
     push_marker(outlet, "trial_end", trial=trial_index, correct=bool(correct), timeout=bool(timed_out))
-    return resp_key, correct, rt_ms, timed_out
+    return resp_key, correct, rt_ms, timed_out, timing
 
 def sample_abs_jitter(min_abs: float, max_abs: float) -> float:
     """Return a signed absolute jitter in *absolute SNR units* (e.g., ±0.01..±0.03)."""
@@ -524,6 +560,11 @@ def main():
     ap.add_argument("--nofeedback", action="store_true", help="Disable feedback (Session 2 style)")
     ap.add_argument("--lsl", action="store_true", help="Enable LSL marker stream")
     ap.add_argument("--debug", action="store_true", help="Start with the debug overlay on (F1 toggles)")
+    ap.add_argument("--frame-log", action="store_true",
+                    help="Store the timing of every flicker frame in the flicker_frame table of the DB")
+    ap.add_argument("--realtime", action="store_true",
+                    help="Linux: pin to a core, ask for SCHED_FIFO (or a higher priority), lock memory and "
+                         "only run the garbage collector between trials")
     args = ap.parse_args()
 
     # Explicit incompatibility: --cond-seq cannot be combined with blinding
@@ -564,6 +605,15 @@ def main():
     task   = TaskConfig(freq_hz=args.freq, cycles=args.cycles, show_feedback=not args.nofeedback)
     stimcf = StimulusConfig()
     stimcf.snr_level = args.snr  # <-- fixed SNR from CLI
+    # Allocated once and refilled by every trial's flicker train
+    frame_log = FrameLog.for_train(task.freq_hz, 80.0, 125.0, task.cycles) if args.frame_log else None
+    # Shared by all trials, so its sleep calibration carries over from one train to the next
+    scheduler = FrameScheduler()
+    long_flips = 0
+
+    # After the outlet and the display, so their threads keep the normal scheduling
+    if args.realtime:
+        print(enter_realtime())
 
     # --- Determine block condition schedule ---
     def _resolve_blind_cond(key: str, session_num: int) -> str:
@@ -627,7 +677,7 @@ def main():
             seed = random.randrange(1<<30)
 
             trial_index = b * args.tperblock + i + 1
-            resp_key, correct, rt_ms, timed_out = run_one_trial(
+            resp_key, correct, rt_ms, timed_out, timing = run_one_trial(
                 screen, task, stimcf,
                 trial_index=trial_index,
                 block=b+1,
@@ -636,12 +686,19 @@ def main():
                 stim_out_dir=os.path.join(args.stimdir, session_id) if args.stimdir else None,
                 outlet=outlet,
                 cond=cond, angle_deg=angle, snr_jitter=snr_jitter, seed=seed,
-                use_debug_overlay=args.debug
+                use_debug_overlay=args.debug,
+                frame_log=frame_log,
+                scheduler=scheduler
             )
 
             print(f"trial {trial_index:03d} block={b+1} cond={display_cond} angle={angle:.0f} "
                   f"resp={'L' if resp_key==pygame.K_LEFT else 'R' if resp_key==pygame.K_RIGHT else '—'} "
                   f"correct={int(correct)} rt={rt_ms} timeout={int(timed_out)}")
+            if timing is not None:
+                long_flips += timing["long_flips"]
+            # ITI boundary: the only place the collector runs in real-time mode
+            if args.realtime:
+                collect_garbage()
 
             # Update per-block stats
             if timed_out:
@@ -677,6 +734,7 @@ def main():
             mean_rt_ms=mean_rt_ms,
         )
 
+    print(f"Flips over {LONG_FLIP_MS} ms around ON frames this session: {long_flips}")
     pygame.quit()
 
 if __name__ == "__main__":
@@ -0,0 +1,31 @@
+import os
+
+import numpy as np
+import pytest
+
+from libs.filters import apply_brainflow_filters
+
+# Written by `python -m scripts.check_brainflow_filters --channels 4 --seconds 20 --save-reference <path>`
+# with brainflow installed: 125 Hz data, so both the 50 and the 60 Hz band-stops are applied
+REFERENCE = os.path.join(os.path.dirname(__file__), 'data', 'brainflow_filters.npz')
+
+
+def assert_close(actual, expected):
+    peak = np.abs(expected).max()
+    np.testing.assert_allclose(actual, expected, rtol=0, atol=1e-7 * peak)
+
+
+@pytest.mark.parametrize('n_jobs', [1, 3])
+def test_matches_stored_brainflow_output(n_jobs):
+    reference = np.load(REFERENCE)
+    actual = apply_brainflow_filters(reference['data'], float(reference['sfreq']), n_jobs=n_jobs)
+    assert_close(actual, reference['expected'])
+
+
+@pytest.mark.parametrize('sfreq', [125.0, 250.0])
+def test_matches_brainflow(sfreq):
+    pytest.importorskip('brainflow')
+    from scripts.check_brainflow_filters import brainflow_filters, generated_data
+
+    data = generated_data(sfreq, 3, 30.0, seed=1)
+    assert_close(apply_brainflow_filters(data, sfreq), brainflow_filters(data, sfreq))
@@ -0,0 +1,15 @@
+import numpy as np
+
+from libs.filters import get_filter_plan
+from scripts.check_filter_plan import concatenated_raw
+
+
+def test_apply_raw_matches_mne_filters():
+    raw = concatenated_raw(250.0, 4, [30.0, 20.0, 40.0])
+    expected = raw.copy().filter(1.0, 45.0, verbose=False).notch_filter(50, notch_widths=4, verbose=False)
+    actual = get_filter_plan(250.0).apply_raw(raw.copy())
+
+    peak = np.abs(expected.get_data()).max()
+    np.testing.assert_allclose(actual.get_data(), expected.get_data(), rtol=0, atol=1e-8 * peak)
+    assert actual.info['highpass'] == expected.info['highpass'] == 1.0
+    assert actual.info['lowpass'] == expected.info['lowpass'] == 45.0
@@ -0,0 +1,40 @@
+import mne
+import numpy as np
+
+from libs.psd import sliding_welch
+
+SFREQ = 250.0
+
+
+def test_sliding_welch_transforms_every_segment_once(monkeypatch):
+    # Default alpha_report.py settings: 90 s windows every 0.5 s. Segments sit
+    # on the 125-sample shift grid, 2000 samples apart, 10 per window
+    data = np.random.default_rng(0).standard_normal((2, int(300 * SFREQ)))
+    transformed = []
+    rfft = np.fft.rfft
+
+    def counting_rfft(a, *args, **kwargs):
+        transformed.append(a.shape[-2])
+        return rfft(a, *args, **kwargs)
+
+    monkeypatch.setattr(np.fft, 'rfft', counting_rfft)
+    sliding = sliding_welch(data, SFREQ, 90.0, 0.5, fmin=1.0, fmax=45.0)
+
+    n_windows = len(sliding.times)
+    assert n_windows == (data.shape[1] - 22501) // 125 + 1
+    n_segments = (n_windows - 1) + 9 * 2000 // 125 + 1
+    assert sum(transformed) == n_segments
+    # compute_psd() on every window would transform 10 segments per window
+    assert sum(transformed) < n_windows * 10 / 5
+
+
+def test_sliding_welch_matches_compute_psd_when_shift_divides_n_fft():
+    data = np.random.default_rng(1).standard_normal((3, int(60 * SFREQ))) * 1e-5
+    raw = mne.io.RawArray(data, mne.create_info(3, SFREQ, 'eeg'), verbose=False)
+    sliding = sliding_welch(data, SFREQ, 20.0, 0.512, fmin=1.0, fmax=45.0)
+
+    for i in range(0, len(sliding.times), 13):
+        t = sliding.times[i]
+        expected = raw.copy().crop(t, t + 20.0).compute_psd(fmin=1.0, fmax=45.0, verbose=False)
+        np.testing.assert_allclose(sliding.psds[i], expected.get_data(), rtol=1e-10)
+        np.testing.assert_allclose(sliding.freqs, expected.freqs)